@@ -1,70 +1,158 @@
+import json
 import logging
 import os
+import sys
 from collections import defaultdict
 import pandas as pd
 import common
 import datetime
 from aue_rues import credentials
 
+# Number of rows of the historical archive that are pushed between two checkpoints
+BACKFILL_CHECKPOINT_ROWS = 100000
 
-def download_latest_data(truebung=False):
+
+def get_state_file() -> str:
+    curr_dir = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(curr_dir, 'data', 'rues_state.json')
+
+
+def load_state(state_file='') -> dict:
+    """
+    Returns the state of the pipeline: the Startzeitpunkt of the newest row pushed per stream ('S3' and 'Truebung')
+    as ISO string, and the number of rows of each archive file pushed by the backfill.
+    """
+    state_file = state_file or get_state_file()
+    state = {'high_water_marks': {}, 'backfill': {}}
+    if os.path.exists(state_file):
+        with open(state_file, 'r') as f:
+            state.update(json.load(f))
+    return state
+
+
+def save_state(state, state_file=''):
+    common.write_json_atomic(state_file or get_state_file(), state)
+
+
+def get_stream(truebung=False) -> str:
+    return 'Truebung' if truebung else 'S3'
+
+
+def list_latest_data(truebung=False) -> list:
     local_path = os.path.join(os.path.dirname(__file__), 'data_orig')
     if truebung:
         return common.download_ftp([], credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass,
-                                   'onlinedaten/truebung', local_path, '*_RUES_Online_Truebung.csv', list_only=False)
+                                   'onlinedaten/truebung', local_path, '*_RUES_Online_Truebung.csv', list_only=True)
     return common.download_ftp([], credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass,
-                               'onlinedaten', local_path, '*_RUES_Online_S3.csv', list_only=False)
+                               'onlinedaten', local_path, '*_RUES_Online_S3.csv', list_only=True)
 
 
-def push_data_files_old(csv_files, truebung=False):
-    for file in csv_files:
-        df = pd.read_csv(file['local_file'], sep=';')
-        common.ods_realtime_push_df(df, url=credentials.ods_push_url_truebung if truebung else credentials.ods_push_url)
+def get_file_date(file) -> datetime.date:
+    # Files are named like YYYY-MM-DD*.csv
+    return datetime.datetime.strptime(file['remote_file'][:10], "%Y-%m-%d").date()
 
 
-def push_data_files(csv_files, truebung=False):
-    # Dictionary to hold the files grouped by date
-    dfs_by_date = defaultdict(pd.DataFrame)
+def download_new_data_files(csv_files, high_water_mark=None) -> list:
+    """Downloads the files that can contain rows newer than high_water_mark and returns them."""
+    new_files = [file for file in csv_files
+                 if high_water_mark is None or get_file_date(file) >= high_water_mark.date()]
+    logging.info(f'{len(new_files)} of {len(csv_files)} files can contain rows newer than {high_water_mark}...')
+    if new_files:
+        local_path = os.path.join(os.path.dirname(__file__), 'data_orig')
+        common.download_ftp([file['remote_file'] for file in new_files], credentials.ftp_server, credentials.ftp_user,
+                            credentials.ftp_pass, new_files[0]['remote_path'], local_path, '')
+    return new_files
 
+
+def read_data_files(csv_files) -> dict:
+    """Returns one de-duplicated frame per date, sorted by Startzeitpunkt, from all files of that date."""
+    frames_by_date = defaultdict(list)
     for file in csv_files:
-        date_str = file['remote_file'][:10]  # Files are named like YYYY-MM-DD*.csv
-        date_obj = datetime.datetime.strptime(date_str, "%Y-%m-%d")
-        dfs_by_date[date_obj.date()] = pd.concat([dfs_by_date[date_obj.date()], pd.read_csv(file['local_file'], sep=';')])
+        frames_by_date[get_file_date(file)].append(pd.read_csv(file['local_file'], sep=';'))
+
+    dfs_by_date = {}
+    for date in sorted(frames_by_date):
+        # Files of the same date can overlap, rows present in several files are pushed once
+        df = pd.concat(frames_by_date[date], ignore_index=True).drop_duplicates()
+        start = pd.to_datetime(df['Startzeitpunkt'], format='%d.%m.%Y %H:%M:%S')
+        dfs_by_date[date] = df.iloc[start.argsort(kind='stable')].reset_index(drop=True)
+    return dfs_by_date
+
+
+def localize_startzeitpunkt(df) -> pd.Series:
+    """
+    Startzeitpunkt as Europe/Zurich timestamps. The rows of a date are sorted by Startzeitpunkt, so of the times that
+    are repeated when DST ends, the first one is in summer time and the repetition in winter time. A single time of
+    the repeated hour counts as summer time. Times that are skipped when DST begins are moved forward to 03:00.
+    """
+    start = pd.to_datetime(df['Startzeitpunkt'], format='%d.%m.%Y %H:%M:%S')
+    return start.dt.tz_localize('Europe/Zurich', ambiguous=~start.duplicated().to_numpy(),
+                                nonexistent='shift_forward')
+
+
+def transform_truebung(df, start) -> pd.DataFrame:
+    df = df.copy()
+    # Endezeitpunkt is Startzeitpunkt plus one hour
+    df['Startzeitpunkt'] = start.dt.strftime('%Y-%m-%d %H:%M:%S%z')
+    df['Endezeitpunkt'] = (start + datetime.timedelta(hours=1)).dt.strftime('%Y-%m-%d %H:%M:%S%z')
+    return df
 
-    for date, df in dfs_by_date.items():
-        logging.info(f'Processing files for date {date}...')
-        df = df.sort_values(by=['Startzeitpunkt']).reset_index(drop=True)
 
-        df['Startzeitpunkt'] = (pd.to_datetime(df['Startzeitpunkt'], format='%d.%m.%Y %H:%M:%S')
-                                .dt.tz_localize('Europe/Zurich', ambiguous='infer'))
-        # df['Startzeitpunkt'] plus one hour
-        df['Endezeitpunkt'] = df['Startzeitpunkt'] + datetime.timedelta(hours=1)
-        df['Startzeitpunkt'] = df['Startzeitpunkt'].dt.strftime('%Y-%m-%d %H:%M:%S%z')
-        df['Endezeitpunkt'] = df['Endezeitpunkt'].dt.strftime('%Y-%m-%d %H:%M:%S%z')
-        common.ods_realtime_push_df(df, url=credentials.ods_push_url_truebung if truebung else credentials.ods_push_url)
+def push_new_rows(dfs_by_date, state, truebung=False, state_file='') -> int:
+    """
+    Pushes the rows newer than the high-water mark of the stream, one date after the other. The high-water mark is
+    moved forward and saved after each pushed date, so an interrupted run continues with the first date not pushed.
+    Returns the number of rows pushed.
+    """
+    stream = get_stream(truebung)
+    high_water_mark = state['high_water_marks'].get(stream)
+    high_water_mark = pd.Timestamp(high_water_mark) if high_water_mark else None
+    pushed = 0
+    for date, df in dfs_by_date.items():
+        start = localize_startzeitpunkt(df)
+        is_new = start > high_water_mark if high_water_mark is not None else pd.Series(True, index=df.index)
+        logging.info(f'Processing {stream} rows for date {date}, {is_new.sum()} of {len(df)} are new...')
+        if not is_new.any():
+            continue
+        df_new = df[is_new]
+        if truebung:
+            df_new = transform_truebung(df_new, start[is_new])
+        common.ods_realtime_push_df(df_new, url=credentials.ods_push_url_truebung if truebung else credentials.ods_push_url)
+        pushed += len(df_new)
+        high_water_mark = start[is_new].max()
+        state['high_water_marks'][stream] = high_water_mark.isoformat()
+        save_state(state, state_file)
+    return pushed
 
 
 def archive_data_files(csv_files, truebung=False):
     archive_folder = 'archiv_ods'
     for file in csv_files:
         # if yesterday or older, move to archive folder
-        date_str = file['remote_file'][:10]
-        date_obj = datetime.datetime.strptime(date_str, "%Y-%m-%d")
-        if date_obj.date() < datetime.date.today():
+        if get_file_date(file) < datetime.date.today():
             from_name = f"{file['remote_path']}/{file['remote_file']}"
             to_name = f"{archive_folder}/{file['remote_file']}" if truebung else f"roh/{archive_folder}/{file['remote_file']}"
             logging.info(f'Renaming file on FTP server from {from_name} to {to_name}...')
             common.rename_ftp(from_name, to_name, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass)
 
 
-def push_older_data_files():
+def update_stream(state, truebung=False, state_file=''):
+    csv_files = list_latest_data(truebung)
+    high_water_mark = state['high_water_marks'].get(get_stream(truebung))
+    new_files = download_new_data_files(csv_files, pd.Timestamp(high_water_mark) if high_water_mark else None)
+    pushed = push_new_rows(read_data_files(new_files), state, truebung, state_file)
+    logging.info(f'Pushed {pushed} new {get_stream(truebung)} rows to ODS...')
+    archive_data_files(csv_files, truebung)
+
+
+def read_older_data_files() -> dict:
+    """Returns the corrected historical data per archive file, in the format expected by ODS."""
     data_path = os.path.join(os.path.dirname(__file__), 'data_orig')
 
     df1 = pd.read_csv(os.path.join(data_path, 'online2002_2023.csv'), sep=',')
     # Transoform Startzeitpunkt and Endezeitpunkt to the format expected by ODS
     df1['Startzeitpunkt'] = pd.to_datetime(df1['Startzeitpunkt'], format='%Y-%m-%d %H:%M:%S').dt.strftime('%d.%m.%Y %H:%M:%S')
     df1['Endezeitpunkt'] = pd.to_datetime(df1['Endezeitpunkt'], format='%Y-%m-%d %H:%M:%S').dt.strftime('%d.%m.%Y %H:%M:%S')
-    common.batched_ods_realtime_push(df1, url=credentials.ods_push_url, chunk_size=25000)
 
     df3 = pd.read_csv(os.path.join(data_path, 'Onliner_RUES_2023_1h_S3_OGD.csv'), sep=';', encoding='cp1252')
     df3 = df3.rename(
@@ -74,8 +162,25 @@ def push_older_data_files():
     df3 = df3[['Startzeitpunkt', 'Endezeitpunkt', 'RUS.W.O.S3.LF', 'RUS.W.O.S3.O2', 'RUS.W.O.S3.PH', 'RUS.W.O.S3.TE']]
     df3 = add_seconds(df3)
     df3 = df3.dropna(subset=['Startzeitpunkt', 'Endezeitpunkt'])
-    common.batched_ods_realtime_push(df3, url=credentials.ods_push_url, chunk_size=25000)
-    pass
+    return {'online2002_2023.csv': df1, 'Onliner_RUES_2023_1h_S3_OGD.csv': df3}
+
+
+def push_older_data_files(state=None, state_file='', checkpoint_rows=BACKFILL_CHECKPOINT_ROWS):
+    """
+    Pushes the historical archive in batches of checkpoint_rows rows. The number of rows pushed per file is saved after
+    each batch, so a backfill that was interrupted continues with the first batch that was not pushed completely.
+    """
+    state = state if state is not None else load_state(state_file)
+    for file_name, df in read_older_data_files().items():
+        offset = state['backfill'].get(file_name, 0)
+        if offset:
+            logging.info(f'Resuming backfill of {file_name} after {offset} of {len(df)} rows...')
+        for batch_start in range(offset, len(df), checkpoint_rows):
+            df_batch = df.iloc[batch_start:batch_start + checkpoint_rows]
+            common.batched_ods_realtime_push(df_batch, url=credentials.ods_push_url, chunk_size=25000)
+            state['backfill'][file_name] = batch_start + len(df_batch)
+            save_state(state, state_file)
+        logging.info(f'Backfill of {file_name} complete, {len(df)} rows pushed...')
 
 
 def add_seconds(df):
@@ -85,18 +190,14 @@ def add_seconds(df):
 
 
 def main():
-    # Uncomment to parse, transform and push older files (corrected etc.)
-    # push_older_data_files()
-
-    csv_files = download_latest_data()
-    push_data_files_old(csv_files)
-    archive_data_files(csv_files)
-
-    csv_files_trueb = download_latest_data(truebung=True)
-    push_data_files(csv_files_trueb, truebung=True)
-    archive_data_files(csv_files_trueb, truebung=True)
-
-    pass
+    state = load_state()
+    # Run with argument "backfill" to parse, transform and push older files (corrected etc.)
+    if len(sys.argv) > 1 and sys.argv[1] == 'backfill':
+        push_older_data_files(state)
+        return
+
+    update_stream(state)
+    update_stream(state, truebung=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+import common
+from aue_rues import etl
+
+COLUMNS = ['Startzeitpunkt', 'RUS.W.O.S3.TE']
+
+
+def write_file(tmp_path, remote_file, hours):
+    local_file = tmp_path / remote_file
+    # The second measurement of an hour repeated at the end of DST has a different value
+    pd.DataFrame([[f'{day}.10.2023 {hour:02d}:00:00', hour + 0.5 * ((day, hour) in hours[:i])]
+                  for i, (day, hour) in enumerate(hours)],
+                 columns=COLUMNS).to_csv(local_file, sep=';', index=False)
+    return {'remote_file': remote_file, 'remote_path': 'onlinedaten', 'local_file': str(local_file)}
+
+
+@pytest.fixture
+def pushed(monkeypatch):
+    frames = []
+    monkeypatch.setattr(common, 'ods_realtime_push_df', lambda df, url: frames.append((url, df)))
+    monkeypatch.setattr(common, 'batched_ods_realtime_push', lambda df, url, chunk_size: frames.append((url, df)))
+    return frames
+
+
+def test_only_rows_after_high_water_mark_are_pushed(tmp_path, pushed):
+    state_file = str(tmp_path / 'rues_state.json')
+    files = [write_file(tmp_path, '2023-10-28_0800_RUES_Online_S3.csv', [(28, h) for h in range(9)]),
+             write_file(tmp_path, '2023-10-28_1200_RUES_Online_S3.csv', [(28, h) for h in range(6, 13)]),
+             write_file(tmp_path, '2023-10-29_0300_RUES_Online_S3.csv', [(29, 0), (29, 1), (29, 2), (29, 2), (29, 3)])]
+    state = etl.load_state(state_file)
+    assert etl.push_new_rows(etl.read_data_files(files[:2]), state, state_file=state_file) == 13
+    assert pushed[0][1]['Startzeitpunkt'].tolist() == [f'28.10.2023 {h:02d}:00:00' for h in range(13)]
+
+    # The next run has a new file of the following day, with the hour that is repeated when DST ends
+    state = etl.load_state(state_file)
+    assert state['high_water_marks']['S3'] == '2023-10-28T12:00:00+02:00'
+    assert etl.push_new_rows(etl.read_data_files(files), state, state_file=state_file) == 5
+    assert list(pushed[1][1].columns) == COLUMNS
+    assert etl.load_state(state_file)['high_water_marks']['S3'] == '2023-10-29T03:00:00+01:00'
+
+
+@pytest.mark.parametrize('times, expected', [
+    # A single time of the hour repeated when DST ends
+    (['29.10.2023 01:00:00', '29.10.2023 02:00:00', '29.10.2023 03:00:00'],
+     ['2023-10-29T01:00:00+02:00', '2023-10-29T02:00:00+02:00', '2023-10-29T03:00:00+01:00']),
+    (['29.10.2023 02:30:00', '29.10.2023 02:30:00'], ['2023-10-29T02:30:00+02:00', '2023-10-29T02:30:00+01:00']),
+    # A time skipped when DST begins
+    (['26.03.2023 01:30:00', '26.03.2023 02:30:00'], ['2023-03-26T01:30:00+01:00', '2023-03-26T03:00:00+02:00']),
+])
+def test_startzeitpunkt_around_dst_changes(times, expected):
+    start = etl.localize_startzeitpunkt(pd.DataFrame({'Startzeitpunkt': times}))
+    assert [t.isoformat() for t in start] == expected
+
+
+def test_truebung_rows_get_iso_timestamps(tmp_path, pushed):
+    files = [write_file(tmp_path, '2023-10-28_0200_RUES_Online_Truebung.csv', [(28, 0), (28, 1)])]
+    etl.push_new_rows(etl.read_data_files(files), etl.load_state(''), truebung=True,
+                      state_file=str(tmp_path / 'rues_state.json'))
+    url, df = pushed[0]
+    assert url == etl.credentials.ods_push_url_truebung
+    assert df['Endezeitpunkt'].tolist() == ['2023-10-28 01:00:00+0200', '2023-10-28 02:00:00+0200']
+
+
+def test_backfill_resumes_after_last_checkpoint(tmp_path, pushed, monkeypatch):
+    archive = {'online2002_2023.csv': pd.DataFrame({'Startzeitpunkt': range(10)})}
+    monkeypatch.setattr(etl, 'read_older_data_files', lambda: archive)
+    state_file = str(tmp_path / 'rues_state.json')
+    etl.save_state({'high_water_marks': {}, 'backfill': {'online2002_2023.csv': 4}}, state_file)
+    etl.push_older_data_files(state_file=state_file, checkpoint_rows=3)
+    assert [df['Startzeitpunkt'].tolist() for url, df in pushed] == [[4, 5, 6], [7, 8, 9]]
+    assert etl.load_state(state_file)['backfill'] == {'online2002_2023.csv': 10}
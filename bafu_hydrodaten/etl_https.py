@@ -1,4 +1,6 @@
+import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import urllib3
 import os
@@ -6,28 +8,54 @@ import pandas as pd
 import common
 from common import retry
 from requests.auth import HTTPBasicAuth
-from functools import reduce
 from bafu_hydrodaten import credentials
 
+# Maximum number of rows per request to the ODS realtime API
+PUSH_CHUNK_SIZE = 1000
+
+
+def get_state_file(river_name) -> str:
+    return os.path.join(credentials.path, f'bafu_hydrodaten/data/{river_name}/realtime_state.json')
+
+
+def load_high_water_mark(river_name):
+    """Returns the timestamp of the newest row pushed to ODS for the river, or None if nothing was pushed yet."""
+    state_file = get_state_file(river_name)
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'r') as f:
+        return pd.Timestamp(json.load(f)['high_water_mark'])
+
+
+def save_high_water_mark(river_name, timestamp):
+    common.write_json_atomic(get_state_file(river_name), {'high_water_mark': timestamp.isoformat()})
+
+
+def align_variables(dfs) -> pd.DataFrame:
+    """Aligns the variables of all files on their Time column with a single concat, like chained outer merges."""
+    frames = [df.drop_duplicates(subset=['Time'], keep='last').set_index('Time') for df in dfs]
+    return pd.concat(frames, axis=1, join='outer', sort=True).rename_axis('Time').reset_index()
+
 
 @retry(common.http_errors_to_handle, tries=5, delay=60, backoff=2)
 def process_river(river_files, river_name, river_id, variable_names, push_url):
-    print('Loading data into data frames...')
+    print(f'{river_name}: Loading data into data frames...')
     dfs = []
     for file in river_files:
         response = common.requests_get(f'{credentials.https_url}/{file}',
                                        auth=HTTPBasicAuth(credentials.https_user, credentials.https_pass), stream=True)
-        df = pd.read_csv(response.raw, parse_dates=True, infer_datetime_format=True)
+        df = pd.read_csv(response.raw)
         dfs.append(df)
-    print(f'Merging data frames...')
-    all_df = reduce(lambda left, right: pd.merge(left, right, on=['Time'], how='outer'), dfs)
+    print(f'{river_name}: Merging data frames...')
+    all_df = align_variables(dfs)
     all_filename = f"{os.path.join(credentials.path, 'bafu_hydrodaten/data/')}{river_name}/{river_name}_hydrodata_{datetime.today().strftime('%Y-%m-%d')}.csv"
     all_df.to_csv(all_filename, index=False)
     ftp_dir = f'{credentials.ftp_dir_all}/{river_name}'
     common.upload_ftp(all_filename, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass, ftp_dir)
-    print('Processing data...')
+    print(f'{river_name}: Processing data...')
     merged_df = all_df.copy(deep=True)
-    merged_df['timestamp'] = pd.to_datetime(merged_df.Time, infer_datetime_format=True)
+    # Parsed as UTC first, since the offset of Time changes when DST begins or ends
+    merged_df['timestamp'] = pd.to_datetime(merged_df.Time, utc=True).dt.tz_convert('Europe/Zurich')
     # timestamp is a text column used tof pushing into ODS realtime API
     merged_df['timestamp_text'] = merged_df.timestamp.dt.strftime('%Y-%m-%dT%H:%M:%S%z')
     merged_df['datum'] = merged_df.timestamp.dt.strftime('%d.%m.%Y')
@@ -50,21 +78,20 @@ def process_river(river_files, river_name, river_id, variable_names, push_url):
     merged_df = merged_df.dropna(subset=['pegel'], how='all')
     local_path = os.path.join(credentials.path, f'bafu_hydrodaten/data/{river_name}')
     merged_filename = os.path.join(local_path, f'{river_id}_pegel_abfluss_{datetime.today().strftime("%Y-%m-%d")}.csv')
-    print(f'Exporting data to {merged_filename}...')
+    print(f'{river_name}: Exporting data to {merged_filename}...')
     merged_df.to_csv(merged_filename, columns=columns_to_export, index=False)
     ftp_remote_dir = credentials.ftp_remote_dir.replace('river_id', river_id)
     common.upload_ftp(merged_filename, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass,
                       ftp_remote_dir)
     urllib3.disable_warnings()
-    # print(f'Retrieving latest record from ODS...')
-    # r = common.requests_get(url='https://data.bs.ch/api/records/1.0/search/?dataset=100089&q=&rows=1&sort=timestamp', verify=False)
-    # r.raise_for_status()
-    # latest_ods_value = r.json()['records'][0]['fields']['timestamp']
-    # print(f'Filtering data after {latest_ods_value} for submission to ODS via realtime API...')
-    # realtime_df = merged_df[merged_df['timestamp'] > latest_ods_value]
-    realtime_df = merged_df
+    high_water_mark = load_high_water_mark(river_name)
+    if high_water_mark is None:
+        realtime_df = merged_df
+    else:
+        print(f'{river_name}: Filtering data after {high_water_mark} for submission to ODS via realtime API...')
+        realtime_df = merged_df[merged_df.timestamp > high_water_mark]
     if len(realtime_df) == 0:
-        print(f'No rows to push to ODS... ')
+        print(f'{river_name}: No rows to push to ODS... ')
     else:
         # Realtime API bootstrap data:
         # {
@@ -77,29 +104,44 @@ def process_river(river_files, river_name, river_id, variable_names, push_url):
         # only keep columns that need to be pushed, and rename if necessary.
         realtime_df = realtime_df[columns_to_push]
         realtime_df = realtime_df.rename(columns={'timestamp_text': 'timestamp'})
+        print(f'{river_name}: Pushing {realtime_df.timestamp.count()} rows to ODS realtime API...')
+        common.batched_ods_realtime_push(realtime_df, url=push_url, chunk_size=PUSH_CHUNK_SIZE)
+        # Values of a variable may arrive later than the others. Rows from the first one missing a value on are pushed
+        # again in the next run, so the mark only advances up to the last row before it
+        timestamps = merged_df.timestamp[realtime_df.index]
+        incomplete = realtime_df.isna().any(axis=1)
+        if incomplete.any():
+            timestamps = timestamps[timestamps < timestamps[incomplete].min()]
+        if len(timestamps) > 0:
+            save_high_water_mark(river_name, timestamps.max())
+
 
-        payload = realtime_df.to_json(orient="records")
-        print(f'Pushing {realtime_df.timestamp.count()} rows to ODS realtime API...')
-        # print(f'Pushing the following data to ODS: {json.dumps(json.loads(payload), indent=4)}')
-        # use data=payload here because payload is a string. If it was an object, we'd have to use json=payload.
-        r = common.requests_post(url=push_url, data=payload, verify=False)
-        r.raise_for_status()
+def get_rivers() -> list:
+    return [
+        dict(river_files=credentials.rhein_files, river_name='Rhein', river_id='2289',
+             variable_names={'abfluss': 'BAFU_2289_AbflussRadar', 'pegel': 'BAFU_2289_PegelRadar'},
+             push_url=credentials.rhein_ods_live_push_api_url),
+        dict(river_files=credentials.birs_files, river_name='Birs', river_id='2106',
+             variable_names={'abfluss': 'BAFU_2106_AbflussRadar', 'pegel': 'BAFU_2106_PegelRadar',
+                             'temperatur': 'BAFU_2106_Wassertemperatur'},
+             push_url=credentials.birs_ods_live_push_api_url),
+        dict(river_files=credentials.wiese_files, river_name='Wiese', river_id='2199',
+             variable_names={'abfluss': 'BAFU_2199_AbflussRadarSchacht', 'pegel': 'BAFU_2199_PegelRadarSchacht'},
+             push_url=credentials.wiese_ods_live_push_api_url),
+        dict(river_files=credentials.rhein_klingenthal_files, river_name='Rhein_Klingenthal', river_id='2615',
+             variable_names={'pegel': 'BAFU_2615_PegelPneumatik'},
+             push_url=credentials.rhein_klingenthal_ods_live_push_api_url),
+    ]
 
 
 def main():
-    process_river(river_files=credentials.rhein_files, river_name='Rhein', river_id='2289',
-                  variable_names={'abfluss': 'BAFU_2289_AbflussRadar', 'pegel': 'BAFU_2289_PegelRadar'},
-                  push_url=credentials.rhein_ods_live_push_api_url)
-    process_river(river_files=credentials.birs_files, river_name='Birs', river_id='2106',
-                  variable_names={'abfluss': 'BAFU_2106_AbflussRadar', 'pegel': 'BAFU_2106_PegelRadar',
-                                  'temperatur': 'BAFU_2106_Wassertemperatur'},
-                  push_url=credentials.birs_ods_live_push_api_url)
-    process_river(river_files=credentials.wiese_files, river_name='Wiese', river_id='2199',
-                  variable_names={'abfluss': 'BAFU_2199_AbflussRadarSchacht', 'pegel': 'BAFU_2199_PegelRadarSchacht'},
-                  push_url=credentials.wiese_ods_live_push_api_url)
-    process_river(river_files=credentials.rhein_klingenthal_files, river_name='Rhein_Klingenthal', river_id='2615',
-                  variable_names={'pegel': 'BAFU_2615_PegelPneumatik'},
-                  push_url=credentials.rhein_klingenthal_ods_live_push_api_url)
+    rivers = get_rivers()
+    # Rivers are independent of each other, a failing river does not stop the others
+    with ThreadPoolExecutor(max_workers=len(rivers)) as executor:
+        futures = [executor.submit(process_river, **river) for river in rivers]
+    errors = [f.exception() for f in futures if f.exception() is not None]
+    if errors:
+        raise errors[0]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+import io
+import pandas as pd
+import pytest
+import common
+from bafu_hydrodaten import etl_https
+
+TIMES = ['2023-10-29T02:50:00+02:00', '2023-10-29T02:55:00+02:00', '2023-10-29T02:00:00+01:00']
+
+
+class Response:
+    def __init__(self, text):
+        self.raw = io.BytesIO(text.encode('utf-8'))
+
+
+@pytest.fixture
+def hydrodaten(tmp_path, monkeypatch):
+    monkeypatch.setattr(etl_https.credentials, 'path', str(tmp_path))
+    (tmp_path / 'bafu_hydrodaten' / 'data' / 'Birs').mkdir(parents=True)
+    files = {'abfluss.csv': {'Time': TIMES[:2], 'BAFU_2106_AbflussRadar': [10.5, 10.6]},
+             'pegel.csv': {'Time': TIMES, 'BAFU_2106_PegelRadar': [260.1, 260.2, 260.3]}}
+    pushed = []
+    monkeypatch.setattr(common, 'requests_get',
+                        lambda url, **kwargs: Response(pd.DataFrame(files[url.split('/')[-1]]).to_csv(index=False)))
+    monkeypatch.setattr(common, 'upload_ftp', lambda *args: None)
+    monkeypatch.setattr(common, 'batched_ods_realtime_push', lambda df, url, chunk_size: pushed.append(df))
+    return files, pushed
+
+
+def process_birs(files=('abfluss.csv', 'pegel.csv')):
+    variable_names = {'abfluss': 'BAFU_2106_AbflussRadar', 'pegel': 'BAFU_2106_PegelRadar'}
+    if 'temperatur.csv' in files:
+        variable_names['temperatur'] = 'BAFU_2106_Wassertemperatur'
+    etl_https.process_river(river_files=list(files), river_name='Birs', river_id='2106',
+                            variable_names=variable_names, push_url='https://ods/push/?pushkey=a')
+
+
+def test_align_variables_matches_outer_merge():
+    left = pd.DataFrame({'Time': TIMES[1:], 'a': [1, 2]})
+    right = pd.DataFrame({'Time': TIMES[:2], 'b': [3, 4]})
+    expected = pd.merge(left, right, on=['Time'], how='outer')
+    pd.testing.assert_frame_equal(etl_https.align_variables([left, right]), expected)
+
+
+def test_only_rows_after_high_water_mark_are_pushed(hydrodaten):
+    files, pushed = hydrodaten
+    process_birs()
+    # The row without abfluss is not pushed
+    assert pushed[0]['timestamp'].tolist() == ['2023-10-29T02:50:00+0200', '2023-10-29T02:55:00+0200']
+    assert etl_https.load_high_water_mark('Birs') == pd.Timestamp('2023-10-29T02:55:00+02:00')
+
+    files['abfluss.csv'] = {'Time': TIMES, 'BAFU_2106_AbflussRadar': [10.5, 10.6, 10.7]}
+    process_birs()
+    assert pushed[1].to_dict('records') == [{'timestamp': '2023-10-29T02:00:00+0100', 'pegel': 260.3, 'abfluss': 10.7}]
+
+    process_birs()
+    assert len(pushed) == 2
+
+
+def test_rows_with_missing_values_are_pushed_again(hydrodaten):
+    files, pushed = hydrodaten
+    files['temperatur.csv'] = {'Time': TIMES[:1], 'BAFU_2106_Wassertemperatur': [12.1]}
+    process_birs(files=('abfluss.csv', 'pegel.csv', 'temperatur.csv'))
+    assert len(pushed[0]) == 2
+    assert etl_https.load_high_water_mark('Birs') == pd.Timestamp('2023-10-29T02:50:00+02:00')
+
+    # The temperature of 02:55 arrives later
+    files['temperatur.csv'] = {'Time': TIMES[:2], 'BAFU_2106_Wassertemperatur': [12.1, 12.2]}
+    process_birs(files=('abfluss.csv', 'pegel.csv', 'temperatur.csv'))
+    assert pushed[1].to_dict('records') == [{'timestamp': '2023-10-29T02:55:00+0200', 'pegel': 260.2,
+                                             'abfluss': 10.6, 'temperatur': 12.2}]
+    assert etl_https.load_high_water_mark('Birs') == pd.Timestamp('2023-10-29T02:55:00+02:00')
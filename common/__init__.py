@@ -1,4 +1,6 @@
 import io
+import json
+import pathlib
 import requests
 import os
 import ftplib
@@ -10,11 +12,15 @@ import fnmatch
 import logging
 import dateutil
 import smtplib
-from more_itertools import chunked
+from concurrent.futures import ThreadPoolExecutor
 
 from common import credentials
 from common import change_tracking
+from common import ftp_pool
+from common import http_session
+from common import ods_realtime
 from common.retry import retry
+from common.atomic_file import atomic_write, write_json_atomic
 import ods_publish.etl_id as odsp
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
@@ -30,41 +36,69 @@ except ImportError:
 
 weekdays_german = ['Montag', 'Dienstag', 'Mittwoch', 'Donnerstag', 'Freitag', 'Samstag', 'Sonntag']
 http_errors_to_handle = ConnectionResetError, urllib3.exceptions.MaxRetryError, requests.exceptions.ProxyError, requests.exceptions.HTTPError, ssl.SSLCertVerificationError
-ftp_errors_to_handle = ftplib.error_temp, ftplib.error_perm, BrokenPipeError, ConnectionResetError, ConnectionRefusedError, EOFError, FileNotFoundError
+ftp_errors_to_handle = ftplib.error_temp, ftplib.error_perm, BrokenPipeError, ConnectionResetError, ConnectionRefusedError, EOFError
 
 
-@retry(http_errors_to_handle, tries=6, delay=5, backoff=1)
-def requests_get(*args, **kwargs):
-    r = requests.get(*args, proxies=credentials.proxies, **kwargs)
+class HttpNotFoundError(requests.exceptions.RequestException):
+    """Raised by the requests_* functions if the server answers with 404. Not retried, as it is not a temporary error."""
+
+
+def raise_for_status(r):
+    if r.status_code == 404:
+        raise HttpNotFoundError(f'404 Client Error: Not Found for url: {r.url}', response=r)
     r.raise_for_status()
+
+
+@retry(http_errors_to_handle, tries=6, delay=5, backoff=1)
+def requests_get(*args, cache=False, **kwargs):
+    # All requests share one pooled session, so connections (and proxy tunnels) are reused.
+    # With cache=True, the response is kept on disk and only transferred again if it changed, see common.http_session.
+    kwargs.setdefault('proxies', credentials.proxies)
+    if cache:
+        r = http_session.cached_get(*args, **kwargs)
+    else:
+        r = http_session.get_session().get(*args, **kwargs)
+    raise_for_status(r)
     return r
 
 
+@retry(http_errors_to_handle, tries=6, delay=5, backoff=1)
+def requests_download(url, file_name, **kwargs) -> bool:
+    # Streams the response to file_name and only transfers it if it changed since the last download,
+    # see common.http_session.download_file. Returns True if the file was downloaded.
+    kwargs.setdefault('proxies', credentials.proxies)
+    return http_session.download_file(url, file_name, **kwargs)
+
+
 @retry(http_errors_to_handle, tries=6, delay=5, backoff=1)
 def requests_post(*args, **kwargs):
-    r = requests.post(*args, proxies=credentials.proxies, **kwargs)
-    r.raise_for_status()
+    kwargs.setdefault('proxies', credentials.proxies)
+    r = http_session.get_session().post(*args, **kwargs)
+    raise_for_status(r)
     return r
 
 
 @retry(http_errors_to_handle, tries=6, delay=5, backoff=1)
 def requests_patch(*args, **kwargs):
-    r = requests.patch(*args, proxies=credentials.proxies, **kwargs)
-    r.raise_for_status()
+    kwargs.setdefault('proxies', credentials.proxies)
+    r = http_session.get_session().patch(*args, **kwargs)
+    raise_for_status(r)
     return r
 
 
 @retry(http_errors_to_handle, tries=6, delay=5, backoff=1)
 def requests_put(*args, **kwargs):
-    r = requests.put(*args, proxies=credentials.proxies, **kwargs)
-    r.raise_for_status()
+    kwargs.setdefault('proxies', credentials.proxies)
+    r = http_session.get_session().put(*args, **kwargs)
+    raise_for_status(r)
     return r
 
 
 @retry(http_errors_to_handle, tries=6, delay=5, backoff=1)
 def requests_delete(*args, **kwargs):
-    r = requests.delete(*args, proxies=credentials.proxies, **kwargs)
-    r.raise_for_status()
+    kwargs.setdefault('proxies', credentials.proxies)
+    r = http_session.get_session().delete(*args, **kwargs)
+    raise_for_status(r)
     return r
 
 
@@ -73,28 +107,87 @@ def requests_delete(*args, **kwargs):
 @retry(ftp_errors_to_handle, tries=6, delay=10, backoff=1)
 def upload_ftp(filename, server, user, password, remote_path):
     logging.info("Uploading " + filename + " to FTP server directory " + remote_path + '...')
-    # change to desired directory first
-    curr_dir = os.getcwd()
-    rel_path, filename_no_path = os.path.split(filename)
-    if rel_path != '':
-        os.chdir(rel_path)
-    ftp = ftplib.FTP(server)
-    ftp.login(user, password)
-    ftp.cwd(remote_path)
-    with open(filename_no_path, 'rb') as f:
-        ftp.storbinary('STOR %s' % filename_no_path, f)
-    ftp.quit()
-    os.chdir(curr_dir)
+    with ftp_pool.session(server, user, password) as ftp:
+        _store_ftp(ftp, filename, remote_path)
     return
 
 
+def _store_ftp(ftp, filename, remote_path):
+    ftp.cwd(remote_path)
+    with open(filename, 'rb') as f:
+        ftp.storbinary('STOR %s' % os.path.basename(filename), f)
+
+
+def upload_ftp_many(files: list, server: str, user: str, password: str, remote_dir_map, workers=4, tries=6, delay=10) -> list:
+    """
+    Uploads a list of files to an FTP server using up to `workers` parallel connections from common.ftp_pool.
+
+    Missing remote directories are created once before uploading. Files whose upload fails with one of
+    ftp_errors_to_handle are retried (only those) up to `tries` times with `delay` seconds in between.
+
+    Args:
+        files (list): Local file paths to upload.
+        server (str): The FTP server address.
+        user (str): The FTP user name.
+        password (str): The FTP password.
+        remote_dir_map (str or dict): Remote directory for all files, or a dict mapping each local file path to its remote directory.
+        workers (int): Maximum number of parallel FTP connections.
+        tries (int): Number of times to try uploading each file before giving up.
+        delay (int): Seconds to wait before retrying the failed files.
+
+    Returns:
+        list: One dict per file with the keys filename, remote_path, ok, tries, seconds and error.
+    """
+    if isinstance(remote_dir_map, str):
+        remote_dir_map = {filename: remote_dir_map for filename in files}
+    logging.info(f'Uploading {len(files)} files to FTP server {server} using {workers} parallel connections...')
+    results = {filename: {'filename': filename, 'remote_path': remote_dir_map[filename], 'ok': False, 'tries': 0,
+                          'seconds': 0.0, 'error': None} for filename in files}
+    ensure_ftp_dirs(server, user, password, {remote_dir_map[filename] for filename in files})
+
+    def upload(filename):
+        start = time.perf_counter()
+        try:
+            with ftp_pool.session(server, user, password) as ftp:
+                _store_ftp(ftp, filename, remote_dir_map[filename])
+            return None
+        except ftp_errors_to_handle as e:
+            return e
+        finally:
+            results[filename]['tries'] += 1
+            results[filename]['seconds'] += time.perf_counter() - start
+
+    pending = list(files)
+    for i in range(tries):
+        if i > 0:
+            logging.info(f'{len(pending)} uploads failed, retrying them in {delay} seconds...')
+            time.sleep(delay)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            errors = dict(zip(pending, executor.map(upload, pending)))
+        for filename, error in errors.items():
+            results[filename]['ok'] = error is None
+            results[filename]['error'] = error
+        pending = [filename for filename, error in errors.items() if error is not None]
+        if not pending:
+            break
+    logging.info(f'Uploaded {len(files) - len(pending)} of {len(files)} files, FTP connection pool stats: {ftp_pool.get_stats()}')
+    if pending:
+        logging.error(f'Upload to FTP failed for files {pending}...')
+        raise results[pending[0]]['error']
+    return list(results.values())
+
+
 # todo: Refactor this into two methods, one for listing only, one for file downloading - this is a mess
 # Download files from FTP server
 # Retry with some delay in between if any explicitly defined error is raised
 @retry(ftp_errors_to_handle, tries=6, delay=10, backoff=1)
 def download_ftp(files: list, server: str, user: str, password: str, remote_path: str, local_path: str, pattern: str, list_only=False) -> list:
     logging.info(f'Connecting to FTP Server "{server}" using user "{user}" in path "{remote_path}" to download file(s) "{files}" or pattern "{pattern}" to local path "{local_path}"...')
-    ftp = ftplib.FTP(server, user, password)
+    with ftp_pool.session(server, user, password) as ftp:
+        return _download_ftp(ftp, files, remote_path, local_path, pattern, list_only)
+
+
+def _download_ftp(ftp, files, remote_path, local_path, pattern, list_only):
     ftp.cwd(remote_path)
     remote_files = []
     extended_list = False
@@ -121,23 +214,144 @@ def download_ftp(files: list, server: str, user: str, password: str, remote_path
             logging.info(f'FTP downloading file {local_file_name}...')
             with open(local_file_name, 'wb') as f:
                 ftp.retrbinary(f"RETR {remote_file_name}", f.write)
-    ftp.quit()
     return files
 
 
 @retry(ftp_errors_to_handle, tries=6, delay=2, backoff=1)
 def ensure_ftp_dir(server, user, password, folder):
     logging.info(f'Connecting to FTP server {server} to make sure folder {folder} exists...')
-    ftp = ftplib.FTP(server, user, password)
-    try:
-        ftp.mkd(folder)
-    except ftplib.all_errors as e:
-        if str(e).split(None, 1)[1] == "Can't create directory: File exists":
-            logging.info(f'Folder (or file with same name) exists already, doing nothing. ')
-        else:
-            raise e
-    finally:
-        ftp.quit()
+    with ftp_pool.session(server, user, password) as ftp:
+        try:
+            ftp.mkd(folder)
+        except ftplib.all_errors as e:
+            if str(e).split(None, 1)[1] == "Can't create directory: File exists":
+                logging.info(f'Folder (or file with same name) exists already, doing nothing. ')
+            else:
+                raise e
+
+
+def sync_files_to_ftp(files: list, server: str, user: str, password: str, remote_dir_map, workers=4) -> dict:
+    """
+    Uploads only those files that are new or have changed since they were last uploaded to the same remote directory.
+
+    For each remote directory a manifest (size, modification time and blake2b hash of every uploaded file)
+    is kept in the change tracking folder. A file is only hashed if its size or modification time differ from the manifest.
+    The changed files are uploaded using upload_ftp_many, then the manifest is replaced atomically.
+
+    Args:
+        files (list): Local file paths to upload.
+        server (str): The FTP server address.
+        user (str): The FTP user name.
+        password (str): The FTP password.
+        remote_dir_map (str or dict): Remote directory for all files, or a dict mapping each local file path to its remote directory.
+        workers (int): Maximum number of parallel FTP connections.
+
+    Returns:
+        dict: Lists of the local file paths that were 'uploaded' and 'skipped'.
+    """
+    if isinstance(remote_dir_map, str):
+        remote_dir_map = {filename: remote_dir_map for filename in files}
+    manifests = {remote_dir: _read_ftp_manifest(server, user, remote_dir) for remote_dir in set(remote_dir_map[f] for f in files)}
+    new_entries = {}
+    to_upload = []
+    for filename in files:
+        old_entry = manifests[remote_dir_map[filename]].get(os.path.basename(filename))
+        new_entries[filename] = _ftp_manifest_entry(filename, old_entry)
+        if old_entry is None or (old_entry['size'], old_entry['hash']) != (new_entries[filename]['size'], new_entries[filename]['hash']):
+            to_upload.append(filename)
+    skipped = [filename for filename in files if filename not in to_upload]
+    logging.info(f'{len(to_upload)} of {len(files)} files are new or changed and have to be uploaded to FTP server {server}...')
+    if to_upload:
+        upload_ftp_many(to_upload, server, user, password, remote_dir_map, workers=workers)
+    for filename, entry in new_entries.items():
+        manifests[remote_dir_map[filename]][os.path.basename(filename)] = entry
+    for remote_dir, manifest in manifests.items():
+        _write_ftp_manifest(server, user, remote_dir, manifest)
+    return {'uploaded': to_upload, 'skipped': skipped}
+
+
+def sync_dir_to_ftp(local_dir: str, server: str, user: str, password: str, remote_dir: str, pattern='*',
+                    delete_orphans=False, workers=4) -> dict:
+    """
+    Mirrors the files in local_dir matching pattern into remote_dir on the FTP server, uploading only new or changed files.
+
+    See sync_files_to_ftp. If delete_orphans is True, files that were uploaded by an earlier sync of the same
+    remote directory but do not exist locally anymore are deleted from the FTP server.
+
+    Returns:
+        dict: Lists of the local file paths that were 'uploaded' and 'skipped', and of the remote file names 'deleted'.
+    """
+    files = sorted(os.path.join(local_dir, f) for f in fnmatch.filter(os.listdir(local_dir), pattern)
+                   if os.path.isfile(os.path.join(local_dir, f)))
+    result = sync_files_to_ftp(files, server, user, password, remote_dir, workers=workers)
+    result['deleted'] = []
+    if delete_orphans:
+        manifest = _read_ftp_manifest(server, user, remote_dir)
+        local_names = {os.path.basename(f) for f in files}
+        orphans = [name for name in manifest if name not in local_names and fnmatch.fnmatch(name, pattern)]
+        if orphans:
+            delete_ftp_files(orphans, server, user, password, remote_dir)
+            for name in orphans:
+                del manifest[name]
+            _write_ftp_manifest(server, user, remote_dir, manifest)
+        result['deleted'] = orphans
+    return result
+
+
+@retry(ftp_errors_to_handle, tries=6, delay=10, backoff=1)
+def delete_ftp_files(files: list, server, user, password, remote_path):
+    logging.info(f'Deleting {len(files)} files in FTP server directory {remote_path}...')
+    with ftp_pool.session(server, user, password) as ftp:
+        ftp.cwd(remote_path)
+        for remote_file in files:
+            try:
+                ftp.delete(remote_file)
+            except ftplib.error_perm as e:
+                logging.info(f'Could not delete {remote_file}, probably it does not exist anymore: {e}')
+
+
+def _get_ftp_manifest_file(server, user, remote_dir) -> str:
+    return change_tracking.get_check_file(f'ftp://{user}@{server}/{remote_dir}', change_tracking.get_check_file_dir(),
+                                          extension='json')
+
+
+def _read_ftp_manifest(server, user, remote_dir) -> dict:
+    manifest_file = _get_ftp_manifest_file(server, user, remote_dir)
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+def _write_ftp_manifest(server, user, remote_dir, manifest):
+    write_json_atomic(_get_ftp_manifest_file(server, user, remote_dir), manifest)
+
+
+def _ftp_manifest_entry(filename, old_entry=None) -> dict:
+    stat = os.stat(filename)
+    if old_entry is not None and old_entry.get('local_file') == filename \
+            and (old_entry['size'], old_entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+        return old_entry
+    return {'local_file': filename, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'hash': change_tracking.file_digest(filename)}
+
+
+@retry(ftp_errors_to_handle, tries=6, delay=2, backoff=1)
+def ensure_ftp_dirs(server, user, password, folders):
+    """Creates all given (possibly nested) folders on the FTP server that do not exist yet, using one connection."""
+    logging.info(f'Connecting to FTP server {server} to make sure folders {sorted(folders)} exist...')
+    with ftp_pool.session(server, user, password) as ftp:
+        for folder in folders:
+            ftp.cwd(ftp.home_dir)
+            if folder.startswith('/'):
+                ftp.cwd('/')
+            for part in [p for p in folder.split('/') if p]:
+                try:
+                    ftp.cwd(part)
+                except ftplib.error_perm:
+                    logging.info(f'Creating folder {part} in {ftp.pwd()}...')
+                    ftp.mkd(part)
+                    ftp.cwd(part)
 
 
 # Tell Opendatasoft to (re-)publish datasets
@@ -201,9 +415,12 @@ def get_dataset_status(dataset_uid, creds):
 def raise_response_error(response):
     logging.info(f'Received http error {response.status_code}:')
     logging.info(f'Error message: {response.text}')
-    r_json = response.json()
-    error_key = r_json['error_key']
-    status_code = r_json['status_code']
+    try:
+        r_json = response.json()
+    except ValueError:
+        r_json = {}
+    error_key = r_json.get('error_key')
+    status_code = r_json.get('status_code')
     if status_code == 400 and error_key == 'InvalidDatasetStatusPreconditionException':
         logging.info(f'ODS returned status 400 and error_key "{error_key}", we raise the error now.')
     response.raise_for_status()
@@ -217,6 +434,38 @@ def get_ods_uid_by_id(ods_id, creds):
     return response.json()['results'][0]['uid']
 
 
+def get_ods_uids_by_ids(ods_ids, creds, chunk_size=100) -> dict:
+    """Returns a dict {ods id: ods uid}, retrieving the uids of up to chunk_size datasets with a single call."""
+    uids = {}
+    ods_ids = list(dict.fromkeys(ods_ids))
+    for i in range(0, len(ods_ids), chunk_size):
+        ids = ods_ids[i:i + chunk_size]
+        logging.info(f'Retrieving ods uids for ods ids {ids}...')
+        params = {'where': ' OR '.join(f'dataset_id="{ods_id}"' for ods_id in ids), 'limit': len(ids)}
+        response = requests_get(url=f'https://data.bs.ch/api/automation/v1.0/datasets/', params=params,
+                                headers={'Authorization': f'apikey {creds.api_key}'})
+        response.raise_for_status()
+        uids.update({dataset['dataset_id']: dataset['uid'] for dataset in response.json()['results']})
+    return uids
+
+
+def get_ods_catalogue_uids(creds, page_size=100) -> dict:
+    """Returns a dict {ods id: ods uid} of all datasets in the catalogue, listing page_size datasets per call."""
+    uids = {}
+    offset = 0
+    while True:
+        logging.info(f'Retrieving ods uids of datasets {offset} to {offset + page_size - 1} in the catalogue...')
+        response = requests_get(url=f'https://data.bs.ch/api/automation/v1.0/datasets/',
+                                params={'limit': page_size, 'offset': offset},
+                                headers={'Authorization': f'apikey {creds.api_key}'})
+        response.raise_for_status()
+        results = response.json()['results']
+        uids.update({dataset['dataset_id']: dataset['uid'] for dataset in results})
+        if len(results) < page_size:
+            return uids
+        offset += page_size
+
+
 @retry(http_errors_to_handle, tries=6, delay=5, backoff=1)
 def pandas_read_csv(*args, **kwargs):
     return pd.read_csv(*args, **kwargs)
@@ -239,10 +488,11 @@ def is_embargo_over(data_file_path, embargo_file_path=None) -> bool:
 
 
 def ods_realtime_push_complete_update(df_old, df_new, id_columns, url, columns_to_compare=None, push_key=''):
-    ods_realtime_push_new_entries(df_old, df_new, id_columns, url, push_key)
+    diff = change_tracking.diff_frames(df_old, df_new, id_columns, columns_to_compare)
+    batched_ods_realtime_push(diff.new_rows.reset_index(drop=True), url, push_key)
     # TODO: Find out why this does not work as expected (405 Method Not Allowed)
-    # ods_realtime_push_delete_entries(df_old, df_new, id_columns, url, push_key)
-    ods_realtime_push_modified_entries(df_old, df_new, id_columns, url, columns_to_compare, push_key)
+    # batched_ods_realtime_push(diff.deleted_rows.reset_index(drop=True), url, push_key, delete=True)
+    batched_ods_realtime_push(diff.updated_rows.reset_index(drop=True), url, push_key)
 
 
 def ods_realtime_push_new_entries(df_old, df_new, id_columns, url, push_key=''):
@@ -263,13 +513,10 @@ def ods_realtime_push_modified_entries(df_old, df_new, id_columns, url, columns_
     batched_ods_realtime_push(updated_rows, url, push_key)
 
 
-def batched_ods_realtime_push(df, url, push_key='', chunk_size=1000, delete=False):
+def batched_ods_realtime_push(df, url, push_key='', chunk_size=1000, delete=False, max_in_flight=4):
     logging.info(f'Pushing a dataframe in chunks of size {chunk_size} to ods...')
-    df_chunks = chunked(df.index, chunk_size)
-    for df_chunk_indexes in df_chunks:
-        logging.info(f'Submitting a data chunk to ODS...')
-        df_chunk = df.iloc[df_chunk_indexes]
-        ods_realtime_push_df(df_chunk, url, push_key, delete=delete)
+    client = ods_realtime.RealtimePushClient(url, push_key, max_rows=chunk_size, max_in_flight=max_in_flight)
+    return client.push(df, delete=delete)
 
 
 def ods_realtime_push_df(df, url, push_key='', delete=False):
@@ -346,18 +593,17 @@ def email_message(subject="Python Notification", text="", img=None, attachment=N
 def rename_ftp(from_name, to_name, server, user, password):
     file = os.path.basename(from_name)
     folder = os.path.dirname(from_name)
-    ftp = ftplib.FTP(server, user, password)
-    logging.info(f'Changing to remote dir {folder}...')
-    ftp.cwd(folder)
-    logging.info('Searching for file to rename or move...')
     moved = False
-    for remote_file, facts in ftp.mlsd():
-        if file == remote_file:
-            logging.info(f'Moving file to {to_name}...')
-            ftp.rename(file, to_name)
-            moved = True
-            break
-    ftp.quit()
+    with ftp_pool.session(server, user, password) as ftp:
+        logging.info(f'Changing to remote dir {folder}...')
+        ftp.cwd(folder)
+        logging.info('Searching for file to rename or move...')
+        for remote_file, facts in ftp.mlsd():
+            if file == remote_file:
+                logging.info(f'Moving file to {to_name}...')
+                ftp.rename(file, to_name)
+                moved = True
+                break
     if not moved:
         logging.error(f'File to rename on FTP not found: {file}...')
         raise FileNotFoundError(file)
@@ -0,0 +1,28 @@
+import contextlib
+import json
+import os
+import pathlib
+import threading
+
+
+@contextlib.contextmanager
+def atomic_write(file_name):
+    """
+    Yields the name of a temporary file next to file_name, which replaces file_name if the block succeeds.
+    Readers see either the old or the new file, never a partly written one.
+    """
+    pathlib.Path(os.path.dirname(file_name) or '.').mkdir(parents=True, exist_ok=True)
+    tmp_file = f'{file_name}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        yield tmp_file
+        os.replace(tmp_file, file_name)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def write_json_atomic(file_name, obj, indent=1):
+    """Writes obj as JSON to file_name, see atomic_write()."""
+    with atomic_write(file_name) as tmp_file:
+        with open(tmp_file, 'w') as f:
+            json.dump(obj, f, indent=indent)
@@ -4,8 +4,11 @@ import urllib3
 from hashlib import blake2b
 from filehash import FileHash
 import os
+import sqlite3
 import time
+import numpy as np
 import pandas as pd
+from more_itertools import chunked
 from common.retry import retry
 
 logging.basicConfig(level=logging.DEBUG)
@@ -16,47 +19,111 @@ def get_check_file_dir() -> str:
     return os.path.join(curr_dir, 'change_tracking')
 
 
-def update_hash_file(file_name, sfv_file_name='') -> str:
-    if not sfv_file_name:
-        sfv_file_name = get_check_file(file_name, get_check_file_dir())
-    # logging.info(f'Ensuring that hash file path exists...')
-    pathlib.Path(os.path.dirname(sfv_file_name)).mkdir(parents=True, exist_ok=True)
-    with open(sfv_file_name, 'w') as f:
-        logging.info(f'Calculating hash of file {file_name} and writing to sfv file {sfv_file_name}...')
-        crc32_hasher = FileHash(hash_algorithm='crc32')
-        file_hash = crc32_hasher.hash_file(file_name)
-        f.write(f'{file_name} {file_hash}')
-    return file_hash
-
-
-def update_mod_timestamp_file(file_name, check_file_name='') -> str:
-    if not check_file_name:
-        check_file_name = get_check_file(file_name, get_check_file_dir(), extension='txt')
-    # logging.info(f'Ensuring that check file path exists...')
-    pathlib.Path(os.path.dirname(check_file_name)).mkdir(parents=True, exist_ok=True)
-    with open(check_file_name, 'w') as f:
-        logging.info(
-            f'Getting modification timestamp of file {file_name} and writing to check file {check_file_name}...')
-        # crc32_hasher = FileHash(hash_algorithm='crc32')
-        # file_hash = crc32_hasher.hash_file(file_name)
-        epoch = os.path.getmtime(file_name)
-        iso = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
-        time_string = f'{epoch},{iso},{file_name}'
-        logging.info(
-            f'Writing the following time string into the check file (Epoch, ISO rounded to seconds, file path): {time_string}')
-        f.write(time_string)
+def get_state_db(folder='') -> str:
+    if not folder:
+        folder = get_check_file_dir()
+    return os.path.join(folder, 'change_tracking.db')
+
+
+def _connect(folder='') -> sqlite3.Connection:
+    db_file = get_state_db(folder)
+    pathlib.Path(os.path.dirname(db_file)).mkdir(parents=True, exist_ok=True)
+    # The state db is shared by all jobs on the host, so wait for other writers instead of failing
+    conn = sqlite3.connect(db_file, timeout=60)
+    with conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS files (
+            file_name TEXT NOT NULL,
+            method TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            hash TEXT,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (file_name, method)
+        )""")
+    return conn
+
+
+def _read_states(conn, file_names, method) -> dict:
+    states = {}
+    for chunk in chunked(file_names, 500):
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(f'SELECT file_name, size, mtime_ns, hash FROM files WHERE method = ? AND file_name IN ({placeholders})',
+                            [method] + list(chunk))
+        for file_name, size, mtime_ns, file_hash in rows:
+            states[file_name] = {'size': size, 'mtime_ns': mtime_ns, 'hash': file_hash}
+    return states
+
+
+def _current_state(file_name, stored_state, method) -> dict:
+    stat = os.stat(file_name)
+    state = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': None}
+    if method == 'hash':
+        if stored_state is not None and (stored_state['size'], stored_state['mtime_ns']) == (state['size'], state['mtime_ns']):
+            # Fast path: same size and modification time, so the content is assumed to be the same
+            state['hash'] = stored_state['hash']
+        else:
+            state['hash'] = file_digest(file_name)
+    return state
+
+
+def _write_states(conn, states: dict, method):
+    updated_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO files (file_name, method, size, mtime_ns, hash, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                         [(file_name, method, state['size'], state['mtime_ns'], state['hash'], updated_at)
+                          for file_name, state in states.items()])
+
+
+def _check_method(method):
+    if method not in ['hash', 'modification_date']:
+        raise ValueError(f'"{method}" is not a valid method.')
+
+
+def update_many(file_names: list, hash_file_dir='', method='hash') -> dict:
+    """Stores the current state of all given files in one transaction and returns it per file name."""
+    _check_method(method)
+    conn = _connect(hash_file_dir)
+    try:
+        stored_states = _read_states(conn, file_names, method)
+        states = {file_name: _current_state(file_name, stored_states.get(file_name), method) for file_name in file_names}
+        logging.info(f'Writing state of {len(states)} files using method "{method}" to {get_state_db(hash_file_dir)}...')
+        _write_states(conn, states, method)
+    finally:
+        conn.close()
+    return states
+
+
+def update_hash_file(file_name, hash_file_dir='') -> str:
+    return update_many([file_name], hash_file_dir, method='hash')[file_name]['hash']
+
+
+def update_mod_timestamp_file(file_name, hash_file_dir='') -> str:
+    state = update_many([file_name], hash_file_dir, method='modification_date')[file_name]
+    epoch = state['mtime_ns'] / 1e9
+    iso = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+    time_string = f'{epoch},{iso},{file_name}'
+    logging.info(f'Stored the following modification time (Epoch, ISO rounded to seconds, file path): {time_string}')
     return time_string
 
 
-def update_check_file(file_name, check_file_name='', method='hash') -> str:
+def update_check_file(file_name, hash_file_dir='', method='hash') -> str:
     if method == 'hash':
-        return update_hash_file(file_name, check_file_name)
+        return update_hash_file(file_name, hash_file_dir)
     elif method == 'modification_date':
-        return update_mod_timestamp_file(file_name, check_file_name)
+        return update_mod_timestamp_file(file_name, hash_file_dir)
     else:
         raise ValueError(f'"{method}" is not a valid method.')
 
 
+def file_digest(file_name, chunk_size=1024 * 1024) -> str:
+    """Returns the blake2b hex digest of a file, read in chunks so that large files are never held in memory."""
+    hasher = blake2b(digest_size=16)
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
 def get_check_file(filename, folder='', extension='sfv') -> str:
     if not folder:
         folder = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'change_tracking')
@@ -65,49 +132,70 @@ def get_check_file(filename, folder='', extension='sfv') -> str:
     return check_filename
 
 
-@retry(OSError, tries=6, delay=600, backoff=1)
-def has_changed(filename: str, hash_file_dir='', do_update_hash_file=False, method='hash') -> bool:
-    if not os.path.exists(filename):
-        raise FileNotFoundError(f'File does not exist: {filename}')
-    if method not in ['hash', 'modification_date']:
-        raise ValueError(f'"{method}" is not a valid method.')
-    logging.info(f'Checking for changes in file {filename}...')
-    if not hash_file_dir:
-        # logging.debug(f'Using default hash_file_dir {get_hash_file_dir()}...')
-        hash_file_dir = get_check_file_dir()
-    check_file_extension = 'sfv' if method == 'hash' else 'txt'
-    check_filename = get_check_file(filename, hash_file_dir, extension=check_file_extension)
-    if not os.path.exists(check_filename):
-        logging.info(f'Check file does not exist.')
-        if do_update_hash_file:
-            update_check_file(filename, check_file_name=check_filename, method=method)
-        return True
-    logging.info(f'Check file exists, checking for changes using method "{method}" and check file {check_filename}...')
-    check_numbers_differ = True
+def _legacy_has_changed(filename, check_filename, method) -> bool:
+    # Check files written before the state db existed: one sfv (CRC32) or txt (mtime) file per tracked file
+    logging.info(f'No state stored yet, checking for changes using method "{method}" and legacy check file {check_filename}...')
     if method == 'hash':
         crc32_hasher = FileHash(hash_algorithm='crc32')
-        check_numbers_differ = not crc32_hasher.verify_sfv(sfv_filename=check_filename)[0].hashes_match
-    elif method == 'modification_date':
-        with open(check_filename, 'r') as f:
-            lines = f.readlines()
-        time_string = lines[0]
-        logging.info(f'Read the following time_string from the check file: {time_string}')
-        check_timestamp = time_string.split(',')[0]
-        check_iso = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(float(check_timestamp)))
-        current_timestamp = os.path.getmtime(filename)
-        current_timestamp_str = str(current_timestamp)
-        current_iso = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(current_timestamp))
-        check_numbers_differ = current_timestamp_str != check_timestamp
-        logging.info(
-            f'Comparing timestamps (Epoch, ISO rounded to seconds, file path): current / last: {current_timestamp_str} / {check_timestamp}, {current_iso} / {check_iso}. Different? {check_numbers_differ}')
-    if check_numbers_differ:
-        logging.info(f'Check numbers do not match, file has changed.')
+        return not crc32_hasher.verify_sfv(sfv_filename=check_filename)[0].hashes_match
+    with open(check_filename, 'r') as f:
+        check_timestamp = f.readline().split(',')[0]
+    return str(os.path.getmtime(filename)) != check_timestamp
+
+
+@retry(OSError, tries=6, delay=600, backoff=1)
+def has_changed_many(file_names: list, hash_file_dir='', do_update_hash_file=False, method='hash') -> dict:
+    """
+    Checks a list of files for changes since their state was last stored and returns a dict file name -> changed.
+
+    With method 'hash', files whose size and modification time are unchanged are not read at all,
+    otherwise their content hash is compared. With method 'modification_date' only the modification time is compared.
+    """
+    for filename in file_names:
+        if not os.path.exists(filename):
+            raise FileNotFoundError(f'File does not exist: {filename}')
+    _check_method(method)
+    logging.info(f'Checking for changes in {len(file_names)} files using method "{method}"...')
+    conn = _connect(hash_file_dir)
+    try:
+        stored_states = _read_states(conn, file_names, method)
+        changed = {}
+        current_states = {}
+        # Files checked against a legacy check file that are unchanged, their state is stored without reading them again
+        seeded_states = {}
+        for filename in file_names:
+            stored_state = stored_states.get(filename)
+            check_filename = get_check_file(filename, hash_file_dir or get_check_file_dir(),
+                                            extension='sfv' if method == 'hash' else 'txt')
+            if stored_state is None and os.path.exists(check_filename):
+                changed[filename] = _legacy_has_changed(filename, check_filename, method)
+                if not changed[filename]:
+                    # Without a hash, the next check only compares size and modification time
+                    stat = os.stat(filename)
+                    seeded_states[filename] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': None}
+                elif do_update_hash_file:
+                    current_states[filename] = _current_state(filename, None, method)
+            else:
+                current_states[filename] = _current_state(filename, stored_state, method)
+                if stored_state is None:
+                    changed[filename] = True
+                elif method == 'hash':
+                    changed[filename] = current_states[filename]['hash'] != stored_state['hash']
+                else:
+                    changed[filename] = current_states[filename]['mtime_ns'] != stored_state['mtime_ns']
+            logging.info(f'File {filename} has changed: {changed[filename]}')
+        states_to_write = dict(seeded_states)
         if do_update_hash_file:
-            update_check_file(filename, check_file_name=check_filename, method=method)
-        return True
-    else:
-        logging.info(f'Check numbers match, no changes detected.')
-        return False
+            states_to_write.update({f: current_states[f] for f in file_names if changed[f]})
+        if states_to_write:
+            _write_states(conn, states_to_write, method)
+    finally:
+        conn.close()
+    return changed
+
+
+def has_changed(filename: str, hash_file_dir='', do_update_hash_file=False, method='hash') -> bool:
+    return has_changed_many([filename], hash_file_dir, do_update_hash_file, method)[filename]
 
 
 def find_new_rows(df_old, df_new, id_columns):
@@ -119,63 +207,100 @@ def find_new_rows(df_old, df_new, id_columns):
     return new_rows
 
 
-def find_modified_rows(df_old, df_new, id_columns, columns_to_compare=None):
+class FrameDiff:
+    """
+    Result of diff_frames: new, deleted and modified rows, plus a boolean mask of the changed columns per modified row.
+
+    Cell-level changes are only materialised when calling cell_changes().
+    """
+
+    def __init__(self, id_columns, new_rows, deleted_rows, deprecated_rows, updated_rows, change_mask):
+        self.id_columns = id_columns
+        self.new_rows = new_rows
+        self.deleted_rows = deleted_rows
+        self.deprecated_rows = deprecated_rows
+        self.updated_rows = updated_rows
+        self.change_mask = change_mask
+
+    @property
+    def changed_columns(self) -> list:
+        return [col for col in self.change_mask.columns if self.change_mask[col].any()]
+
+    def cell_changes(self, limit=None) -> pd.DataFrame:
+        """Returns one row per changed cell (id columns, column, old_value, new_value), at most limit rows."""
+        stacked = self.change_mask.stack()
+        stacked = stacked[stacked]
+        if limit is not None:
+            stacked = stacked.iloc[:limit]
+        rows = stacked.index.get_level_values(0)
+        columns = stacked.index.get_level_values(1)
+        changes = self.updated_rows.loc[rows, self.id_columns].reset_index(drop=True)
+        changes['column'] = columns
+        changes['old_value'] = [self.deprecated_rows.at[row, col] for row, col in zip(rows, columns)]
+        changes['new_value'] = [self.updated_rows.at[row, col] for row, col in zip(rows, columns)]
+        return changes
+
+
+def _row_hashes(df, columns) -> pd.Series:
+    if not columns:
+        return pd.Series(0, index=df.index, dtype='uint64')
+    return pd.util.hash_pandas_object(df[columns], index=False)
+
+
+def _values_differ(old_col, new_col) -> pd.Series:
+    if isinstance(old_col.dtype, pd.CategoricalDtype) or isinstance(new_col.dtype, pd.CategoricalDtype):
+        # Categoricals with different categories cannot be compared directly
+        old_col, new_col = old_col.astype(object), new_col.astype(object)
+    return ~((old_col == new_col) | (pd.isna(old_col) & pd.isna(new_col)))
+
+
+def diff_frames(df_old, df_new, id_columns, columns_to_compare=None, log_limit=20) -> FrameDiff:
+    """
+    Classifies the rows of df_new and df_old into new, deleted and modified rows in a single merge on the id columns.
+
+    Rows are first compared by a content hash of the compared columns, only rows whose hashes differ
+    are compared column by column. Up to log_limit changed cells are logged.
+    """
+    id_columns = [id_columns] if isinstance(id_columns, str) else list(id_columns)
     if columns_to_compare is None:
         columns_to_compare = [col for col in df_new.columns if col not in id_columns]
-    # Merge the dataframes on the id columns
-    merged = pd.merge(df_old, df_new, on=id_columns, suffixes=('_old', '_new'), how='inner')
-    mask = pd.DataFrame(index=merged.index)
-    changed_columns = []  # To store column names where changes occur
-    for col in columns_to_compare:
-        # If a new row gets added to the dataframe, the old column will be NaN
-        if f'{col}_old' not in merged.columns:
-            merged[f'{col}_old'] = ''
-            merged[f'{col}_new'] = merged[col]
-        old_col = merged[f'{col}_old']
-        new_col = merged[f'{col}_new']
-        if new_col.dtype == 'category':
-            # Handle categorical columns by ensuring they have the same categories
-            common_categories = sorted(set(new_col.cat.categories.tolist() + old_col.cat.categories.tolist()))
-            new_col = new_col.cat.set_categories(common_categories)
-            old_col = old_col.cat.set_categories(common_categories)
-        # Compare columns and record where changes occurred
-        mask[col] = ~((old_col == new_col) | (pd.isna(old_col) & pd.isna(new_col)))
-        # If there are changes in this column, add the column name to the list
-        if mask[col].any():
-            changed_columns.append(col)
-    # Filter rows with any changes in the specified columns
-    modified_rows = merged[mask.any(axis=1)]
-    
-    # Log the columns that had changes
-    if changed_columns:
-        logging.info(f'Columns with changes: {changed_columns}')
-    else:
-        logging.info('No columns were modified.')
-    logging.info(f'Found {len(modified_rows)} modified rows:')
-    # Deprecated rows (old values)
-    deprecated_rows = modified_rows[([id_columns] if isinstance(id_columns, str) else id_columns) +
-                                    [f'{col}_old' for col in columns_to_compare]].rename(
-        columns={f'{col}_old': col for col in columns_to_compare})
-    logging.info(f'Deprecated rows:')
-    logging.info(deprecated_rows)
-    # Updated rows (new values)
-    updated_rows = modified_rows[([id_columns] if isinstance(id_columns, str) else id_columns) +
-                                 [f'{col}_new' for col in columns_to_compare]].rename(
-        columns={f'{col}_new': col for col in columns_to_compare})
-    logging.info(f'Updated rows:')
-    logging.info(updated_rows)
-    # Print detailed changes for debugging
-    for idx, row in modified_rows.iterrows():
-        row_id = row[id_columns] if isinstance(id_columns, str) else tuple(row[id_columns])
-        logging.info(f'\nChanges for row with ID {row_id}:')
-        for col in changed_columns:
-            old_value = row[f'{col}_old']
-            new_value = row[f'{col}_new']
-            if not pd.isna(old_value) or not pd.isna(new_value):
-                logging.info(f" - Column '{col}': old value = {old_value}, new value = {new_value}")
-    
-    return deprecated_rows, updated_rows
+    # Columns missing in the old dataframe are compared against empty strings
+    df_old_compare = df_old.reindex(columns=columns_to_compare, fill_value='')
+    keys_old = df_old[id_columns].assign(_pos_old=np.arange(len(df_old)), _hash_old=_row_hashes(df_old_compare, columns_to_compare).values)
+    keys_new = df_new[id_columns].assign(_pos_new=np.arange(len(df_new)), _hash_new=_row_hashes(df_new, columns_to_compare).values)
+    merged = pd.merge(keys_old, keys_new, on=id_columns, how='outer', indicator=True, sort=False)
+
+    new_positions = np.sort(merged.loc[merged['_merge'] == 'right_only', '_pos_new'].astype(int).values)
+    new_rows = df_new.iloc[new_positions][id_columns + [col for col in df_new.columns if col not in id_columns]]
+    deleted_positions = np.sort(merged.loc[merged['_merge'] == 'left_only', '_pos_old'].astype(int).values)
+    deleted_rows = df_old.iloc[deleted_positions]
+
+    # Matched rows in the order of df_old, numbered like the result of an inner merge
+    both = merged[merged['_merge'] == 'both'].sort_values('_pos_old', kind='stable')
+    both.index = pd.RangeIndex(len(both))
+    candidates = both[both['_hash_old'] != both['_hash_new']]
+    old_values = df_old_compare.iloc[candidates['_pos_old'].astype(int).values].set_axis(candidates.index)
+    new_values = df_new[columns_to_compare].iloc[candidates['_pos_new'].astype(int).values].set_axis(candidates.index)
+    change_mask = pd.DataFrame({col: _values_differ(old_values[col], new_values[col]) for col in columns_to_compare},
+                               index=candidates.index, columns=columns_to_compare).astype(bool)
+    modified = change_mask.any(axis=1)
+    change_mask = change_mask[modified]
+    ids = df_old[id_columns].iloc[candidates.loc[modified, '_pos_old'].astype(int).values].set_axis(change_mask.index)
+    deprecated_rows = pd.concat([ids, old_values[modified]], axis=1)
+    updated_rows = pd.concat([ids, new_values[modified]], axis=1)
 
+    diff = FrameDiff(id_columns, new_rows, deleted_rows, deprecated_rows, updated_rows, change_mask)
+    logging.info(f'Found {len(new_rows)} new, {len(deleted_rows)} deleted and {len(updated_rows)} modified rows.')
+    if len(updated_rows) > 0:
+        logging.info(f'Columns with changes: {diff.changed_columns}')
+        logging.info(f'First {log_limit} changed cells:')
+        logging.info(diff.cell_changes(limit=log_limit))
+    return diff
+
+
+def find_modified_rows(df_old, df_new, id_columns, columns_to_compare=None):
+    diff = diff_frames(df_old, df_new, id_columns, columns_to_compare)
+    return diff.deprecated_rows, diff.updated_rows
 
 
 def find_deleted_rows(df_old, df_new, id_columns):
@@ -0,0 +1,106 @@
+import atexit
+import ftplib
+import logging
+import threading
+from contextlib import contextmanager
+
+# Idle connections kept per (server, user). Anything above is closed on release.
+MAX_IDLE_PER_KEY = 8
+
+_lock = threading.Lock()
+_idle = {}
+_stats = {'opened': 0, 'reused': 0, 'discarded': 0}
+
+
+def _connect(server, user, password) -> ftplib.FTP:
+    logging.info(f'Opening new FTP connection to server "{server}" using user "{user}"...')
+    ftp = ftplib.FTP(server)
+    ftp.login(user, password)
+    # Remember the login directory, so that each session starts from there regardless of earlier cwd() calls
+    ftp.home_dir = ftp.pwd()
+    with _lock:
+        _stats['opened'] += 1
+    return ftp
+
+
+def _close(ftp: ftplib.FTP):
+    try:
+        ftp.quit()
+    except ftplib.all_errors:
+        ftp.close()
+
+
+def _discard(ftp: ftplib.FTP):
+    with _lock:
+        _stats['discarded'] += 1
+    _close(ftp)
+
+
+def _acquire(server, user, password) -> ftplib.FTP:
+    key = (server, user)
+    while True:
+        with _lock:
+            idle = _idle.get(key, [])
+            ftp = idle.pop() if idle else None
+        if ftp is None:
+            return _connect(server, user, password)
+        try:
+            ftp.voidcmd('NOOP')
+        except ftplib.all_errors as e:
+            logging.info(f'Pooled FTP connection to "{server}" failed health check ({e}), discarding it...')
+            _discard(ftp)
+            continue
+        with _lock:
+            _stats['reused'] += 1
+        return ftp
+
+
+def _release(server, user, ftp: ftplib.FTP):
+    try:
+        ftp.cwd(ftp.home_dir)
+    except ftplib.all_errors:
+        _discard(ftp)
+        return
+    with _lock:
+        idle = _idle.setdefault((server, user), [])
+        if len(idle) < MAX_IDLE_PER_KEY:
+            idle.append(ftp)
+            return
+    _close(ftp)
+
+
+@contextmanager
+def session(server, user, password):
+    """
+    Yields a logged-in ftplib.FTP connection taken from a pool keyed by server and user.
+
+    The connection is returned to the pool in its login directory if the block finishes without error.
+    If an error is raised, the connection is discarded, so that a retry of the calling function
+    (see the @retry policies in common) starts over on a fresh connection.
+    """
+    ftp = _acquire(server, user, password)
+    try:
+        yield ftp
+    except BaseException:
+        _discard(ftp)
+        raise
+    _release(server, user, ftp)
+
+
+def get_stats() -> dict:
+    """Returns the number of FTP connections opened, reused from the pool and discarded so far."""
+    with _lock:
+        return dict(_stats, idle=sum(len(conns) for conns in _idle.values()))
+
+
+def close_all():
+    with _lock:
+        conns = [ftp for idle in _idle.values() for ftp in idle]
+        _idle.clear()
+    for ftp in conns:
+        _close(ftp)
+    if _stats['opened'] > 0:
+        logging.info(f'FTP connection pool stats: {get_stats()}')
+
+
+atexit.register(close_all)
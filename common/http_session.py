@@ -0,0 +1,153 @@
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+from hashlib import blake2b
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from common.atomic_file import atomic_write, write_json_atomic
+
+MAX_POOL_SIZE = 16
+# Upper bound of the size of all cached response bodies, least recently used entries are evicted first
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+_cache_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Returns the keep-alive session shared by all http requests of this process."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=MAX_POOL_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def get_cache_dir() -> str:
+    curr_dir = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(curr_dir, 'http_cache')
+
+
+def _cache_key(url, params=None, headers=None) -> str:
+    prepared_url = requests.Request('GET', url, params=params).prepare().url
+    key = json.dumps([prepared_url, sorted((headers or {}).items())])
+    return blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _response_from_cache(url, meta, body) -> requests.Response:
+    r = requests.Response()
+    r.status_code = 200
+    r.url = url
+    r.headers = CaseInsensitiveDict(meta['headers'])
+    r.encoding = meta['encoding']
+    r._content = body
+    r.from_cache = True
+    return r
+
+
+def cached_get(url, params=None, headers=None, cache_dir='', max_cache_bytes=MAX_CACHE_BYTES, **kwargs) -> requests.Response:
+    """
+    GET request that keeps the response body on disk and revalidates it using ETag / Last-Modified.
+
+    If the server answers 304 Not Modified, the cached body is returned without transferring it again.
+    Responses without ETag and Last-Modified headers are not cached. The returned response has the
+    attribute from_cache set to True if the body was taken from the cache.
+    """
+    cache_dir = cache_dir or get_cache_dir()
+    pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    key = _cache_key(url, params, headers)
+    meta_file = os.path.join(cache_dir, f'{key}.json')
+    body_file = os.path.join(cache_dir, f'{key}.body')
+    meta = None
+    request_headers = dict(headers or {})
+    if os.path.exists(meta_file) and os.path.exists(body_file):
+        with open(meta_file, 'r') as f:
+            meta = json.load(f)
+        if meta.get('etag'):
+            request_headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            request_headers['If-Modified-Since'] = meta['last_modified']
+    r = get_session().get(url, params=params, headers=request_headers, **kwargs)
+    if r.status_code == 304 and meta is not None:
+        logging.info(f'Server reported no changes for {r.url}, using cached response...')
+        with open(body_file, 'rb') as f:
+            body = f.read()
+        # Mark the entry as recently used for the eviction
+        os.utime(body_file)
+        return _response_from_cache(r.url, meta, body)
+    r.from_cache = False
+    if r.status_code == 200 and (r.headers.get('ETag') or r.headers.get('Last-Modified')):
+        meta = {'url': r.url, 'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified'),
+                'encoding': r.encoding, 'headers': {k: v for k, v in r.headers.items()
+                                                    if k.lower() not in ['content-encoding', 'content-length', 'transfer-encoding']}}
+        with _cache_lock:
+            with atomic_write(body_file) as tmp_file:
+                with open(tmp_file, 'wb') as f:
+                    f.write(r.content)
+            write_json_atomic(meta_file, meta, indent=None)
+            evict(cache_dir, max_cache_bytes)
+    return r
+
+
+def evict(cache_dir='', max_cache_bytes=MAX_CACHE_BYTES):
+    """Deletes the least recently used cache entries until the bodies use at most max_cache_bytes."""
+    cache_dir = cache_dir or get_cache_dir()
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.body'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, body_file in sorted(entries):
+        if total_bytes <= max_cache_bytes:
+            break
+        logging.info(f'Evicting {body_file} from http cache...')
+        for file_name in [body_file, body_file[:-len('.body')] + '.json']:
+            if os.path.exists(file_name):
+                os.remove(file_name)
+        total_bytes -= size
+
+
+def download_file(url, file_name, params=None, headers=None, chunk_size=DOWNLOAD_CHUNK_SIZE, **kwargs) -> bool:
+    """
+    Streams the response body to file_name in chunks of chunk_size bytes, so memory use does not depend on its size.
+
+    ETag / Last-Modified of the response are kept in file_name + '.http.json'. If file_name exists, the next request
+    sends them as validators and the file is kept as it is if the server answers 304 Not Modified.
+    Returns True if the file was downloaded, False if it did not change.
+    """
+    meta_file = f'{file_name}.http.json'
+    request_headers = dict(headers or {})
+    if os.path.exists(file_name) and os.path.exists(meta_file):
+        with open(meta_file, 'r') as f:
+            meta = json.load(f)
+        if meta.get('etag'):
+            request_headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            request_headers['If-Modified-Since'] = meta['last_modified']
+    with get_session().get(url, params=params, headers=request_headers, stream=True, **kwargs) as r:
+        if r.status_code == 304:
+            logging.info(f'Server reported no changes for {r.url}, keeping {file_name}...')
+            return False
+        r.raise_for_status()
+        size = 0
+        with atomic_write(file_name) as tmp_file:
+            with open(tmp_file, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+        meta = {'url': r.url, 'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+    write_json_atomic(meta_file, meta, indent=None)
+    logging.info(f'Downloaded {size} bytes from {meta["url"]} to {file_name}...')
+    return True
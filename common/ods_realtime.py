@@ -0,0 +1,111 @@
+import gzip
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from common import credentials
+from common import http_session
+
+# Status codes after which a chunk is sent again, all other http errors are raised immediately
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RealtimePushClient:
+    """
+    Pushes dataframes to the Opendatasoft realtime API using the keep-alive session of common.http_session.
+
+    Rows are serialised to JSON once and grouped into chunks of at most max_rows rows and max_bytes bytes.
+    Up to max_in_flight chunks are sent in parallel, so the order in which chunks arrive is not guaranteed.
+    Each chunk is retried on its own, chunks that were already acknowledged are never sent again.
+    """
+
+    def __init__(self, url, push_key='', max_rows=1000, max_bytes=4 * 1024 * 1024, max_in_flight=4, use_gzip=False,
+                 tries=6, delay=5, backoff=2, session=None):
+        if not push_key:
+            t = url.partition('?pushkey=')
+            url = t[0]
+            push_key = t[2]
+        self.url = url
+        self.push_key = push_key
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_in_flight = max_in_flight
+        self.use_gzip = use_gzip
+        self.tries = tries
+        self.delay = delay
+        self.backoff = backoff
+        self.session = session or http_session.get_session()
+        self._lock = threading.Lock()
+
+    def chunk_payloads(self, df) -> list:
+        """Returns the JSON payloads (as bytes) of the chunks that df is pushed in."""
+        if len(df) == 0:
+            return []
+        rows = df.to_json(orient='records', lines=True).encode('utf-8').splitlines()
+        payloads = []
+        chunk, chunk_bytes = [], 2
+        for row in rows:
+            if chunk and (len(chunk) >= self.max_rows or chunk_bytes + len(row) + 1 > self.max_bytes):
+                payloads.append(b'[' + b','.join(chunk) + b']')
+                chunk, chunk_bytes = [], 2
+            chunk.append(row)
+            chunk_bytes += len(row) + 1
+        payloads.append(b'[' + b','.join(chunk) + b']')
+        return payloads
+
+    def push(self, df, delete=False) -> dict:
+        """Pushes (or deletes, if delete is True) all rows of df and returns statistics about the chunks sent."""
+        url = self.url.rsplit('push', 1)[0] + 'delete' if delete else self.url
+        payloads = self.chunk_payloads(df)
+        stats = {'rows': len(df), 'chunks': len(payloads), 'requests': 0, 'bytes_sent': 0, 'seconds': 0.0}
+        if not payloads:
+            logging.info(f"No rows to {'delete' if delete else 'push'} to ODS... ")
+            return stats
+        logging.info(f"{'Deleting' if delete else 'Pushing'} {len(df)} rows in {len(payloads)} chunks "
+                     f"with up to {self.max_in_flight} parallel requests to ODS realtime API...")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            futures = [executor.submit(self._send_chunk, url, payload, delete, stats) for payload in payloads]
+            errors = [f.exception() for f in futures if f.exception() is not None]
+        stats['seconds'] = time.perf_counter() - start
+        logging.info(f'Realtime push stats: {stats}')
+        if errors:
+            logging.error(f'{len(errors)} of {len(payloads)} chunks could not be pushed to ODS...')
+            raise errors[0]
+        return stats
+
+    def _send_chunk(self, url, payload, delete, stats):
+        mdelay = self.delay
+        for i in range(self.tries):
+            headers = {'Content-Type': 'application/json'}
+            data = payload
+            if self.use_gzip:
+                headers['Content-Encoding'] = 'gzip'
+                data = gzip.compress(payload)
+            with self._lock:
+                stats['requests'] += 1
+                stats['bytes_sent'] += len(data)
+            try:
+                r = self.session.request('DELETE' if delete else 'POST', url, data=data, headers=headers,
+                                         params={'pushkey': self.push_key}, proxies=credentials.proxies)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if i == self.tries - 1:
+                    raise
+                logging.warning(f'{e}, Retrying chunk in {mdelay} seconds...')
+            else:
+                if r.status_code == 415 and self.use_gzip:
+                    logging.info('ODS does not accept gzip request bodies, sending uncompressed payloads from now on...')
+                    self.use_gzip = False
+                    continue
+                if r.status_code not in RETRY_STATUS_CODES or i == self.tries - 1:
+                    r.raise_for_status()
+                    return r
+                retry_after = r.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    mdelay = max(mdelay, int(retry_after))
+                logging.warning(f'Received http status {r.status_code}, Retrying chunk in {mdelay} seconds...')
+            time.sleep(mdelay)
+            mdelay *= self.backoff
@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import common
+
+
+class HighWaterMark:
+    """
+    Timestamps of the newest records pushed successfully, stored in one JSON file per job (one entry per dataset),
+    so that the next run only fetches the time slice since the last successful push.
+    """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self.marks = {}
+        if os.path.exists(state_file):
+            with open(state_file, 'r') as f:
+                self.marks = json.load(f)
+
+    def get(self, name, default=None):
+        return self.marks.get(name, default)
+
+    def set(self, name, value):
+        with self._lock:
+            self.marks[name] = value
+            common.write_json_atomic(self.state_file, self.marks)
+        logging.info(f'High-water mark of {name} is now {value}...')
+
+
+class PaginatedClient:
+    """
+    Retrieves the records of an http API page by page, each page is returned as a DataFrame as soon as it arrives.
+
+    iter_by_timestamp() pages through records sorted by ascending timestamp, each request starts at the last timestamp
+    of the previous page (keyset pagination), so records can neither be skipped nor truncated. iter_by_page() requests
+    numbered pages, max_workers pages at the same time, until a page is not full.
+    """
+
+    def __init__(self, url, auth=None, headers=None, page_size=1000, size_param='size', record_path=None,
+                 max_workers=1, max_pages=1000):
+        self.url = url
+        self.auth = auth
+        self.headers = headers
+        self.page_size = page_size
+        self.size_param = size_param
+        self.record_path = record_path
+        self.max_workers = max_workers
+        self.max_pages = max_pages
+
+    def get_records(self, params) -> list:
+        params = {**params, self.size_param: self.page_size}
+        logging.info(f'Querying API using url {self.url} with parameters {params}...')
+        r = common.requests_get(url=self.url, params=params, auth=self.auth, headers=self.headers)
+        r.raise_for_status()
+        body = r.json()
+        return body[self.record_path] if self.record_path else body
+
+    def iter_by_timestamp(self, params, start_param, timestamp_field, start):
+        """
+        Yields the records with a timestamp of at least start, params must sort the records by ascending timestamp.
+        Records with the timestamp a page ends with are requested again with the next page, and skipped there.
+        """
+        seen_at_start = set()
+        for _ in range(self.max_pages):
+            records = self.get_records({**params, start_param: start})
+            new_records = [r for r in records
+                           if r[timestamp_field] != start or json.dumps(r, sort_keys=True) not in seen_at_start]
+            if new_records:
+                yield pd.json_normalize(new_records)
+            if len(records) < self.page_size:
+                return
+            last = records[-1][timestamp_field]
+            if last == start:
+                raise RuntimeError(f'More than {self.page_size} records at {start}, increase the page size')
+            seen_at_start = {json.dumps(r, sort_keys=True) for r in records if r[timestamp_field] == last}
+            start = last
+        raise RuntimeError(f'Stopped after {self.max_pages} pages of {self.url}')
+
+    def iter_by_page(self, params, page_param='page', first_page=0):
+        """Yields the pages in order, max_workers pages are requested at the same time."""
+        page = first_page
+        previous = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while page < first_page + self.max_pages:
+                batch = range(page, page + self.max_workers)
+                for records in executor.map(lambda p: self.get_records({**params, page_param: p}), batch):
+                    if records and records == previous:
+                        raise RuntimeError(f'{self.url} returned the same page twice, it might not support "{page_param}"')
+                    if records:
+                        yield pd.json_normalize(records)
+                    if len(records) < self.page_size:
+                        return
+                    previous = records
+                page += self.max_workers
+        raise RuntimeError(f'Stopped after {self.max_pages} pages of {self.url}')
+
+    def fetch_by_timestamp(self, params, start_param, timestamp_field, start) -> pd.DataFrame:
+        pages = list(self.iter_by_timestamp(params, start_param, timestamp_field, start))
+        df = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame()
+        logging.info(f'Received {len(df)} records in {len(pages)} pages from API...')
+        return df
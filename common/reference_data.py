@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from io import BytesIO, StringIO
+
+import numpy as np
+import pandas as pd
+
+import common
+
+ODS_API_URL = 'https://data.bs.ch/api/explore/v2.1/catalog/datasets'
+# Reference datasets are checked for updates at most once per TTL, the default is once per day
+DEFAULT_TTL = timedelta(days=1)
+BOOLEAN_VALUES = {'True': True, 'False': False, 'true': True, 'false': False, 'TRUE': True, 'FALSE': False}
+
+
+def get_snapshot_dir() -> str:
+    # Next to the common package, so all jobs running from the same checkout share the snapshots
+    curr_dir = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(curr_dir, 'reference_data_snapshots')
+
+
+def get_data_processed(dataset_id) -> str:
+    """Returns the data_processed timestamp of the dataset, it changes whenever the data of the dataset changes."""
+    r = common.requests_get(f'{ODS_API_URL}/{dataset_id}')
+    return r.json()['metas']['default']['data_processed']
+
+
+def load_snapshot_meta(meta_file) -> dict:
+    if not os.path.exists(meta_file):
+        return {}
+    with open(meta_file, 'r') as f:
+        return json.load(f)
+
+
+def refresh_snapshot(dataset_id, snapshot_file, write_snapshot, ttl=DEFAULT_TTL) -> bool:
+    """
+    Makes sure snapshot_file holds the current data of the dataset, write_snapshot(tmp_file) downloads and writes it.
+
+    Within ttl of the last check, the snapshot is used without any request. After that, data_processed of the
+    dataset is compared to the one of the snapshot, and the dataset is only downloaded again if it differs.
+    Returns True if the snapshot was downloaded.
+    """
+    meta_file = f'{snapshot_file}.json'
+    meta = load_snapshot_meta(meta_file)
+    now = datetime.now(timezone.utc)
+    if os.path.exists(snapshot_file) and meta.get('checked_at'):
+        if now - datetime.fromisoformat(meta['checked_at']) < ttl:
+            logging.info(f'Using snapshot {snapshot_file} of dataset {dataset_id} checked at {meta["checked_at"]}...')
+            return False
+    data_processed = get_data_processed(dataset_id)
+    if os.path.exists(snapshot_file) and meta.get('data_processed') == data_processed:
+        logging.info(f'Dataset {dataset_id} did not change since {data_processed}, using snapshot {snapshot_file}...')
+        common.write_json_atomic(meta_file, {**meta, 'checked_at': now.isoformat()})
+        return False
+    logging.info(f'Downloading dataset {dataset_id} processed at {data_processed} to snapshot {snapshot_file}...')
+    with common.atomic_write(snapshot_file) as tmp_file:
+        write_snapshot(tmp_file)
+    common.write_json_atomic(meta_file, {'dataset_id': dataset_id, 'data_processed': data_processed,
+                                         'checked_at': now.isoformat()})
+    return True
+
+
+def infer_dtype(values: pd.Series) -> pd.Series:
+    """Converts a column of strings to numbers or booleans where all of its values allow it, as pandas.read_csv does."""
+    non_missing = values.dropna()
+    if len(non_missing) == 0:
+        return values.astype(float)
+    if non_missing.isin(BOOLEAN_VALUES.keys()).all() and not values.isna().any():
+        return values.map(BOOLEAN_VALUES).astype(bool)
+    try:
+        return pd.to_numeric(values)
+    except (ValueError, TypeError):
+        return values
+
+
+def get_dataset(dataset_id, dtype=None, columns=None, ttl=DEFAULT_TTL, snapshot_dir='') -> pd.DataFrame:
+    """
+    Returns the data of an ODS dataset from a local Parquet snapshot, downloaded at most once per ttl.
+
+    The snapshot keeps all values as strings, so jobs that read the same dataset with different dtypes can share it.
+    Columns in dtype are converted as pandas.read_csv would with dtype, the types of all others are inferred.
+    """
+    snapshot_file = os.path.join(snapshot_dir or get_snapshot_dir(), f'{dataset_id}.parquet')
+
+    def write_snapshot(tmp_file):
+        r = common.requests_get(f'{ODS_API_URL}/{dataset_id}/exports/csv', params={'delimiter': ';'})
+        df_raw = pd.read_csv(StringIO(r.content.decode('utf-8-sig')), sep=';', dtype=str)
+        df_raw.to_parquet(tmp_file, index=False)
+
+    refresh_snapshot(dataset_id, snapshot_file, write_snapshot, ttl=ttl)
+    df = pd.read_parquet(snapshot_file, columns=columns)
+    dtype = dtype or {}
+    for column in df.columns:
+        # Missing values are NaN, as with pandas.read_csv
+        values = df[column].where(df[column].notna(), np.nan) if df[column].dtype == object else df[column]
+        if column not in dtype:
+            df[column] = infer_dtype(values)
+        elif dtype[column] not in [str, 'str', object, 'object']:
+            df[column] = values.astype(dtype[column])
+        else:
+            df[column] = values
+    return df
+
+
+def get_geodataset(dataset_id, columns=None, ttl=DEFAULT_TTL, snapshot_dir=''):
+    """
+    Returns the data of an ODS dataset with a geometry as GeoDataFrame (EPSG:4326), from a local GeoParquet
+    snapshot downloaded at most once per ttl. Requires geopandas, which is only imported here.
+    """
+    import geopandas as gpd
+    snapshot_file = os.path.join(snapshot_dir or get_snapshot_dir(), f'{dataset_id}.geoparquet')
+
+    def write_snapshot(tmp_file):
+        r = common.requests_get(f'{ODS_API_URL}/{dataset_id}/exports/geojson')
+        gdf_raw = gpd.read_file(BytesIO(r.content))
+        gdf_raw.to_parquet(tmp_file, index=False)
+
+    refresh_snapshot(dataset_id, snapshot_file, write_snapshot, ttl=ttl)
+    return gpd.read_parquet(snapshot_file, columns=columns)
@@ -0,0 +1,22 @@
+import json
+import os
+import pytest
+import common
+
+
+def test_json_is_written_to_new_dir(tmp_path):
+    state_file = os.path.join(tmp_path, 'state', 'marks.json')
+    common.write_json_atomic(state_file, {'S3': '2024-01-01T00:00:00'})
+    with open(state_file) as f:
+        assert json.load(f) == {'S3': '2024-01-01T00:00:00'}
+    assert os.listdir(os.path.dirname(state_file)) == ['marks.json']
+
+
+def test_file_is_kept_if_writing_fails(tmp_path):
+    state_file = os.path.join(tmp_path, 'marks.json')
+    common.write_json_atomic(state_file, {'S3': 'old'})
+    with pytest.raises(TypeError):
+        common.write_json_atomic(state_file, {'S3': object()})
+    with open(state_file) as f:
+        assert json.load(f) == {'S3': 'old'}
+    assert os.listdir(tmp_path) == ['marks.json']
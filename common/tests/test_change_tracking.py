@@ -100,6 +100,59 @@ def test_changed_file_timestamp(text_file):
     assert not ct.has_changed(text_file, hash_file_dir=CHANGE_TRACKING_DIR, method='modification_date')
 
 
+@pytest.fixture
+def text_files(tmp_path):
+    file_paths = []
+    for i in range(3):
+        file_path = os.path.join(tmp_path, f'test-{i}-{random()}.txt')
+        with open(file_path, 'w') as f:
+            f.write(f'{datetime.now()}: Hello World {i}!')
+        file_paths.append(file_path)
+    return file_paths
+
+
+def test_has_changed_many(text_files):
+    assert ct.has_changed_many(text_files, hash_file_dir=CHANGE_TRACKING_DIR) == {f: True for f in text_files}
+    ct.update_many(text_files, hash_file_dir=CHANGE_TRACKING_DIR)
+    assert ct.has_changed_many(text_files, hash_file_dir=CHANGE_TRACKING_DIR) == {f: False for f in text_files}
+    with open(text_files[1], 'a') as f:
+        f.write('changed')
+    result = ct.has_changed_many(text_files, hash_file_dir=CHANGE_TRACKING_DIR, do_update_hash_file=True)
+    assert result == {text_files[0]: False, text_files[1]: True, text_files[2]: False}
+    assert not any(ct.has_changed_many(text_files, hash_file_dir=CHANGE_TRACKING_DIR).values())
+
+
+def test_unchanged_stat_skips_hashing(text_file, monkeypatch):
+    ct.update_hash_file(text_file, hash_file_dir=CHANGE_TRACKING_DIR)
+    hashed_files = []
+    monkeypatch.setattr(ct, 'file_digest', lambda file_name: hashed_files.append(file_name))
+    assert not ct.has_changed(text_file, hash_file_dir=CHANGE_TRACKING_DIR)
+    assert hashed_files == []
+
+
+def test_touched_but_unchanged_file(text_file):
+    ct.update_hash_file(text_file, hash_file_dir=CHANGE_TRACKING_DIR)
+    stat = os.stat(text_file)
+    os.utime(text_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert not ct.has_changed(text_file, hash_file_dir=CHANGE_TRACKING_DIR)
+    assert ct.has_changed(text_file, hash_file_dir=CHANGE_TRACKING_DIR, method='modification_date')
+
+
+def test_legacy_sfv_file_is_used(text_file, monkeypatch):
+    from filehash import FileHash
+    legacy_file = ct.get_check_file(text_file, CHANGE_TRACKING_DIR)
+    pathlib.Path(CHANGE_TRACKING_DIR).mkdir(parents=True, exist_ok=True)
+    with open(legacy_file, 'w') as f:
+        f.write(f'{text_file} {FileHash(hash_algorithm="crc32").hash_file(text_file)}')
+    hashed_files = []
+    monkeypatch.setattr(ct, 'file_digest', lambda file_name: hashed_files.append(file_name))
+    assert not ct.has_changed(text_file, hash_file_dir=CHANGE_TRACKING_DIR)
+    # The state is now in the db, the legacy check file is not read anymore
+    os.remove(legacy_file)
+    assert not ct.has_changed(text_file, hash_file_dir=CHANGE_TRACKING_DIR)
+    assert hashed_files == []
+
+
 def create_df(id_values, value_values, index=None):
     return pd.DataFrame({'id': id_values, 'value': value_values}, index=index)
 
@@ -152,3 +205,24 @@ def test_find_deleted_rows():
 
     with pytest.raises(KeyError):
         ct.find_deleted_rows(df_old, df_new, ['non_existent_column'])
+
+
+def test_diff_frames():
+    df_old = create_df(['1', '2', '3', '5'], ['a', 'b', 'c', 'e'])
+    df_new = create_df(['2', '3', '4', '1'], ['b', 'd', 'x', 'a'])
+    diff = ct.diff_frames(df_old, df_new, 'id')
+    assert diff.new_rows['id'].tolist() == ['4']
+    assert diff.deleted_rows['id'].tolist() == ['5']
+    assert diff.deprecated_rows.to_dict('records') == [{'id': '3', 'value': 'c'}]
+    assert diff.updated_rows.to_dict('records') == [{'id': '3', 'value': 'd'}]
+    assert diff.changed_columns == ['value']
+    assert diff.cell_changes().to_dict('records') == [{'id': '3', 'column': 'value', 'old_value': 'c', 'new_value': 'd'}]
+
+
+def test_diff_frames_ignores_dtype_only_changes():
+    df_old = pd.DataFrame({'id': [1, 2], 'value': [1, 2], 'cat': pd.Categorical(['a', 'b'])})
+    df_new = pd.DataFrame({'id': [1, 2], 'value': [1.0, 3.0], 'cat': pd.Categorical(['a', 'b'], categories=['b', 'a'])})
+    diff = ct.diff_frames(df_old, df_new, ['id'])
+    assert diff.updated_rows['id'].tolist() == [2]
+    assert diff.change_mask.to_dict('records') == [{'value': True, 'cat': False}]
+    assert len(diff.cell_changes(limit=0)) == 0
@@ -0,0 +1,190 @@
+import ftplib
+import os
+import pytest
+import common
+from common import ftp_pool
+
+
+class FakeFTP:
+    """Minimal stand-in for ftplib.FTP that records the commands sent to it."""
+    instances = []
+    existing_dirs = {'/home'}
+    stored = []
+    fail_once = set()
+
+    def __init__(self, server):
+        self.server = server
+        self.cwd_path = '/home'
+        self.broken = False
+        self.closed = False
+        self.commands = []
+        FakeFTP.instances.append(self)
+
+    def login(self, user, password):
+        self.commands.append(('login', user))
+
+    def pwd(self):
+        return self.cwd_path
+
+    def cwd(self, path):
+        if self.broken:
+            raise EOFError()
+        new_path = os.path.normpath(os.path.join(self.cwd_path, path))
+        if new_path not in FakeFTP.existing_dirs:
+            raise ftplib.error_perm('550 No such directory')
+        self.cwd_path = new_path
+
+    def mkd(self, path):
+        FakeFTP.existing_dirs.add(os.path.normpath(os.path.join(self.cwd_path, path)))
+
+    def storbinary(self, cmd, f):
+        remote_file = os.path.join(self.cwd_path, cmd.split(' ', 1)[1])
+        if remote_file in FakeFTP.fail_once:
+            FakeFTP.fail_once.remove(remote_file)
+            raise ftplib.error_temp('451 Transfer aborted')
+        FakeFTP.stored.append(remote_file)
+
+    def delete(self, name):
+        FakeFTP.stored.remove(os.path.join(self.cwd_path, name))
+
+    def voidcmd(self, cmd):
+        if self.broken:
+            raise ftplib.error_temp('421 Timeout')
+        self.commands.append(cmd)
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def fake_ftp(monkeypatch):
+    FakeFTP.instances = []
+    FakeFTP.existing_dirs = {'/', '/home'}
+    FakeFTP.stored = []
+    FakeFTP.fail_once = set()
+    monkeypatch.setattr(ftp_pool.ftplib, 'FTP', FakeFTP)
+    ftp_pool.close_all()
+    monkeypatch.setattr(ftp_pool, '_stats', {'opened': 0, 'reused': 0, 'discarded': 0})
+    yield
+    ftp_pool.close_all()
+
+
+def test_connection_is_reused():
+    with ftp_pool.session('server', 'user', 'pass') as ftp1:
+        ftp1.cwd('/')
+    with ftp_pool.session('server', 'user', 'pass') as ftp2:
+        assert ftp2.pwd() == '/home'
+    assert ftp1 is ftp2
+    assert 'NOOP' in ftp2.commands
+    stats = ftp_pool.get_stats()
+    assert stats['opened'] == 1
+    assert stats['reused'] == 1
+
+
+def test_pool_is_keyed_by_server_and_user():
+    with ftp_pool.session('server', 'user', 'pass') as ftp1:
+        pass
+    with ftp_pool.session('server', 'other_user', 'pass') as ftp2:
+        pass
+    assert ftp1 is not ftp2
+    assert ftp_pool.get_stats()['opened'] == 2
+
+
+def test_concurrent_sessions_use_separate_connections():
+    with ftp_pool.session('server', 'user', 'pass') as ftp1:
+        with ftp_pool.session('server', 'user', 'pass') as ftp2:
+            assert ftp1 is not ftp2
+    assert ftp_pool.get_stats()['idle'] == 2
+
+
+def test_broken_connection_is_replaced():
+    with ftp_pool.session('server', 'user', 'pass') as ftp1:
+        pass
+    ftp1.broken = True
+    with ftp_pool.session('server', 'user', 'pass') as ftp2:
+        pass
+    assert ftp1 is not ftp2
+    assert ftp1.closed
+    stats = ftp_pool.get_stats()
+    assert stats['opened'] == 2
+    assert stats['discarded'] == 1
+
+
+def test_connection_is_discarded_on_error():
+    with pytest.raises(EOFError):
+        with ftp_pool.session('server', 'user', 'pass') as ftp:
+            raise EOFError()
+    assert ftp.closed
+    assert ftp_pool.get_stats()['idle'] == 0
+
+
+@pytest.fixture
+def local_files(tmp_path):
+    files = []
+    for i in range(5):
+        file_path = os.path.join(tmp_path, f'file_{i}.csv')
+        with open(file_path, 'w') as f:
+            f.write(f'{i}')
+        files.append(file_path)
+    return files
+
+
+def test_upload_ftp_many_creates_dirs_and_uploads(local_files):
+    remote_dir_map = {f: 'data/even' if i % 2 == 0 else 'data/odd' for i, f in enumerate(local_files)}
+    results = common.upload_ftp_many(local_files, 'server', 'user', 'pass', remote_dir_map, workers=3)
+    assert all(r['ok'] for r in results)
+    assert {'/home/data', '/home/data/even', '/home/data/odd'} <= FakeFTP.existing_dirs
+    assert sorted(FakeFTP.stored) == sorted(f'/home/{remote_dir_map[f]}/{os.path.basename(f)}' for f in local_files)
+    assert ftp_pool.get_stats()['opened'] <= 3
+
+
+def test_upload_ftp_many_retries_only_failed_files(local_files):
+    FakeFTP.existing_dirs.add('/home/data')
+    FakeFTP.fail_once.add('/home/data/file_2.csv')
+    results = common.upload_ftp_many(local_files, 'server', 'user', 'pass', 'data', workers=2, delay=0)
+    assert all(r['ok'] for r in results)
+    assert [r['tries'] for r in results] == [1, 1, 2, 1, 1]
+    assert len(FakeFTP.stored) == len(local_files)
+
+
+def test_sync_dir_to_ftp_skips_unchanged_files(local_files, tmp_path, monkeypatch):
+    monkeypatch.setattr(common.change_tracking, 'get_check_file_dir', lambda: os.path.join(tmp_path, 'change_tracking'))
+    result = common.sync_dir_to_ftp(str(tmp_path), 'server', 'user', 'pass', 'data', pattern='*.csv')
+    assert result['uploaded'] == local_files
+    result = common.sync_dir_to_ftp(str(tmp_path), 'server', 'user', 'pass', 'data', pattern='*.csv')
+    assert result['uploaded'] == []
+    with open(local_files[1], 'w') as f:
+        f.write('changed')
+    # Rewriting a file with identical content changes its modification time, but not its hash
+    with open(local_files[2], 'w') as f:
+        f.write('2')
+    result = common.sync_dir_to_ftp(str(tmp_path), 'server', 'user', 'pass', 'data', pattern='*.csv')
+    assert result['uploaded'] == [local_files[1]]
+    assert len(FakeFTP.stored) == len(local_files) + 1
+
+
+def test_sync_dir_to_ftp_deletes_orphans(local_files, tmp_path, monkeypatch):
+    monkeypatch.setattr(common.change_tracking, 'get_check_file_dir', lambda: os.path.join(tmp_path, 'change_tracking'))
+    common.sync_dir_to_ftp(str(tmp_path), 'server', 'user', 'pass', 'data', pattern='*.csv')
+    os.remove(local_files[0])
+    result = common.sync_dir_to_ftp(str(tmp_path), 'server', 'user', 'pass', 'data', pattern='*.csv')
+    assert result['deleted'] == []
+    result = common.sync_dir_to_ftp(str(tmp_path), 'server', 'user', 'pass', 'data', pattern='*.csv',
+                                    delete_orphans=True)
+    assert result['deleted'] == ['file_0.csv']
+    assert '/home/data/file_0.csv' not in FakeFTP.stored
+
+
+def test_missing_local_file_is_not_retried(local_files, monkeypatch):
+    def no_sleep(seconds):
+        raise AssertionError('A missing local file must not be retried')
+
+    monkeypatch.setattr(common.time, 'sleep', no_sleep)
+    os.remove(local_files[0])
+    with pytest.raises(FileNotFoundError):
+        common.upload_ftp(local_files[0], 'server', 'user', 'pass', '/home')
+    with pytest.raises(FileNotFoundError):
+        common.upload_ftp_many(local_files, 'server', 'user', 'pass', '/home', delay=0)
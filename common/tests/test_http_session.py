@@ -0,0 +1,87 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from common import http_session
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves a fixed body with an ETag and answers 304 if the client already has it."""
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        etag = f'"{self.server.version}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = f'id;name\n1;version {self.server.version}\n'.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.requests = []
+    server.version = 1
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def test_cached_get_reuses_unchanged_body(stub_server, tmp_path):
+    url = f'http://127.0.0.1:{stub_server.server_port}/download'
+    r1 = http_session.cached_get(url, params={'dataset': '100307'}, cache_dir=str(tmp_path))
+    r2 = http_session.cached_get(url, params={'dataset': '100307'}, cache_dir=str(tmp_path))
+    assert not r1.from_cache
+    assert r2.from_cache
+    assert r2.text == r1.text == 'id;name\n1;version 1\n'
+    assert stub_server.requests[1]['If-None-Match'] == '"1"'
+    stub_server.version = 2
+    r3 = http_session.cached_get(url, params={'dataset': '100307'}, cache_dir=str(tmp_path))
+    assert not r3.from_cache
+    assert r3.text == 'id;name\n1;version 2\n'
+
+
+def test_cache_is_keyed_by_params(stub_server, tmp_path):
+    url = f'http://127.0.0.1:{stub_server.server_port}/download'
+    http_session.cached_get(url, params={'dataset': '100307'}, cache_dir=str(tmp_path))
+    r = http_session.cached_get(url, params={'dataset': '100231'}, cache_dir=str(tmp_path))
+    assert not r.from_cache
+    assert 'If-None-Match' not in stub_server.requests[1]
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    for i, name in enumerate(['old', 'new']):
+        for ext in ['body', 'json']:
+            file_name = os.path.join(tmp_path, f'{name}.{ext}')
+            with open(file_name, 'wb') as f:
+                f.write(b'x' * 10)
+            os.utime(file_name, (i, i))
+    http_session.evict(str(tmp_path), max_cache_bytes=15)
+    assert sorted(os.listdir(tmp_path)) == ['new.body', 'new.json']
+
+
+def test_download_file_skips_unchanged_body(stub_server, tmp_path):
+    url = f'http://127.0.0.1:{stub_server.server_port}/bs.zip'
+    file_name = os.path.join(tmp_path, 'data_orig', 'bs.zip')
+    assert http_session.download_file(url, file_name, chunk_size=4)
+    assert not http_session.download_file(url, file_name)
+    assert stub_server.requests[1]['If-None-Match'] == '"1"'
+    stub_server.version = 2
+    assert http_session.download_file(url, file_name)
+    with open(file_name, 'rb') as f:
+        assert f.read() == b'id;name\n1;version 2\n'
+    # Without the file, the validators are not sent
+    os.remove(file_name)
+    assert http_session.download_file(url, file_name)
+    assert 'If-None-Match' not in stub_server.requests[3]
@@ -0,0 +1,81 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import pytest
+import requests
+from common import ods_realtime
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Stub of the ODS realtime API, fails the first request containing a record with id 'fail_once' with http 503."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            if not self.server.accept_gzip:
+                return self.respond(415)
+            body = gzip.decompress(body)
+        records = json.loads(body)
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            if any(r['id'] == 'fail_once' for r in records) and not self.server.failed:
+                self.server.failed = True
+                return self.respond(503)
+            self.server.records.extend(records)
+        self.respond(200)
+
+    def respond(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.records = []
+    server.failed = False
+    server.accept_gzip = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def create_client(server, **kwargs):
+    url = f'http://127.0.0.1:{server.server_port}/api/push/1.0/100000/realtime/push/?pushkey=secret'
+    return ods_realtime.RealtimePushClient(url, delay=0, session=requests.Session(), **kwargs)
+
+
+def test_chunk_payloads_respects_rows_and_bytes():
+    df = pd.DataFrame({'id': [str(i) for i in range(10)], 'value': ['x' * 10] * 10})
+    client = ods_realtime.RealtimePushClient('https://example.com/push/', max_rows=4, session=requests.Session())
+    payloads = client.chunk_payloads(df)
+    assert [len(json.loads(p)) for p in payloads] == [4, 4, 2]
+    assert [r for p in payloads for r in json.loads(p)] == json.loads(df.to_json(orient='records'))
+    client.max_bytes = 100
+    assert all(len(p) <= 100 for p in client.chunk_payloads(df))
+
+
+def test_push_retries_only_failed_chunk(stub_server):
+    df = pd.DataFrame({'id': [str(i) for i in range(9)] + ['fail_once'], 'value': range(10)})
+    stats = create_client(stub_server, max_rows=3).push(df)
+    assert sorted(r['id'] for r in stub_server.records) == sorted(df['id'])
+    assert stats['chunks'] == 4
+    assert stats['requests'] == 5
+    assert all('pushkey=secret' in path for path in stub_server.requests)
+
+
+def test_push_falls_back_to_uncompressed(stub_server):
+    stub_server.accept_gzip = False
+    df = pd.DataFrame({'id': [str(i) for i in range(5)], 'value': range(5)})
+    create_client(stub_server, max_rows=2, max_in_flight=1, use_gzip=True).push(df)
+    assert len(stub_server.records) == 5
@@ -0,0 +1,67 @@
+import pytest
+import common
+from common import paginated_api
+
+
+class FakeApi:
+    """Returns the records with a timestamp of at least start_time, or the requested page, sorted by timestamp."""
+
+    def __init__(self, timestamps):
+        self.records = [{'id': i, 'ts': ts} for i, ts in enumerate(timestamps)]
+        self.requests = []
+
+    def requests_get(self, url, params, auth=None, headers=None):
+        self.requests.append(params)
+        if 'start_time' in params:
+            records = [r for r in self.records if r['ts'] >= params['start_time']][:params['size']]
+        else:
+            page_start = (params['page'] - 1) * params['size']
+            records = self.records[page_start:page_start + params['size']]
+        return Response({'results': records})
+
+
+class Response:
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    # Several records share a timestamp, one of them at the end of the first page
+    api = FakeApi(['01', '02', '03', '03', '03', '04', '05', '06', '07'])
+    monkeypatch.setattr(common, 'requests_get', api.requests_get)
+    return api
+
+
+def test_iter_by_timestamp_returns_each_record_once(fake_api):
+    client = paginated_api.PaginatedClient('https://api/detections', page_size=4, record_path='results')
+    df = client.fetch_by_timestamp({'sort': 'ts'}, start_param='start_time', timestamp_field='ts', start='02')
+    assert df['id'].tolist() == list(range(1, 9))
+    assert [params['start_time'] for params in fake_api.requests] == ['02', '03', '04', '07']
+
+
+def test_iter_by_timestamp_raises_if_page_is_too_small(fake_api):
+    client = paginated_api.PaginatedClient('https://api/detections', page_size=2, record_path='results')
+    with pytest.raises(RuntimeError):
+        client.fetch_by_timestamp({}, start_param='start_time', timestamp_field='ts', start='03')
+
+
+def test_iter_by_page_fetches_pages_concurrently(fake_api):
+    client = paginated_api.PaginatedClient('https://api/charges', page_size=2, record_path='results', max_workers=3)
+    pages = list(client.iter_by_page({}, page_param='page', first_page=1))
+    assert [page['id'].tolist() for page in pages] == [[0, 1], [2, 3], [4, 5], [6, 7], [8]]
+    assert sorted(params['page'] for params in fake_api.requests) == [1, 2, 3, 4, 5, 6]
+
+
+def test_high_water_mark_is_persisted(tmp_path):
+    state_file = str(tmp_path / 'data' / 'high_water_marks.json')
+    paginated_api.HighWaterMark(state_file).set('vehicles', '2022-02-02T08:44:13.875+01:00')
+    high_water_mark = paginated_api.HighWaterMark(state_file)
+    assert high_water_mark.get('vehicles') == '2022-02-02T08:44:13.875+01:00'
+    assert high_water_mark.get('noise_levels', 'default') == 'default'
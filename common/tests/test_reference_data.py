@@ -0,0 +1,73 @@
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from common import reference_data
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves the metadata and the csv export of dataset 100042 like the ODS explore API."""
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path.startswith('/100042/exports/csv'):
+            body = ('\ufeffwov_id;wov_name;einwohner;flaeche;aktiv\n'
+                    f'01;Altstadt Grossbasel;{self.server.version};;True\n'
+                    '02;Vorstädte;5000;1.5;False\n').encode('utf-8')
+        elif self.path == '/100042':
+            body = json.dumps({'metas': {'default': {'data_processed': f'2024-0{self.server.version}-01T00:00:00+00:00'}}}).encode('utf-8')
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.requests = []
+    server.version = 1
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(reference_data, 'ODS_API_URL', f'http://127.0.0.1:{server.server_port}')
+    yield server
+    server.shutdown()
+
+
+def test_dtypes_as_read_csv(stub_server, tmp_path):
+    df = reference_data.get_dataset('100042', dtype={'wov_id': 'str'}, snapshot_dir=str(tmp_path))
+    assert df['wov_id'].tolist() == ['01', '02']
+    assert df['einwohner'].dtype == 'int64'
+    assert df['flaeche'].dtype == 'float64'
+    assert df['flaeche'].isna().tolist() == [True, False]
+    assert df['aktiv'].dtype == bool
+    assert df['wov_name'].tolist() == ['Altstadt Grossbasel', 'Vorstädte']
+
+
+def test_snapshot_is_downloaded_once_per_ttl(stub_server, tmp_path):
+    reference_data.get_dataset('100042', snapshot_dir=str(tmp_path))
+    reference_data.get_dataset('100042', snapshot_dir=str(tmp_path))
+    assert stub_server.requests == ['/100042', '/100042/exports/csv?delimiter=%3B']
+    # After the TTL, only the metadata is requested as long as data_processed did not change
+    df = reference_data.get_dataset('100042', ttl=timedelta(0), snapshot_dir=str(tmp_path))
+    assert stub_server.requests[2:] == ['/100042']
+    assert df['einwohner'].tolist() == [1, 5000]
+    stub_server.version = 2
+    df = reference_data.get_dataset('100042', ttl=timedelta(0), snapshot_dir=str(tmp_path))
+    assert stub_server.requests[3:] == ['/100042', '/100042/exports/csv?delimiter=%3B']
+    assert df['einwohner'].tolist() == [2, 5000]
+
+
+def test_columns_are_selected(stub_server, tmp_path):
+    df = reference_data.get_dataset('100042', columns=['wov_id', 'wov_name'], dtype={'wov_id': str},
+                                    snapshot_dir=str(tmp_path))
+    assert df.columns.tolist() == ['wov_id', 'wov_name']
+    assert df['wov_id'].tolist() == ['01', '02']
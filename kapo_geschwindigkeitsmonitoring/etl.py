@@ -180,10 +180,11 @@ def create_measurements_df(df_meta_raw, df_metadata_per_direction):
                 raw_df.to_csv(filename_current_measure, index=False)
                 files_to_upload.append({'filename': filename_current_measure, 'dataset_id': row['dataset_id']})
 
+    common.upload_ftp_many(files=[obj['filename'] for obj in files_to_upload], server=credentials.ftp_server,
+                           user=credentials.ftp_user, password=credentials.ftp_pass,
+                           remote_dir_map={obj['filename']: f'{credentials.ftp_remote_path_data}/{obj["dataset_id"]}'
+                                           for obj in files_to_upload})
     for obj in files_to_upload:
-        common.upload_ftp(filename=obj['filename'], server=credentials.ftp_server, user=credentials.ftp_user,
-                          password=credentials.ftp_pass,
-                          remote_path=f'{credentials.ftp_remote_path_data}/{obj["dataset_id"]}')
         os.remove(obj['filename'])
 
     logging.info(f'Creating index on Richtung ID...')
@@ -198,9 +199,7 @@ def create_measurements_df(df_meta_raw, df_metadata_per_direction):
     logging.info(f'All data processed and saved to {db_filename} and {pkl_filename}...')
     if ct.has_changed(filename=pkl_filename, method='hash'):
         common.upload_ftp(db_filename, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass, '')
-        odsp.publish_ods_dataset_by_id('100097')
-        odsp.publish_ods_dataset_by_id('100200')
-        odsp.publish_ods_dataset_by_id('100358')
+        odsp.publish_ods_datasets_by_id(['100097', '100200', '100358'])
         ct.update_hash_file(pkl_filename)
 
     return all_df
@@ -210,14 +209,17 @@ def create_measures_per_year(all_df):
     # Create a separate data file per year
     all_df['messbeginn_jahr'] = all_df.Messbeginn.astype(str).str.slice(0, 4).astype(int)
     all_years = all_df.messbeginn_jahr.unique()
+    files_to_upload = []
     for year in all_years:
         year_data = all_df[all_df.messbeginn_jahr.eq(year)]
         logging.info(f"Number of rows in {year}: {year_data.shape[0]}")
         current_filename = os.path.join(credentials.path, credentials.filename.replace('.csv', f'_{str(year)}.csv'))
         logging.info(f'Saving {current_filename}...')
         year_data.to_csv(current_filename, index=False)
-        common.upload_ftp(filename=current_filename, server=credentials.ftp_server, user=credentials.ftp_user,
-                          password=credentials.ftp_pass, remote_path=credentials.ftp_remote_path_all_data)
+        files_to_upload.append(current_filename)
+    common.sync_files_to_ftp(files=files_to_upload, server=credentials.ftp_server, user=credentials.ftp_user,
+                             password=credentials.ftp_pass, remote_dir_map=credentials.ftp_remote_path_all_data)
+    for current_filename in files_to_upload:
         os.remove(current_filename)
 
 
@@ -1,10 +1,8 @@
 import logging
 import os
-import io
 import time
 import json
 import pandas as pd
-import zipfile
 from tqdm import tqdm
 
 from geopy.distance import geodesic
@@ -15,6 +13,7 @@ import geopandas as gpd
 from shapely.geometry import Point
 
 import common
+from common import reference_data
 import ods_publish.etl_id as odsp
 from common import change_tracking as ct
 from common import email_message
@@ -168,23 +167,13 @@ def append_coordinates(df):
 
 
 def get_gebaeudeeingaenge():
-    raw_data_file = os.path.join(credentials.export_path, 'gebaeudeeingaenge.csv')
-    logging.info(f'Downloading Gebäudeeingänge from ods to file {raw_data_file}...')
-    r = common.requests_get(f'https://data.bs.ch/api/records/1.0/download?dataset=100231')
-    with open(raw_data_file, 'wb') as f:
-        f.write(r.content)
-    return pd.read_csv(raw_data_file, sep=';')
+    logging.info(f'Getting Gebäudeeingänge from the local snapshot of ods dataset 100231...')
+    return reference_data.get_dataset('100231')
 
 
 def get_street_shapes():
-    path_to_folder = os.path.join(credentials.export_path, 'streets')
-    logging.info(f'Downloading street shapes from ods to file {path_to_folder}...')
-    r = common.requests_get(f'https://data.bs.ch/explore/dataset/100189/download/?format=shp')
-    z = zipfile.ZipFile(io.BytesIO(r.content))
-    z.extractall(path_to_folder)
-    path_to_shp = os.path.join(path_to_folder, '100189.shp')
-    gdf = gpd.read_file(path_to_shp, encoding='utf-8')
-    return gdf
+    logging.info(f'Getting street shapes from the local snapshot of ods dataset 100189...')
+    return reference_data.get_geodataset('100189')
 
 
 def get_coordinates_from_gwr(df, df_geb_eing):
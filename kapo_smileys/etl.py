@@ -1,9 +1,9 @@
 import glob
 import logging
 import os
-import shapefile  # library pyshp
 import sqlite3
 import common
+from common import reference_data
 import pandas as pd
 import pytz
 from datetime import timedelta
@@ -11,8 +11,6 @@ import numpy as np
 from common import change_tracking as ct
 import ods_publish.etl_id as odsp
 from kapo_smileys import credentials
-import zipfile
-import io
 
 
 def csv_to_sqlite(curr_dir, export_file_all):
@@ -69,17 +67,6 @@ def csv_to_sqlite(curr_dir, export_file_all):
     conn.close()
 
 
-# see https://gist.github.com/aerispaha/f098916ac041c286ae92d037ba5c37ba
-def read_shapefile(shp_path):
-    sf = shapefile.Reader(shp_path)
-    fields = [x[0] for x in sf.fields][1:]
-    records = sf.records()
-    points = [s.points for s in sf.shapes()]
-    df = pd.DataFrame(columns=fields, data=records)
-    df = df.assign(coords=points)
-    return df
-
-
 def parse_messdaten(curr_dir, df_einsatz_days, df_einsaetze):
     any_changes = False
     messdaten_path = os.path.join(curr_dir, 'data_orig', 'Datenablage')
@@ -140,6 +127,7 @@ def parse_single_messdaten_folder(curr_dir, folder, df_einsatz_days, df_einsatze
     # Go recursively into folders until TXT files are found
     tagesdaten_files = glob.glob(os.path.join(folder, '**', '*.TXT'), recursive=True)
     messdaten_dfs_pro_standort = []
+    files_to_upload = {}
     for f in tagesdaten_files:
         logging.info(f'Parsing Messdaten File {f}...')
         # p = re.compile(r'Datenablage\\\\(?P<idstandort>\d+)_')
@@ -185,9 +173,11 @@ def parse_single_messdaten_folder(curr_dir, folder, df_einsatz_days, df_einsatze
         export_file_single = os.path.join(curr_dir, 'data', f'{day_str}_{id_standort}.csv')
         df_m.to_csv(export_file_single, index=False)
         if not df_m.empty:
-            common.upload_ftp(export_file_single, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass,
-                              f'kapo/smileys/data/zyklus{int(df_m.Zyklus.iloc[0])}')
-            os.remove(export_file_single)
+            files_to_upload[export_file_single] = f'kapo/smileys/data/zyklus{int(df_m.Zyklus.iloc[0])}'
+    common.sync_files_to_ftp(list(files_to_upload), credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass,
+                             files_to_upload)
+    for export_file_single in files_to_upload:
+        os.remove(export_file_single)
     df_all_pro_standort = pd.concat(messdaten_dfs_pro_standort)
 
     if len(df_all_pro_standort.id_standort.unique()) > 1:
@@ -281,21 +271,16 @@ def main():
     curr_dir = os.path.dirname(os.path.realpath(__file__))
     logging.info(f'Parsing Einsatzplaene...')
     df_einsaetze = parse_einsatzplaene(curr_dir)
-    req = common.requests_get(
-        'https://data.bs.ch/api/explore/v2.1/catalog/datasets/100286/exports/shp')
-    shp_path = os.path.join(curr_dir, 'data', 'Smiley-Standorte')
-    zip_file = io.BytesIO(req.content)
-    with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-        zip_ref.extractall(shp_path)
-    shp_coords_df = read_shapefile(os.path.join(shp_path, '100286.shp'))
+    df_standorte = reference_data.get_dataset('100286', columns=['idstandort', 'geo_point_2d'])
     # Convert idstandort to int
-    shp_coords_df['idstandort'] = shp_coords_df.idstandort.astype(int)
-    df_einsaetze = pd.merge(df_einsaetze, shp_coords_df[['idstandort', 'coords']],
+    df_standorte['idstandort'] = df_standorte.idstandort.astype(int)
+    df_einsaetze = pd.merge(df_einsaetze, df_standorte.rename(columns={'geo_point_2d': 'standort_point'}),
                             how='left', left_on='id_Standort', right_on='idstandort').drop(columns=['idstandort'])
     logging.info(f'Creating df_einsatz_days with one row per day and standort_id...')
-    df_einsaetze['geo_point_2d'] = df_einsaetze[df_einsaetze['coords'].notna()]['coords'].apply(
-        lambda x: f'{x[0][1]}, {x[0][0]}')
-    df_einsaetze = df_einsaetze.drop(columns=['coords'])
+    # Formatted as "lat, lon" with the shortest representation of the float values
+    df_einsaetze['geo_point_2d'] = df_einsaetze[df_einsaetze['standort_point'].notna()]['standort_point'].apply(
+        lambda x: ', '.join(str(float(c)) for c in x.split(',')))
+    df_einsaetze = df_einsaetze.drop(columns=['standort_point'])
     df_einsaetze = df_einsaetze.dropna(subset=['Start_Vormessung', 'Start_Betrieb', 'Start_Nachmessung', 'Ende'])
     df_einsatz_days = pd.concat([pd.DataFrame({'id_standort': row.id_Standort, 'Zyklus': row.Zyklus,
                                                'datum_aktiv': pd.date_range(row.Start_Vormessung, row.Ende, freq='D',
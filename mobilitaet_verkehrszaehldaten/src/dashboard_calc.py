@@ -1,14 +1,203 @@
 import os
 import io
 import json
+import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import pandas as pd
 
 import common
-from common import change_tracking as ct
 from mobilitaet_verkehrszaehldaten import credentials
+from mobilitaet_verkehrszaehldaten.src import parquet_store
 
 
-def create_files_for_dashboard(df, filename, dest_path):
+CATEGORIES = {
+    'MIV_Speed.csv': ['Total', '<20', '20-30', '30-40', '40-50', '50-60', '60-70',
+                      '70-80', '80-90', '90-100', '100-110', '110-120', '120-130', '>130'],
+    'MIV_Class_10_1.csv': ['Total', 'MR', 'PW', 'PW+', 'Lief', 'Lief+', 'Lief+Aufl.',
+                           'LW', 'LW+', 'Sattelzug', 'Bus', 'andere'],
+    'Velo_Fuss_Count.csv': ['Total']
+}
+TRAFFIC_TYPES = ['MIV', 'Velo', 'Fussgänger']
+# The hourly aggregates of a site all dashboard files are derived from
+CELL_COLUMNS = ['Date', 'Direction_LaneName', 'HourFrom']
+
+
+class SiteAggregateState:
+    """
+    Persisted aggregates of one site and traffic type: the sums of the categories per date, direction, lane and
+    hour (the cells), and a fingerprint (number of rows and sum of the row hashes) of the raw rows of each date.
+
+    update() only aggregates the rows of dates whose fingerprint changed, which in daily runs are the last few days.
+    """
+
+    def __init__(self, dest_path, subfolder, site, load=True):
+        self.state_dir = os.path.join(dest_path, 'dashboard_state', subfolder, str(site))
+        self.cells_file = os.path.join(self.state_dir, 'cells.parquet')
+        self.fingerprints_file = os.path.join(self.state_dir, 'fingerprints.parquet')
+        self.cells = None
+        self.fingerprints = pd.DataFrame({'RowCount': pd.Series(dtype='int64'), 'RowHash': pd.Series(dtype='uint64')},
+                                         index=pd.Index([], dtype=object, name='Date'))
+        if load and os.path.exists(self.cells_file) and os.path.exists(self.fingerprints_file):
+            self.cells = pd.read_parquet(self.cells_file)
+            self.fingerprints = pd.read_parquet(self.fingerprints_file)
+
+    def update(self, site_data, categories, years=None) -> bool:
+        """
+        Updates the cells with the dates of site_data that changed, only comparing the dates of the given years
+        (all dates if years is None or there is no state yet). Returns True if any cell changed.
+        """
+        rows = site_data
+        if years is not None and self.cells is not None:
+            rows = site_data[site_data['Year'].isin(years)]
+        fingerprints = get_date_fingerprints(rows)
+        old_fingerprints = self.fingerprints
+        if rows is not site_data:
+            old_fingerprints = old_fingerprints[old_fingerprints.index.str[:4].astype(int).isin(years)]
+        compared = fingerprints.join(old_fingerprints, how='left', rsuffix='_old')
+        changed_dates = compared.index[(compared['RowCount'] != compared['RowCount_old']) |
+                                       (compared['RowHash'] != compared['RowHash_old'])]
+        removed_dates = old_fingerprints.index.difference(fingerprints.index)
+        if changed_dates.empty and removed_dates.empty:
+            return False
+        logging.info(f'{len(changed_dates)} dates changed and {len(removed_dates)} were removed in {self.state_dir}...')
+
+        raw_dates = pd.to_datetime(changed_dates, format='%Y-%m-%d').strftime('%d.%m.%Y')
+        new_cells = aggregate_cells(rows[rows['Date'].isin(raw_dates)], categories)
+        cells = new_cells
+        updated_dates = changed_dates.union(removed_dates)
+        if self.cells is not None:
+            kept_cells = self.cells[~self.cells['Date'].isin(updated_dates)]
+            cells = pd.concat([kept_cells, new_cells], ignore_index=True)
+        self.cells = cells.iloc[cells['Date'].argsort(kind='stable')].reset_index(drop=True)
+        kept_fingerprints = self.fingerprints[~self.fingerprints.index.isin(updated_dates)]
+        self.fingerprints = pd.concat([kept_fingerprints, fingerprints.loc[changed_dates]]).sort_index()
+        return True
+
+    def save(self):
+        for df, file in [(self.cells, self.cells_file), (self.fingerprints, self.fingerprints_file)]:
+            with common.atomic_write(file) as tmp_file:
+                df.to_parquet(tmp_file)
+
+
+def get_date_fingerprints(rows) -> pd.DataFrame:
+    """Returns the number of rows and the sum of the row hashes per date (formatted like '2022-01-01')."""
+    hashes = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+    fingerprints = (pd.DataFrame({'Date': rows['Date'].to_numpy(), 'RowHash': hashes})
+                    .groupby('Date')['RowHash'].agg(['size', 'sum'])
+                    .rename(columns={'size': 'RowCount', 'sum': 'RowHash'}))
+    fingerprints.index = pd.to_datetime(fingerprints.index, format='%d.%m.%Y').strftime('%Y-%m-%d').rename('Date')
+    return fingerprints
+
+
+def aggregate_cells(rows, categories) -> pd.DataFrame:
+    """Sums up the categories per date, direction, lane and hour, and counts the measures (distinct DateTimeFrom)."""
+    rows = rows.assign(
+        Date=pd.to_datetime(rows['Date'], format='%d.%m.%Y').dt.strftime('%Y-%m-%d'),
+        Direction_LaneName=rows['DirectionName'].astype(str) + '#' + rows['LaneName'].astype(str))
+    grouped = rows.groupby(CELL_COLUMNS, sort=False)
+    cells = grouped[categories].sum()
+    cells['NumMeasures'] = grouped['DateTimeFrom'].nunique()
+    return cells.reset_index()
+
+
+def get_cell_date_time_from(cells) -> pd.Series:
+    return pd.to_datetime(cells['Date'], format='%Y-%m-%d') + pd.to_timedelta(cells['HourFrom'], unit='h')
+
+
+def get_subfolder(traffic_type, filename) -> str:
+    if traffic_type == 'Fussgänger':
+        return 'Fussgaenger'
+    if filename == 'MIV_Speed.csv':
+        return 'MIV_Speed'
+    return traffic_type
+
+
+def create_site_files(site_data, site, filename, dest_path, years=None, rebuild=False) -> tuple:
+    """
+    Updates the aggregate states of one site, one per traffic type, and creates the files of the states that changed.
+
+    Parameters:
+    - site_data (pd.DataFrame): All rows of the site.
+    - site (str): Site identifier.
+    - filename (str): The name of the file to process.
+    - dest_path (str): The destination path where the files will be saved.
+    - years (set): Years that changed since the last run, None to compare all dates with the states.
+    - rebuild (bool): Ignore the persisted states and aggregate all dates.
+
+    Returns:
+    - tuple: Remote path per created file, and the changed states to save once the files are uploaded.
+    """
+    files_to_upload = {}
+    changed_states = []
+    for traffic_type, positions in site_data.groupby('TrafficType', observed=True, sort=False).indices.items():
+        if traffic_type not in TRAFFIC_TYPES:
+            continue
+        traffic_type_data = site_data.iloc[positions]
+        subfolder = get_subfolder(traffic_type, filename)
+        state = SiteAggregateState(dest_path, subfolder, site, load=not rebuild)
+        if not state.update(traffic_type_data, CATEGORIES[filename], years):
+            continue
+
+        # Save the original site data
+        current_filename = os.path.join(dest_path, 'sites', subfolder, f'{str(site)}.csv')
+        print(f'Saving {current_filename}...')
+        traffic_type_data.to_csv(current_filename, sep=';', encoding='utf-8', index=False)
+
+        # Perform aggregations
+        remote_path = f'verkehrszaehl_dashboard/data/{subfolder}'
+        for current_filename in aggregate_hourly(state.cells, CATEGORIES, dest_path, subfolder, site, filename):
+            files_to_upload[current_filename] = remote_path
+        files_to_upload[aggregate_daily(state.cells, CATEGORIES, dest_path, subfolder, site, filename)] = remote_path
+        files_to_upload[aggregate_monthly(state.cells, CATEGORIES, dest_path, subfolder, site, filename)] = remote_path
+        files_to_upload[aggregate_yearly(state.cells, CATEGORIES, dest_path, subfolder, site, filename)] = remote_path
+        changed_states.append(state)
+    return files_to_upload, changed_states
+
+
+def create_site_files_from_store(store_root, dtypes, site, filename, dest_path, years=None, rebuild=False) -> tuple:
+    """
+    Runs create_site_files() in a worker process. The rows of the site are read memory-mapped from the partitions of
+    the site in the Parquet store instead of being pickled, dtypes restores the columns of the DataFrame of the job.
+    """
+    site_data = parquet_store.PartitionedStore(store_root).read(filters=[('Zst_id', '=', site)])
+    site_data = site_data[list(dtypes.index)].astype(dtypes.to_dict())
+    return create_site_files(site_data, site, filename, dest_path, years, rebuild)
+
+
+def create_files_for_sites(df, filename, dest_path, changed_years=None, store=None, workers=1, rebuild=False) -> tuple:
+    """
+    Creates the files of all sites, or of the sites in changed_years (a set of changed years per site), serially or in
+    worker processes. See create_files_for_dashboard() for the parameters.
+
+    Returns:
+    - tuple: Remote path per created file, and the changed states to save once the files are uploaded.
+    """
+    # Partition the data by site in one pass
+    positions_by_site = df.groupby('Zst_id', observed=True, sort=False).indices
+    sites = [site for site in positions_by_site if changed_years is None or site in changed_years]
+    years = [None if changed_years is None else changed_years[site] for site in sites]
+    if workers > 1 and store is not None:
+        logging.info(f'Creating the files of {len(sites)} sites in {workers} processes...')
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(create_site_files_from_store, repeat(store.root), repeat(df.dtypes), sites,
+                                        repeat(filename), repeat(dest_path), years, repeat(rebuild)))
+    else:
+        results = [create_site_files(df.iloc[positions_by_site[site]], site, filename, dest_path, site_years, rebuild)
+                   for site, site_years in zip(sites, years)]
+
+    # Collect the generated files per remote folder to upload them in one batch
+    files_to_upload = {}
+    changed_states = []
+    for site_files, site_states in results:
+        files_to_upload.update(site_files)
+        changed_states.extend(site_states)
+    return files_to_upload, changed_states
+
+
+def create_files_for_dashboard(df, filename, dest_path, changed_partitions=None, store=None, workers=1,
+                               rebuild=False):
     """
     Creates JSON files for the dashboard based on the provided DataFrame.
 
@@ -16,53 +205,28 @@ def create_files_for_dashboard(df, filename, dest_path):
     - df (pd.DataFrame): The input DataFrame containing the data.
     - filename (str): The name of the file to process.
     - dest_path (str): The destination path where JSON files will be saved.
+    - changed_partitions (list): (Year, Zst_id) partitions that changed since the last run, None to check all sites.
+    - store (parquet_store.PartitionedStore): Store of df, the worker processes read the rows of their sites from it.
+    - workers (int): Number of processes creating the files of the sites, requires store if larger than 1.
+    - rebuild (bool): Ignore the persisted aggregate states and create the files of all sites.
     """
-    # Define categories based on filename
-    categories = {
-        'MIV_Speed.csv': ['Total', '<20', '20-30', '30-40', '40-50', '50-60', '60-70',
-                          '70-80', '80-90', '90-100', '100-110', '110-120', '120-130', '>130'],
-        'MIV_Class_10_1.csv': ['Total', 'MR', 'PW', 'PW+', 'Lief', 'Lief+', 'Lief+Aufl.',
-                               'LW', 'LW+', 'Sattelzug', 'Bus', 'andere'],
-        'Velo_Fuss_Count.csv': ['Total']
-    }
-
-    # Create a separate dataset per site and traffic type
-    all_sites = df.Zst_id.unique()
-    for site in all_sites:
-        for traffic_type in ['MIV', 'Velo', 'Fussgänger']:
-            site_data = df[df.Zst_id.eq(site) & df.TrafficType.eq(traffic_type)]
-
-            if site_data.empty:
-                continue
-
-            # Determine subfolder based on traffic type and filename
-            if traffic_type == 'Fussgänger':
-                subfolder = 'Fussgaenger'
-            elif filename == 'MIV_Speed.csv':
-                subfolder = 'MIV_Speed'
-            else:
-                subfolder = traffic_type
-
-            # Save the original site data
-            current_filename = os.path.join(dest_path, 'sites', subfolder, f'{str(site)}.csv')
-            print(f'Saving {current_filename}...')
-            site_data.to_csv(current_filename, sep=';', encoding='utf-8', index=False)
-
-            if True or ct.has_changed(current_filename):
-                # Add Direction_LaneName column
-                site_data['Direction_LaneName'] = (
-                        site_data['DirectionName'].astype(str) + '#' + site_data['LaneName'].astype(str)
-                )
-                # Convert Date to string format like '2022-01-01'
-                site_data['Date'] = pd.to_datetime(site_data['Date'], format='%d.%m.%Y').dt.strftime('%Y-%m-%d')
-
-                # Perform aggregations
-                aggregate_hourly(site_data, categories, dest_path, subfolder, site, filename)
-                aggregate_daily(site_data, categories, dest_path, subfolder, site, filename)
-                aggregate_monthly(site_data, categories, dest_path, subfolder, site, filename)
-                aggregate_yearly(site_data, categories, dest_path, subfolder, site, filename)
-
-                ct.update_hash_file(current_filename)
+    changed_years = None
+    if changed_partitions is not None and not rebuild:
+        changed_years = defaultdict(set)
+        for year, zst_id in changed_partitions:
+            changed_years[zst_id].add(year)
+
+    files_to_upload, changed_states = create_files_for_sites(df, filename, dest_path, changed_years, store, workers,
+                                                             rebuild)
+    logging.info(f'Aggregates of {len(changed_states)} sites changed...')
+    if files_to_upload:
+        common.sync_files_to_ftp(list(files_to_upload), credentials.ftp_server, credentials.ftp_user,
+                                 credentials.ftp_pass, files_to_upload, workers=8)
+    for current_filename in files_to_upload:
+        os.remove(current_filename)
+    # Only save the states once the files derived from them are uploaded
+    for state in changed_states:
+        state.save()
 
     # Calculate DTV per ZST and traffic type
     df_locations = download_locations()
@@ -93,71 +257,80 @@ def create_files_for_dashboard(df, filename, dest_path):
         os.remove(current_filename_fuss)
 
 
-def aggregate_hourly(site_data, categories, dest_path, subfolder, site, filename):
+def aggregate_hourly(cells, categories, dest_path, subfolder, site, filename):
     """
     Performs hourly aggregation and saves the data.
 
     Parameters:
-    - site_data (pd.DataFrame): DataFrame containing site data.
+    - cells (pd.DataFrame): Hourly aggregates of the site, see aggregate_cells().
     - categories (dict): Dictionary mapping filenames to category lists.
     - dest_path (str): Destination path for saving files.
     - subfolder (str): Subfolder name.
     - site (str/int): Site identifier.
     - filename (str): Name of the file being processed.
+
+    Returns:
+    - list: Paths of the saved files, one per category.
     """
 
     # Determine the date range
-    min_date = pd.to_datetime(site_data['Date']).min()
-    max_date = pd.to_datetime(site_data['Date']).max()
+    min_date = pd.to_datetime(cells['Date']).min()
+    max_date = pd.to_datetime(cells['Date']).max()
     date_range = pd.DataFrame({'Date': pd.date_range(start=min_date, end=max_date).strftime('%Y-%m-%d')})
 
-    for category in categories[filename]:
-        # Calculate the total counts per hour for each date, direction, and lane
-        df_to_pivot = site_data[['Date', 'Direction_LaneName', 'HourFrom', category]].copy()
-        df_agg = df_to_pivot.pivot_table(
-            index=['Date', 'Direction_LaneName'],
-            values=category,
-            columns='HourFrom',
-            aggfunc='sum'
-        ).reset_index()
+    # Calculate the total counts per hour for each date, direction, and lane, all categories in one pivot
+    df_wide = cells.pivot_table(
+        index=['Date', 'Direction_LaneName'],
+        values=categories[filename],
+        columns='HourFrom',
+        aggfunc='sum'
+    )
 
-        # Create the complete date range for each direction and lane combination
-        directions_lanes = df_agg['Direction_LaneName'].unique()
-        complete_dates = pd.MultiIndex.from_product([date_range['Date'], directions_lanes],
-                                                    names=['Date', 'Direction_LaneName']).to_frame(index=False)
-        df_agg = complete_dates.merge(df_agg, on=['Date', 'Direction_LaneName'], how='left')
+    # Create the complete date range for each direction and lane combination
+    directions_lanes = df_wide.index.get_level_values('Direction_LaneName').unique()
+    complete_dates = pd.MultiIndex.from_product([date_range['Date'], directions_lanes],
+                                                names=['Date', 'Direction_LaneName'])
+    df_wide = df_wide.reindex(complete_dates)
+    weekday = pd.to_datetime(complete_dates.get_level_values('Date')).weekday
+    direction_lane = complete_dates.get_level_values('Direction_LaneName').str.split('#', expand=True)
 
-        df_agg['Weekday'] = pd.to_datetime(df_agg['Date']).dt.weekday
-        df_agg[['DirectionName', 'LaneName']] = df_agg['Direction_LaneName'].str.split('#', expand=True)
+    saved_files = []
+    for category in categories[filename]:
+        df_agg = df_wide[category].reset_index()
+        df_agg['Weekday'] = weekday
+        df_agg['DirectionName'] = direction_lane.get_level_values(0)
+        df_agg['LaneName'] = direction_lane.get_level_values(1)
         df_agg = df_agg.drop(columns=['Direction_LaneName'])
 
         # Save the hourly data
         current_filename_hourly = os.path.join(dest_path, 'sites', subfolder, f'{str(site)}_{category}_hourly.csv')
         print(f'Saving {current_filename_hourly}...')
         df_agg.to_csv(current_filename_hourly, sep=';', encoding='utf-8', index=False)
-        common.upload_ftp(current_filename_hourly, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass,
-                          f'verkehrszaehl_dashboard/data/{subfolder}')
-        os.remove(current_filename_hourly)
+        saved_files.append(current_filename_hourly)
+    return saved_files
 
 
-def aggregate_daily(site_data, categories, dest_path, subfolder, site, filename):
+def aggregate_daily(cells, categories, dest_path, subfolder, site, filename):
     """
     Performs daily aggregation and saves the data.
 
     Parameters:
-    - site_data (pd.DataFrame): DataFrame containing site data.
+    - cells (pd.DataFrame): Hourly aggregates of the site, see aggregate_cells().
     - categories (dict): Dictionary mapping filenames to category lists.
     - dest_path (str): Destination path for saving files.
     - subfolder (str): Subfolder name.
     - site (str/int): Site identifier.
     - filename (str): Name of the file being processed.
+
+    Returns:
+    - str: Path of the saved file.
     """
     # Calculate the daily counts per weekday for each date, direction, and lane
-    df_to_group = site_data[['Date', 'Direction_LaneName'] + categories[filename]].copy()
+    df_to_group = cells[['Date', 'Direction_LaneName'] + categories[filename]].copy()
 
     # Determine the date range
-    min_date = pd.to_datetime(site_data['Date']).min()
-    max_date = pd.to_datetime(site_data['Date']).max()
+    min_date = pd.to_datetime(cells['Date']).min()
+    max_date = pd.to_datetime(cells['Date']).max()
     date_range = pd.DataFrame({'Date': pd.date_range(start=min_date, end=max_date).strftime('%Y-%m-%d')})
 
     df_agg = df_to_group.groupby(['Date', 'Direction_LaneName'])[categories[filename]].sum().reset_index()
@@ -179,42 +352,40 @@ def aggregate_daily(site_data, categories, dest_path, subfolder, site, filename)
     current_filename_daily = os.path.join(dest_path, 'sites', subfolder, f'{str(site)}_daily.csv')
     print(f'Saving {current_filename_daily}...')
     df_agg.to_csv(current_filename_daily, sep=';', encoding='utf-8', index=False)
-    common.upload_ftp(current_filename_daily, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass,
-                      f'verkehrszaehl_dashboard/data/{subfolder}')
-    os.remove(current_filename_daily)
+    return current_filename_daily
 
 
-def aggregate_monthly(site_data, categories, dest_path, subfolder, site, filename):
+def aggregate_monthly(cells, categories, dest_path, subfolder, site, filename):
     """
     Aggregates data over months.
 
     Parameters:
-    - site_data (pd.DataFrame): DataFrame containing site data.
+    - cells (pd.DataFrame): Hourly aggregates of the site, see aggregate_cells().
     - categories (dict): Dictionary mapping filenames to category lists.
     - dest_path (str): Destination path for saving files.
     - subfolder (str): Subfolder name.
     - site (str/int): Site identifier.
     - filename (str): Name of the file being processed.
+
+    Returns:
+    - str: Path of the saved file.
     """
     group_cols = ['Year', 'Month', 'Direction_LaneName']
-    df_to_group = site_data[group_cols + ['DateTimeFrom'] + categories[filename]].copy()
+    date_time_from = get_cell_date_time_from(cells)
+    df_to_group = cells[['Direction_LaneName', 'NumMeasures'] + categories[filename]].assign(
+        Year=date_time_from.dt.year, Month=date_time_from.dt.month)
 
-    # Aggregate data by month
-    df_agg = df_to_group.groupby(group_cols)[categories[filename]].sum().reset_index()
+    # Aggregate data by month, the number of measures is the sum of the measures of the cells
+    df_agg = df_to_group.groupby(group_cols)[categories[filename] + ['NumMeasures']].sum().reset_index()
     df_agg = df_agg[df_agg['Total'] > 0]
-
-    # Count the number of measures
-    df_measures = df_to_group.groupby(group_cols)['DateTimeFrom'].nunique().reset_index()
-    df_measures.rename(columns={'DateTimeFrom': 'NumMeasures'}, inplace=True)
-    df_agg = df_agg.merge(df_measures, on=group_cols, how='left')
     for col in categories[filename]:
         df_agg[col] = df_agg[col] / df_agg['NumMeasures'] * 24
 
     # Create a complete range of months
-    min_date = site_data['DateTimeFrom'].min()
-    max_date = site_data['DateTimeFrom'].max()
+    min_date = date_time_from.min()
+    max_date = date_time_from.max()
     date_range = pd.date_range(start=min_date, end=max_date, freq='MS')
-    direction_lanes = site_data['Direction_LaneName'].unique()
+    direction_lanes = cells['Direction_LaneName'].unique()
     complete_months = pd.MultiIndex.from_product(
         [date_range.year, date_range.month, direction_lanes],
         names=['Year', 'Month', 'Direction_LaneName']
@@ -229,42 +400,40 @@ def aggregate_monthly(site_data, categories, dest_path, subfolder, site, filenam
     current_filename = os.path.join(dest_path, 'sites', subfolder, f'{str(site)}_monthly.csv')
     print(f'Saving {current_filename}...')
     df_agg.to_csv(current_filename, sep=';', encoding='utf-8', index=False)
-    common.upload_ftp(current_filename, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass,
-                      f'verkehrszaehl_dashboard/data/{subfolder}')
-    os.remove(current_filename)
+    return current_filename
 
 
-def aggregate_yearly(site_data, categories, dest_path, subfolder, site, filename):
+def aggregate_yearly(cells, categories, dest_path, subfolder, site, filename):
     """
     Aggregates data over years.
 
     Parameters:
-    - site_data (pd.DataFrame): DataFrame containing site data.
+    - cells (pd.DataFrame): Hourly aggregates of the site, see aggregate_cells().
     - categories (dict): Dictionary mapping filenames to category lists.
     - dest_path (str): Destination path for saving files.
     - subfolder (str): Subfolder name.
     - site (str/int): Site identifier.
     - filename (str): Name of the file being processed.
+
+    Returns:
+    - str: Path of the saved file.
     """
     group_cols = ['Year', 'Direction_LaneName']
-    df_to_group = site_data[group_cols + ['DateTimeFrom'] + categories[filename]].copy()
+    date_time_from = get_cell_date_time_from(cells)
+    df_to_group = cells[['Direction_LaneName', 'NumMeasures'] + categories[filename]].assign(
+        Year=date_time_from.dt.year)
 
-    # Aggregate data by year
-    df_agg = df_to_group.groupby(group_cols)[categories[filename]].sum().reset_index()
+    # Aggregate data by year, the number of measures is the sum of the measures of the cells
+    df_agg = df_to_group.groupby(group_cols)[categories[filename] + ['NumMeasures']].sum().reset_index()
     df_agg = df_agg[df_agg['Total'] > 0]
-
-    # Count the number of measures
-    df_measures = df_to_group.groupby(group_cols)['DateTimeFrom'].nunique().reset_index()
-    df_measures.rename(columns={'DateTimeFrom': 'NumMeasures'}, inplace=True)
-    df_agg = df_agg.merge(df_measures, on=group_cols, how='left')
     for col in categories[filename]:
         df_agg[col] = df_agg[col] / df_agg['NumMeasures'] * 24
 
     # Create a complete range of years
-    min_year = site_data['DateTimeFrom'].min().year
-    max_year = site_data['DateTimeFrom'].max().year
+    min_year = date_time_from.min().year
+    max_year = date_time_from.max().year
     years = pd.DataFrame({'Year': range(min_year, max_year + 1)})
-    direction_lanes = site_data['Direction_LaneName'].unique()
+    direction_lanes = cells['Direction_LaneName'].unique()
     complete_years = pd.MultiIndex.from_product(
         [years['Year'], direction_lanes],
         names=['Year', 'Direction_LaneName']
@@ -279,9 +448,7 @@ def aggregate_yearly(site_data, categories, dest_path, subfolder, site, filename
     current_filename = os.path.join(dest_path, 'sites', subfolder, f'{str(site)}_yearly.csv')
     print(f'Saving {current_filename}...')
     df_agg.to_csv(current_filename, sep=';', encoding='utf-8', index=False)
-    common.upload_ftp(current_filename, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass,
-                      f'verkehrszaehl_dashboard/data/{subfolder}')
-    os.remove(current_filename)
+    return current_filename
 
 
 def download_locations():
@@ -5,6 +5,7 @@ import common
 from common import change_tracking as ct
 from mobilitaet_verkehrszaehldaten import credentials
 from mobilitaet_verkehrszaehldaten.src import dashboard_calc
+from mobilitaet_verkehrszaehldaten.src import parquet_store
 import sys
 import os
 import platform
@@ -16,7 +17,11 @@ print(f'Python running on the following architecture:')
 print(f'{platform.architecture()}')
 
 
-def parse_truncate(path, filename, dest_path, no_file_cp):
+def get_store(dest_path, filename) -> parquet_store.PartitionedStore:
+    return parquet_store.PartitionedStore(os.path.join(dest_path, 'parquet', filename.replace('.csv', '')))
+
+
+def parse_truncate(path, filename, dest_path, no_file_cp, store=None, workers=1, rebuild=False):
     generated_filenames = []
     path_to_orig_file = os.path.join(path, filename)
     path_to_copied_file = os.path.join(dest_path, filename)
@@ -25,24 +30,19 @@ def parse_truncate(path, filename, dest_path, no_file_cp):
         copy2(path_to_orig_file, path_to_copied_file)
     # Parse, process, truncate and write csv file
     print(f"Reading file {filename}...")
-    data = pd.read_csv(path_to_copied_file,
-                       engine='python',
-                       sep=';',
-                       # encoding='ANSI',
-                       encoding='cp1252',
-                       dtype={'SiteCode': 'category', 'SiteName': 'category', 'DirectionName': 'category',
-                              'LaneName': 'category', 'TrafficType': 'category'})
+    data = parquet_store.read_count_file(path_to_copied_file)
     print(f"Processing {path_to_copied_file}...")
-    data['DateTimeFrom'] = pd.to_datetime(data['Date'] + ' ' + data['TimeFrom'], format='%d.%m.%Y %H:%M')
-    data['DateTimeTo'] = data['DateTimeFrom'] + pd.Timedelta(hours=1)
-    data['Year'] = data['DateTimeFrom'].dt.year
-    data['Month'] = data['DateTimeFrom'].dt.month
-    data['Day'] = data['DateTimeFrom'].dt.day
-    data['Weekday'] = data['DateTimeFrom'].dt.weekday
-    data['HourFrom'] = data['DateTimeFrom'].dt.hour
-    data['DayOfYear'] = data['DateTimeFrom'].dt.dayofyear
-    print(f'Retrieving Zst_id as the first word in SiteName...')
-    data['Zst_id'] = data['SiteName'].str.split().str[0]
+    data = parquet_store.add_date_columns(data)
+
+    # The partitioned Parquet dataset is the canonical intermediate, all other outputs are only written
+    # if partitions changed, per-year files only for the years of these partitions
+    store = store or get_store(dest_path, filename)
+    changed_partitions = store.write(data)
+    changed_years = sorted({year for year, zst_id in changed_partitions})
+    if not changed_partitions and not rebuild:
+        print(f'No partition of {filename} changed, no files to create...')
+        return generated_filenames
+
     current_filename = os.path.join(dest_path, 'converted_' + filename)
     print(f"Saving {current_filename}...")
     data.to_csv(current_filename, sep=';', encoding='utf-8', index=False)
@@ -50,8 +50,7 @@ def parse_truncate(path, filename, dest_path, no_file_cp):
 
     db_filename = os.path.join(dest_path, filename.replace('.csv', '.db'))
     print(f'Saving into sqlite db {db_filename}...')
-    conn = sqlite3.connect(db_filename)
-    data.to_sql(name=db_filename.split(os.sep)[-1].replace('.db', ''), con=conn, if_exists='replace', index=False)
+    update_sqlite_db(db_filename, data, changed_partitions)
     common.upload_ftp(db_filename, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass, '')
 
     # group by SiteName, get latest rows (data is already sorted by date and time) so that ODS limit
@@ -65,37 +64,74 @@ def parse_truncate(path, filename, dest_path, no_file_cp):
 
     # Only keep latest n years of data
     keep_years = 2
-    current_filename = os.path.join(dest_path, 'truncated_' + filename)
-    print(f'Creating dataset {current_filename}...')
     latest_year = data['Year'].max()
     years = range(latest_year - keep_years, latest_year + 1)
-    print(f'Keeping only data for the following years in the truncated file: {list(years)}...')
-    truncated_data = data[data.Year.isin(years)]
-    print(f"Saving {current_filename}...")
-    truncated_data.to_csv(current_filename, sep=';', encoding='utf-8', index=False)
-    generated_filenames.append(current_filename)
+    if any(year in years for year in changed_years):
+        current_filename = os.path.join(dest_path, 'truncated_' + filename)
+        print(f'Creating dataset {current_filename}...')
+        print(f'Keeping only data for the following years in the truncated file: {list(years)}...')
+        truncated_data = data[data.Year.isin(years)]
+        print(f"Saving {current_filename}...")
+        truncated_data.to_csv(current_filename, sep=';', encoding='utf-8', index=False)
+        generated_filenames.append(current_filename)
 
-    # Create a separate dataset per year
-    all_years = data.Year.unique()
-    for year in all_years:
-        year_data = data[data.Year.eq(year)]
+    # Create a separate dataset per year in which a partition changed
+    positions_by_year = data.groupby('Year').indices
+    for year in changed_years:
+        if year not in positions_by_year:
+            continue
+        year_data = data.iloc[positions_by_year[year]]
         current_filename = os.path.join(dest_path, str(year) + '_' + filename)
         print(f'Saving {current_filename}...')
         year_data.to_csv(current_filename, sep=';', encoding='utf-8', index=False)
         generated_filenames.append(current_filename)
 
     logging.info(f'Creating json files for dashboard...')
-    dashboard_calc.create_files_for_dashboard(data, filename, dest_path)
+    dashboard_calc.create_files_for_dashboard(data, filename, dest_path, changed_partitions, store, workers, rebuild)
 
     print(f'Created the following files to further processing: {str(generated_filenames)}')
     return generated_filenames
 
 
+def update_sqlite_db(db_filename, data, changed_partitions):
+    """Replaces the rows of the changed partitions, or the whole table if it does not exist yet."""
+    table_name = os.path.basename(db_filename).replace('.db', '')
+    conn = sqlite3.connect(db_filename)
+    try:
+        table_exists = conn.execute('SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?',
+                                    ['table', table_name]).fetchone() is not None
+        if not table_exists:
+            data.to_sql(name=table_name, con=conn, if_exists='replace', index=False)
+            return
+        positions_by_partition = data.groupby(parquet_store.PARTITION_COLUMNS, observed=True).indices
+        with conn:
+            for year, zst_id in changed_partitions:
+                conn.execute(f'DELETE FROM "{table_name}" WHERE Year = ? AND Zst_id = ?', [int(year), str(zst_id)])
+                if (year, zst_id) in positions_by_partition:
+                    data.iloc[positions_by_partition[(year, zst_id)]].to_sql(name=table_name, con=conn,
+                                                                            if_exists='append', index=False)
+    finally:
+        conn.close()
+
+
+def get_workers(argv) -> int:
+    """Returns N of the argument "--workers=N" or "--workers N", the number of processes creating dashboard files."""
+    for i, arg in enumerate(argv):
+        if arg.startswith('--workers='):
+            return int(arg.split('=', 1)[1])
+        if arg == '--workers' and i + 1 < len(argv):
+            return int(argv[i + 1])
+    return 1
+
+
 def main():
     no_file_copy = False
     if 'no_file_copy' in sys.argv:
         no_file_copy = True
         print('Proceeding without copying files...')
+    # Run with argument "rebuild" to create the dashboard files of all sites, ignoring the persisted aggregates
+    rebuild = 'rebuild' in sys.argv
+    workers = get_workers(sys.argv)
 
     filename_orig = ['MIV_Class_10_1.csv', 'Velo_Fuss_Count.csv', 'MIV_Speed.csv']
 
@@ -103,11 +139,15 @@ def main():
     for datafile in filename_orig:
         datafile_with_path = os.path.join(credentials.path_orig, datafile)
         if True or ct.has_changed(datafile_with_path):
-            file_names = parse_truncate(credentials.path_orig, datafile, credentials.path_dest, no_file_copy)
+            store = get_store(credentials.path_dest, datafile)
+            file_names = parse_truncate(credentials.path_orig, datafile, credentials.path_dest, no_file_copy, store,
+                                        workers, rebuild)
             if not no_file_copy:
                 for file in file_names:
                     common.upload_ftp(file, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass, '')
                     os.remove(file)
+            # Only now the changed partitions count as handled
+            store.commit()
             ct.update_hash_file(datafile_with_path)
 
     # For the velo view in the dashboard,
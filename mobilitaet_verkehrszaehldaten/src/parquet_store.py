@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import pathlib
+import shutil
+from hashlib import blake2b
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as pa_dataset
+import pyarrow.parquet as pq
+
+import common
+
+CATEGORY_COLUMNS = ['SiteCode', 'SiteName', 'DirectionName', 'LaneName', 'TrafficType']
+# Columns that pyarrow would otherwise convert to times or numbers
+STRING_COLUMNS = ['Date', 'TimeFrom', 'TimeTo']
+PARTITION_COLUMNS = ['Year', 'Zst_id']
+
+
+def read_count_file(path) -> pd.DataFrame:
+    """Reads a count file with the multithreaded pyarrow CSV reader, the columns of CATEGORY_COLUMNS as categoricals."""
+    column_types = {column: pa.dictionary(pa.int32(), pa.string()) for column in CATEGORY_COLUMNS}
+    column_types.update({column: pa.string() for column in STRING_COLUMNS})
+    table = pa_csv.read_csv(path,
+                            read_options=pa_csv.ReadOptions(encoding='cp1252'),
+                            parse_options=pa_csv.ParseOptions(delimiter=';'),
+                            convert_options=pa_csv.ConvertOptions(column_types=column_types))
+    return table.to_pandas()
+
+
+def add_date_columns(data):
+    data['DateTimeFrom'] = pd.to_datetime(data['Date'] + ' ' + data['TimeFrom'], format='%d.%m.%Y %H:%M')
+    data['DateTimeTo'] = data['DateTimeFrom'] + pd.Timedelta(hours=1)
+    data['Year'] = data['DateTimeFrom'].dt.year
+    data['Month'] = data['DateTimeFrom'].dt.month
+    data['Day'] = data['DateTimeFrom'].dt.day
+    data['Weekday'] = data['DateTimeFrom'].dt.weekday
+    data['HourFrom'] = data['DateTimeFrom'].dt.hour
+    data['DayOfYear'] = data['DateTimeFrom'].dt.dayofyear
+    print(f'Retrieving Zst_id as the first word in SiteName...')
+    data['Zst_id'] = data['SiteName'].str.split().str[0]
+    return data
+
+
+def partition_hash(part) -> str:
+    return blake2b(pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes(), digest_size=16).hexdigest()
+
+
+class PartitionedStore:
+    """
+    Parquet dataset of a count file, partitioned by Year and Zst_id (hive layout, e.g. Year=2023/Zst_id=350).
+
+    A manifest stores the content hash of each partition. write() only rewrites partitions whose content changed
+    and returns them, so that outputs derived from the data can be limited to these partitions. The manifest is
+    only saved by commit(), after these outputs were delivered, so that a failed run handles the partitions again.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        # Files starting with an underscore are ignored when the dataset is read
+        self.manifest_file = os.path.join(root, '_manifest.json')
+        self.manifest = {}
+        self.pending_manifest = None
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r') as f:
+                self.manifest = json.load(f)
+
+    @staticmethod
+    def partition_key(year, zst_id) -> str:
+        return f'Year={year}/Zst_id={zst_id}'
+
+    def write(self, data) -> list:
+        """Writes all partitions of data that changed, removes partitions that vanished, returns the changed (year, zst_id)."""
+        changed = []
+        manifest = {}
+        for (year, zst_id), positions in data.groupby(PARTITION_COLUMNS, observed=True, sort=True).indices.items():
+            part = data.iloc[positions]
+            key = self.partition_key(year, zst_id)
+            manifest[key] = partition_hash(part)
+            if self.manifest.get(key) == manifest[key]:
+                continue
+            changed.append((year, zst_id))
+            part_dir = os.path.join(self.root, key)
+            pathlib.Path(part_dir).mkdir(parents=True, exist_ok=True)
+            table = pa.Table.from_pandas(part.drop(columns=PARTITION_COLUMNS), preserve_index=False)
+            pq.write_table(table, os.path.join(part_dir, 'part-0.parquet'))
+        for key in set(self.manifest) - set(manifest):
+            logging.info(f'Removing partition {key} that is not in the data anymore...')
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            year, zst_id = [value.split('=', 1)[1] for value in key.split('/')]
+            changed.append((int(year), zst_id))
+        logging.info(f'{len(changed)} of {len(manifest)} partitions in {self.root} changed...')
+        self.pending_manifest = manifest
+        return changed
+
+    def commit(self):
+        """Saves the manifest of the last write()."""
+        if self.pending_manifest is None:
+            return
+        common.write_json_atomic(self.manifest_file, self.pending_manifest)
+        self.manifest, self.pending_manifest = self.pending_manifest, None
+
+    def read(self, filters=None) -> pd.DataFrame:
+        """Reads the dataset (memory-mapped), optionally only the partitions matching the pyarrow filters."""
+        partitioning = pa_dataset.partitioning(pa.schema([('Year', pa.int64()), ('Zst_id', pa.string())]), flavor='hive')
+        table = pq.read_table(self.root, partitioning=partitioning, filters=filters, memory_map=True)
+        return table.to_pandas()
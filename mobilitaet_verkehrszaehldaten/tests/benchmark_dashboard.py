@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from mobilitaet_verkehrszaehldaten.src import dashboard_calc, parquet_store
+
+FILENAME = 'MIV_Speed.csv'
+
+
+def make_count_data(sites, days) -> pd.DataFrame:
+    """Creates hourly speed counts of two lanes per site, in the format of the MIV_Speed.csv file."""
+    categories = dashboard_calc.CATEGORIES[FILENAME][1:]
+    dates = pd.date_range('2020-01-01', periods=days)
+    rng = np.random.default_rng(0)
+    site_codes = np.repeat(np.arange(sites) + 100, days * 24 * 2)
+    lane_codes = np.tile([1, 2], sites * days * 24)
+    date_times = np.tile(np.repeat(pd.date_range(dates[0], periods=days * 24, freq='h'), 2), sites)
+    data = pd.DataFrame({
+        'SiteCode': [f'{site}{lane}' for site, lane in zip(site_codes, lane_codes)],
+        'SiteName': [f'{site} Basel Strasse' for site in site_codes],
+        'DirectionName': np.where(lane_codes == 1, 'Grenze', 'Zentrum'),
+        'LaneCode': lane_codes,
+        'LaneName': [f'Spur {lane}' for lane in lane_codes],
+        'Date': pd.DatetimeIndex(date_times).strftime('%d.%m.%Y'),
+        'TimeFrom': pd.DatetimeIndex(date_times).strftime('%H:%M'),
+        'TrafficType': 'MIV',
+    })
+    counts = pd.DataFrame(rng.integers(0, 50, (len(data), len(categories))), columns=categories)
+    data = pd.concat([data, counts.sum(axis=1).rename('Total'), counts], axis=1)
+    for column in parquet_store.CATEGORY_COLUMNS:
+        data[column] = data[column].astype('category')
+    return parquet_store.add_date_columns(data)
+
+
+def main(sites=24, days=730, workers=4):
+    data = make_count_data(sites, days)
+    with tempfile.TemporaryDirectory() as dest_path:
+        os.makedirs(os.path.join(dest_path, 'sites', 'MIV_Speed'))
+        store = parquet_store.PartitionedStore(os.path.join(dest_path, 'parquet'))
+        store.write(data)
+        timings = {}
+        for mode, mode_workers in [('serial', 1), ('parallel', workers)]:
+            start = time.perf_counter()
+            files, states = dashboard_calc.create_files_for_sites(data, FILENAME, dest_path, store=store,
+                                                                  workers=mode_workers, rebuild=True)
+            timings[mode] = time.perf_counter() - start
+            print(f'{mode}: {len(states)} sites, {len(files)} files created in {timings[mode]:.2f}s')
+    print(f'create_files_for_sites: {sites} sites, {days} days, {len(data)} rows, '
+          f'speedup with {workers} workers: {timings["serial"] / timings["parallel"]:.1f}x')
+
+
+if __name__ == "__main__":
+    print(f'Executing {__file__}...')
+    main(*[int(arg) for arg in sys.argv[1:]])
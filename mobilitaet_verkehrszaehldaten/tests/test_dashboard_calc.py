@@ -0,0 +1,60 @@
+import os
+import pandas as pd
+from mobilitaet_verkehrszaehldaten.src import dashboard_calc, parquet_store
+
+
+def make_site_data(days, total=3):
+    rows = []
+    for date in pd.date_range('2022-12-30', periods=days):
+        for hour in range(3):
+            for lane, direction in [(1, 'Grenze'), (2, 'Zentrum')]:
+                rows.append(['350 Basel Strasse', direction, f'Spur {lane}', date.strftime('%d.%m.%Y'),
+                             f'{hour:02d}:00', 'MIV', total])
+    data = pd.DataFrame(rows, columns=['SiteName', 'DirectionName', 'LaneName', 'Date', 'TimeFrom', 'TrafficType',
+                                       'Total'])
+    return parquet_store.add_date_columns(data)
+
+
+def test_state_only_aggregates_changed_dates(tmp_path):
+    state = dashboard_calc.SiteAggregateState(str(tmp_path), 'MIV', '350')
+    assert state.update(make_site_data(3), ['Total'])
+    state.save()
+
+    # One day more and a correction of the first day, only the dates of 2023 are compared
+    data = make_site_data(4)
+    data.loc[data['Date'].eq('30.12.2022'), 'Total'] = 5
+    state = dashboard_calc.SiteAggregateState(str(tmp_path), 'MIV', '350')
+    assert state.update(data, ['Total'], years={2023})
+    assert state.cells['Date'].unique().tolist() == ['2022-12-30', '2022-12-31', '2023-01-01', '2023-01-02']
+    assert state.cells.loc[state.cells['Date'].eq('2022-12-30'), 'Total'].eq(3).all()
+    assert state.update(data, ['Total'])
+    expected = dashboard_calc.aggregate_cells(data, ['Total'])
+    pd.testing.assert_frame_equal(state.cells, expected)
+    state.save()
+
+    state = dashboard_calc.SiteAggregateState(str(tmp_path), 'MIV', '350')
+    assert not state.update(data, ['Total'])
+    # Dates that vanished are removed
+    assert state.update(data[~data['Date'].eq('02.01.2023')], ['Total'], years={2023})
+    assert state.cells['Date'].max() == '2023-01-01'
+    assert len(state.fingerprints) == 3
+
+
+def test_parallel_files_equal_serial_files(tmp_path):
+    data = pd.concat([make_site_data(3), make_site_data(4).assign(SiteName='351 Basel Strasse', Zst_id='351')],
+                     ignore_index=True)
+    store = parquet_store.PartitionedStore(str(tmp_path / 'parquet'))
+    store.write(data)
+    contents = {}
+    for workers in [1, 2]:
+        dest_path = tmp_path / str(workers)
+        (dest_path / 'sites' / 'MIV').mkdir(parents=True)
+        files, states = dashboard_calc.create_files_for_sites(data, 'Velo_Fuss_Count.csv', str(dest_path),
+                                                              store=store, workers=workers)
+        assert len(states) == 2
+        contents[workers] = {os.path.relpath(file, dest_path): open(file).read() for file in files}
+        for state in states:
+            state.save()
+    assert contents[1] == contents[2]
+    assert sorted(contents[1]) == [os.path.join('sites', 'MIV', f'{site}_{name}.csv') for site in ['350', '351']
+                                   for name in ['Total_hourly', 'daily', 'monthly', 'yearly']]
@@ -0,0 +1,50 @@
+import pandas as pd
+from mobilitaet_verkehrszaehldaten.src import parquet_store
+
+
+def write_count_file(path, sites=(350, 351), dates=('30.12.2022', '31.12.2022', '01.01.2023')):
+    rows = []
+    for site in sites:
+        for date in dates:
+            for hour in range(2):
+                rows.append([f'{site}1', f'{site} Basel Strasse', 'Grenze', 1, 'Spur 1', date, f'{hour:02d}:00',
+                             f'{hour + 1:02d}:00', 1, 0, 'MIV', 3, 1, 2])
+    df = pd.DataFrame(rows, columns=['SiteCode', 'SiteName', 'DirectionName', 'LaneCode', 'LaneName', 'Date', 'TimeFrom',
+                                     'TimeTo', 'ValuesApproved', 'ValuesEdited', 'TrafficType', 'Total', 'PW', 'Lief'])
+    df.to_csv(path, sep=';', index=False, encoding='cp1252')
+
+
+def test_read_count_file_matches_pandas(tmp_path):
+    path = tmp_path / 'MIV_Class_10_1.csv'
+    write_count_file(path)
+    data = parquet_store.read_count_file(path)
+    expected = pd.read_csv(path, engine='python', sep=';', encoding='cp1252',
+                           dtype={column: 'category' for column in parquet_store.CATEGORY_COLUMNS})
+    assert list(data.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(data.astype(str), expected.astype(str))
+    assert all(isinstance(data[column].dtype, pd.CategoricalDtype) for column in parquet_store.CATEGORY_COLUMNS)
+
+
+def test_write_returns_changed_partitions_only(tmp_path):
+    path = tmp_path / 'MIV_Class_10_1.csv'
+    write_count_file(path)
+    data = parquet_store.add_date_columns(parquet_store.read_count_file(path))
+    store = parquet_store.PartitionedStore(str(tmp_path / 'parquet'))
+    assert sorted(store.write(data)) == [(2022, '350'), (2022, '351'), (2023, '350'), (2023, '351')]
+    store.commit()
+
+    # One value of site 351 in 2023 changed, site 350 vanished
+    data.loc[(data['Zst_id'] == '351') & (data['Year'] == 2023), 'Total'] = 4
+    data = data[data['Zst_id'] == '351'].reset_index(drop=True)
+    store = parquet_store.PartitionedStore(str(tmp_path / 'parquet'))
+    assert sorted(store.write(data)) == [(2022, '350'), (2023, '350'), (2023, '351')]
+    # Without commit the same partitions are reported again
+    store = parquet_store.PartitionedStore(str(tmp_path / 'parquet'))
+    assert len(store.write(data)) == 3
+    store.commit()
+    assert store.write(data) == []
+
+    stored = store.read(filters=[('Year', '=', 2023)])
+    assert set(stored['Zst_id']) == {'351'}
+    assert (stored['Total'] == 4).all()
+    assert len(store.read()) == len(data)
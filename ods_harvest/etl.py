@@ -1,25 +1,99 @@
 from ods_harvest import credentials
+import logging
+import random
 import time
 import common
+from concurrent.futures import ThreadPoolExecutor
 
 import sys
-ods_harvester_ids = sys.argv[1].split(',')
 
+ODS_API_URL = 'https://data.bs.ch/api/automation/v1.0'
 
-def wait_for_idle(harvester_id):
-    while True:
-        print(f'Checking status of harvester "{harvester_id}"...')
-        resp = common.requests_get(url=f'https://data.bs.ch/api/automation/v1.0/harvesters/{harvester_id}/',
-                                   headers={'Authorization': f'apikey {credentials.api_key}'})
+
+class HarvesterRunner:
+    """
+    Runs ODS harvesters concurrently, each one as an independent sequence of phases:
+    wait until idle, start, wait until harvested, publish, wait until published.
+
+    At most max_concurrency harvesters are driven at the same time. Status polls of a harvester are
+    spaced by an exponentially growing delay (poll_delay * backoff ** n, at most max_poll_delay) with random
+    jitter, so that harvesters started together do not poll in lockstep. All requests use the shared
+    session of common.http_session.
+    """
+
+    def __init__(self, api_url=ODS_API_URL, api_key='', max_concurrency=4, poll_delay=2, max_poll_delay=60,
+                 backoff=2, jitter=0.5, timeout=6 * 60 * 60):
+        self.api_url = api_url
+        self.api_key = api_key or credentials.api_key
+        self.max_concurrency = max_concurrency
+        self.poll_delay = poll_delay
+        self.max_poll_delay = max_poll_delay
+        self.backoff = backoff
+        self.jitter = jitter
+        self.timeout = timeout
+
+    def run(self, harvester_ids) -> list:
+        """Runs all harvesters and returns one timing report per harvester, raises the first error after all ran."""
+        harvester_ids = list(dict.fromkeys(harvester_ids))
+        logging.info(f'Running {len(harvester_ids)} harvesters, at most {self.max_concurrency} at the same time...')
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            reports = list(executor.map(self.run_harvester, harvester_ids))
+        for report in reports:
+            logging.info(f'Harvester report: {report}')
+        errors = [report['error'] for report in reports if report['error'] is not None]
+        if errors:
+            logging.error(f'{len(errors)} of {len(reports)} harvesters failed...')
+            raise errors[0]
+        return reports
+
+    def run_harvester(self, harvester_id) -> dict:
+        report = {'harvester_id': harvester_id, 'phase': None, 'seconds': {}, 'polls': 0, 'error': None}
+        start = time.perf_counter()
+        phases = [('wait_idle', lambda: self.wait_for_idle(harvester_id, report)),
+                  ('start', lambda: self.send_signal(harvester_id, 'start')),
+                  ('harvest', lambda: self.wait_for_idle(harvester_id, report)),
+                  ('publish', lambda: self.send_signal(harvester_id, 'publish')),
+                  ('wait_published', lambda: self.wait_for_idle(harvester_id, report))]
+        try:
+            for phase, fn in phases:
+                report['phase'] = phase
+                phase_start = time.perf_counter()
+                fn()
+                report['seconds'][phase] = time.perf_counter() - phase_start
+            report['phase'] = 'done'
+        except Exception as e:
+            logging.exception(f'Harvester "{harvester_id}" failed in phase "{report["phase"]}"...')
+            report['error'] = e
+        report['seconds']['total'] = time.perf_counter() - start
+        return report
+
+    def get_status(self, harvester_id) -> str:
+        resp = common.requests_get(url=f'{self.api_url}/harvesters/{harvester_id}/',
+                                   headers={'Authorization': f'apikey {self.api_key}'})
         handle_http_errors(resp)
-        status = resp.json()['status']
-        print(f'Harvester "{harvester_id}" is "{status}".')
-        if status == 'idle':
-            break
-        else:
-            seconds = 10
-            print(f'Waiting {seconds} seconds before trying again...')
+        return resp.json()['status']
+
+    def wait_for_idle(self, harvester_id, report):
+        delay = self.poll_delay
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            status = self.get_status(harvester_id)
+            report['polls'] += 1
+            logging.info(f'Harvester "{harvester_id}" is "{status}".')
+            if status == 'idle':
+                return
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f'Harvester "{harvester_id}" did not become idle within {self.timeout} seconds')
+            seconds = random.uniform(delay * (1 - self.jitter), delay)
+            logging.info(f'Waiting {seconds:.1f} seconds before checking harvester "{harvester_id}" again...')
             time.sleep(seconds)
+            delay = min(delay * self.backoff, self.max_poll_delay)
+
+    def send_signal(self, harvester_id, signal):
+        logging.info(f'Sending harvester "{harvester_id}" the "{signal}" signal...')
+        resp = common.requests_post(f'{self.api_url}/harvesters/{harvester_id}/{signal}/',
+                                    headers={'Authorization': f'apikey {self.api_key}'})
+        handle_http_errors(resp)
 
 
 def handle_http_errors(resp):
@@ -30,19 +104,13 @@ def handle_http_errors(resp):
         raise RuntimeError('Problem with OpenDataSoft Management API: ' + resp.text)
 
 
-for harv_id in ods_harvester_ids:
-    wait_for_idle(harv_id)
-    print(f'Sending harvester "{harv_id}" the "start" signal...')
-    response = common.requests_post(f'https://data.bs.ch/api/automation/v1.0/harvesters/{harv_id}/start/',
-                                   headers={'Authorization': f'apikey {credentials.api_key}'})
-    handle_http_errors(response)
-    wait_for_idle(harv_id)
-
-    print(f'Sending harvester "{harv_id}" the "publish" signal...')
-    response = common.requests_post(f'https://data.bs.ch/api/automation/v1.0/harvesters/{harv_id}/publish/',
-                                   headers={'Authorization': f'apikey {credentials.api_key}'})
-    handle_http_errors(response)
-    wait_for_idle(harv_id)
+def main():
+    ods_harvester_ids = sys.argv[1].split(',')
+    HarvesterRunner().run(ods_harvester_ids)
+    print('Job successful!')
 
 
-print('Job successful!')
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logging.info(f'Executing {__file__}...')
+    main()
@@ -0,0 +1,75 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from ods_harvest import etl
+
+
+class FakeAutomationApi(BaseHTTPRequestHandler):
+    """Local fake of the harvester endpoints of the ODS automation API, harvesters stay busy for a few polls."""
+
+    def do_GET(self):
+        harvester_id = self.path.strip('/').split('/')[-1]
+        with self.server.lock:
+            harvester = self.server.harvesters[harvester_id]
+            if harvester['busy_polls'] > 0:
+                harvester['busy_polls'] -= 1
+                if harvester['busy_polls'] == 0:
+                    harvester['status'] = 'idle'
+            status = harvester['status']
+        self.respond({'harvester_id': harvester_id, 'status': status})
+
+    def do_POST(self):
+        harvester_id, signal = self.path.strip('/').split('/')[-2:]
+        with self.server.lock:
+            harvester = self.server.harvesters[harvester_id]
+            self.server.signals.append((harvester_id, signal))
+            if signal == 'start':
+                self.server.running.add(harvester_id)
+                self.server.max_running = max(self.server.max_running, len(self.server.running))
+            else:
+                self.server.running.discard(harvester_id)
+            harvester['status'] = 'processing_all' if signal == 'start' else 'publishing'
+            harvester['busy_polls'] = 2
+        self.respond({})
+
+    def respond(self, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_api():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAutomationApi)
+    server.lock = threading.Lock()
+    server.harvesters = {f'harv_{i}': {'status': 'idle', 'busy_polls': 0} for i in range(6)}
+    # One harvester is still running from an earlier job
+    server.harvesters['harv_0'] = {'status': 'processing_all', 'busy_polls': 3}
+    server.signals = []
+    server.running = set()
+    server.max_running = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def test_runner_drives_all_harvesters(fake_api):
+    runner = etl.HarvesterRunner(api_url=f'http://127.0.0.1:{fake_api.server_port}/api/automation/v1.0',
+                                 api_key='secret', max_concurrency=3, poll_delay=0.01)
+    reports = runner.run(fake_api.harvesters.keys())
+    assert [r['phase'] for r in reports] == ['done'] * 6
+    assert all(r['error'] is None for r in reports)
+    for harvester_id in fake_api.harvesters:
+        signals = [signal for h, signal in fake_api.signals if h == harvester_id]
+        assert signals == ['start', 'publish']
+    assert fake_api.max_running <= 3
+    assert all(h['status'] == 'idle' for h in fake_api.harvesters.values())
+    assert reports[0]['polls'] > reports[1]['polls']
+    assert set(reports[0]['seconds']) == {'wait_idle', 'start', 'harvest', 'publish', 'wait_published', 'total'}
@@ -1,20 +1,15 @@
 import sys
-import common
-from ods_publish import credentials
-import time
+from ods_publish import orchestrator
 import logging
-import sys
 
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 ods_dataset_uids = sys.argv[1].split(',')
-count = len(ods_dataset_uids)
 print('Publishing ODS datasets...')
-for i, dataset_uid in enumerate(ods_dataset_uids):
-    common.publish_ods_dataset(dataset_uid, credentials)
-    if i < (count-1):
-        print('Waiting 5 seconds before sending next publish request to ODS...')
-        time.sleep(5)
+reports = orchestrator.get_orchestrator().publish_uids(ods_dataset_uids, wait=True)
+failed = [report for report in reports if report['status'] != 'published']
+if failed:
+    logging.warning(f'ODS did not publish all datasets: {failed}')
 
-print('Job successful!')
\ No newline at end of file
+print('Job successful!')
@@ -1,6 +1,6 @@
 import common
 from ods_publish import credentials
-import time
+from ods_publish import orchestrator
 import logging
 import sys
 
@@ -10,32 +10,42 @@ logger = logging.getLogger(__name__)
 
 def main():
     ods_dataset_ids = sys.argv[1].split(',')
-    count = len(ods_dataset_ids)
     print('Publishing ODS datasets...')
-    for i, dataset_id in enumerate(ods_dataset_ids):
-        publish_ods_dataset_by_id(dataset_id)
-        if i < (count - 1):
-            print('Waiting 5 seconds before sending next publish request to ODS...')
-            time.sleep(5)
+    reports = publish_ods_datasets_by_id(ods_dataset_ids, wait=True)
+    failed = [report for report in reports if report['status'] != 'published']
+    if failed:
+        logging.warning(f'ODS did not publish all datasets: {failed}')
     print('Job successful!')
 
 
+def publish_ods_datasets_by_id(dataset_ids: list, unpublish_first=False, wait=False) -> list:
+    return orchestrator.get_orchestrator().publish(dataset_ids, unpublish_first=unpublish_first, wait=wait)
+
+
 def publish_ods_dataset_by_id(dataset_id: str, unpublish_first=False):
-    dataset_uid = common.get_ods_uid_by_id(dataset_id, credentials)
-    common.publish_ods_dataset(dataset_uid, credentials, unpublish_first=unpublish_first)
+    return publish_ods_datasets_by_id([dataset_id], unpublish_first=unpublish_first)
+
+
+def get_ods_uid_by_id(dataset_id: str) -> str:
+    return orchestrator.get_orchestrator().resolve_uids([dataset_id])[dataset_id]
 
 
 def unpublish_ods_dataset_by_id(dataset_id: str):
-    dataset_uid = common.get_ods_uid_by_id(dataset_id, credentials)
-    common.unpublish_ods_dataset(dataset_uid, credentials)
+    orchestrator.get_orchestrator().call_with_uid(
+        dataset_id, lambda dataset_uid: common.unpublish_ods_dataset(dataset_uid, credentials))
+
+
+def get_ods_dataset(dataset_uid: str):
+    r = common.requests_get(url=f'https://data.bs.ch/api/automation/v1.0/datasets/{dataset_uid}/',
+                            headers={'Authorization': f'apikey {credentials.api_key}'})
+    r.raise_for_status()
+    return r
 
 
 def ods_set_general_access_policy(dataset_id: str, access_should_be_restricted: bool, do_publish=True):
-    dataset_uid = common.get_ods_uid_by_id(dataset_id, credentials)
     logging.info(f'Getting General Access Policy before setting it...')
+    dataset_uid, r = orchestrator.get_orchestrator().call_with_uid(dataset_id, get_ods_dataset)
     url = f'https://data.bs.ch/api/automation/v1.0/datasets/{dataset_uid}/'
-    r = common.requests_get(url=url, headers={'Authorization': f'apikey {credentials.api_key}'})
-    r.raise_for_status()
     is_currently_restricted = r.json()['is_restricted']
     do_change_policy = is_currently_restricted != access_should_be_restricted
     logging.info(f'Current access policy: {is_currently_restricted}. Do we have to change that? {do_change_policy}.')
@@ -45,7 +55,7 @@ def ods_set_general_access_policy(dataset_id: str, access_should_be_restricted:
         r.raise_for_status()
         if do_publish:
             logging.info(f'Publishing dataset...')
-            common.publish_ods_dataset(dataset_uid, credentials)
+            orchestrator.get_orchestrator().publish_uids([dataset_uid], dataset_ids={dataset_uid: dataset_id})
     return do_change_policy, r
 
 
@@ -0,0 +1,190 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import common
+from ods_publish import credentials
+from ods_publish import uid_cache
+
+FAILED_STATUSES = {'error', 'limit_reached'}
+# A dataset counts as published if its status changed to idle after the publish request was sent.
+# The status timestamp comes from the ODS server, so differences between the clocks are tolerated.
+CLOCK_TOLERANCE = timedelta(seconds=60)
+
+_orchestrator = None
+
+
+class PublishOrchestrator:
+    """
+    Publishes ODS datasets concurrently and keeps track of them for the rest of the run.
+
+    Dataset ids are resolved to uids using the on-disk cache of ods_publish.uid_cache.
+    Up to max_in_flight requests are sent in parallel. The status of all datasets that are still being
+    processed is polled in rounds; the delay between rounds grows by backoff up to max_poll_delay as long
+    as no dataset finishes. A dataset that is requested again while ODS is still processing it is published
+    once more after it is done, instead of failing with an InvalidDatasetStatusPreconditionException.
+    """
+
+    def __init__(self, creds=credentials, max_in_flight=4, poll_delay=1, max_poll_delay=30, backoff=1.5,
+                 timeout=1800, cache=None):
+        self.creds = creds
+        self.uid_cache = cache or uid_cache.get_uid_cache()
+        self.max_in_flight = max_in_flight
+        self.poll_delay = poll_delay
+        self.max_poll_delay = max_poll_delay
+        self.backoff = backoff
+        self.timeout = timeout
+        # uid -> time the last publish request was sent, for datasets that are not known to be done yet
+        self.in_flight = {}
+        self._seen_busy = set()
+
+    def resolve_uids(self, dataset_ids) -> dict:
+        """Returns a dict {dataset id: uid}."""
+        return self.uid_cache.get_uids(dataset_ids)
+
+    def call_with_uid(self, dataset_id, fn, dataset_uid=None) -> tuple:
+        """
+        Calls fn with the uid of dataset_id and returns the uid used and the result of fn.
+
+        If ODS answers with 404, the cached uid is outdated: it is resolved again and fn is called once more.
+        """
+        dataset_uid = dataset_uid or self.resolve_uids([dataset_id])[dataset_id]
+        try:
+            return dataset_uid, fn(dataset_uid)
+        except common.HttpNotFoundError:
+            # Raised by the first 404 without any retries, see common.raise_for_status
+            logging.info(f'ODS does not know uid {dataset_uid} of dataset {dataset_id}, resolving it again...')
+            self.uid_cache.invalidate(dataset_id)
+            dataset_uid = self.resolve_uids([dataset_id])[dataset_id]
+            return dataset_uid, fn(dataset_uid)
+
+    def publish(self, dataset_ids, unpublish_first=False, wait=False) -> list:
+        """Publishes the datasets with the given ids, see publish_uids()."""
+        uids = self.resolve_uids(dataset_ids)
+        return self.publish_uids(list(uids.values()), unpublish_first=unpublish_first, wait=wait,
+                                 dataset_ids={uid: dataset_id for dataset_id, uid in uids.items()})
+
+    def publish_uids(self, uids, unpublish_first=False, wait=False, dataset_ids=None) -> list:
+        """
+        Publishes the datasets with the given uids and returns one report per dataset.
+
+        Each report contains the seconds until the publish request was accepted and, if wait is True,
+        the status the dataset ended up in and the seconds until ODS finished processing it.
+        """
+        start = time.perf_counter()
+        dataset_ids = dataset_ids or {}
+        unique_uids = list(dict.fromkeys(uids))
+        if len(unique_uids) < len(uids):
+            logging.info(f'Publishing each of {len(unique_uids)} datasets once for {len(uids)} publish requests...')
+        busy = [uid for uid in unique_uids if uid in self.in_flight]
+        if busy:
+            logging.info(f'Waiting for ODS to finish publishing {busy} before publishing them again...')
+            self.wait_for(busy, self._publish_result)
+        # Requested uid -> uid known to ODS, they differ if a cached uid turned out to be outdated
+        current_uids = {uid: uid for uid in unique_uids}
+
+        def call(fn, uid):
+            if uid in dataset_ids:
+                current_uids[uid], _ = self.call_with_uid(dataset_ids[uid], fn, current_uids[uid])
+            else:
+                fn(uid)
+
+        if unpublish_first:
+            self._run_concurrently(lambda uid: call(lambda u: common.unpublish_ods_dataset(u, self.creds), uid),
+                                   unique_uids)
+            self.wait_for(list(current_uids.values()), self._unpublish_result)
+        reports = {uid: {'dataset_id': dataset_ids.get(uid, ''), 'dataset_uid': uid, 'status': 'submitted',
+                         'submit_seconds': None, 'seconds': None} for uid in unique_uids}
+
+        def submit(uid):
+            call(lambda u: common.publish_ods_dataset(u, self.creds), uid)
+            self.in_flight[current_uids[uid]] = datetime.now(timezone.utc)
+            reports[uid]['dataset_uid'] = current_uids[uid]
+            reports[uid]['submit_seconds'] = time.perf_counter() - start
+
+        self._run_concurrently(submit, unique_uids)
+        if wait:
+            results = self.wait_for(list(current_uids.values()), self._publish_result)
+            for uid in unique_uids:
+                status, finished = results[current_uids[uid]]
+                reports[uid]['status'] = status
+                reports[uid]['seconds'] = finished - start
+        for report in reports.values():
+            logging.info(f'Publish report: {report}')
+        return list(reports.values())
+
+    def wait_for(self, uids, get_result) -> dict:
+        """
+        Polls the status of all uids until get_result returns a result for each of them.
+
+        Returns a dict {uid: (result, time.perf_counter() when the result was found)}.
+        """
+        pending = list(uids)
+        results = {}
+        delay = self.poll_delay
+        deadline = time.perf_counter() + self.timeout
+        while pending:
+            time.sleep(delay)
+            with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+                statuses = list(executor.map(lambda uid: common.get_dataset_status(uid, self.creds), pending))
+            now = time.perf_counter()
+            for uid, status in zip(pending, statuses):
+                result = get_result(uid, *status)
+                if result is not None:
+                    results[uid] = (result, now)
+            done = [uid for uid in pending if uid in results]
+            pending = [uid for uid in pending if uid not in results]
+            # Poll again quickly while datasets are finishing, back off while ODS is busy
+            delay = self.poll_delay if done else min(delay * self.backoff, self.max_poll_delay)
+            if pending and now > deadline:
+                logging.warning(f'Timeout while waiting for ODS to process datasets {pending}...')
+                results.update({uid: ('timeout', now) for uid in pending})
+                pending = []
+        return results
+
+    def _publish_result(self, uid, is_published, status, since):
+        if status in FAILED_STATUSES:
+            logging.error(f'ODS reported status "{status}" after publishing dataset {uid}...')
+            self._finish(uid)
+            return status
+        if status != 'idle':
+            self._seen_busy.add(uid)
+            return None
+        if not is_published:
+            return None
+        submitted = self.in_flight.get(uid)
+        changed_since_submit = submitted is None or (since and _parse_since(since) >= submitted - CLOCK_TOLERANCE)
+        if uid in self._seen_busy or changed_since_submit:
+            self._finish(uid)
+            return 'published'
+        return None
+
+    @staticmethod
+    def _unpublish_result(uid, is_published, status, since):
+        return 'unpublished' if not is_published and status == 'idle' else None
+
+    def _finish(self, uid):
+        self.in_flight.pop(uid, None)
+        self._seen_busy.discard(uid)
+
+    def _run_concurrently(self, fn, uids):
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            futures = [executor.submit(fn, uid) for uid in uids]
+            errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            logging.error(f'{len(errors)} of {len(uids)} requests to ODS failed...')
+            raise errors[0]
+
+
+def _parse_since(since) -> datetime:
+    since = datetime.fromisoformat(since)
+    return since if since.tzinfo is not None else since.replace(tzinfo=timezone.utc)
+
+
+def get_orchestrator() -> PublishOrchestrator:
+    """Returns the PublishOrchestrator of this run, so that uids and datasets in flight are shared by all callers."""
+    global _orchestrator
+    if _orchestrator is None:
+        _orchestrator = PublishOrchestrator()
+    return _orchestrator
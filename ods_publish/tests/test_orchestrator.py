@@ -0,0 +1,127 @@
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import pytest
+import requests
+import common
+from ods_publish import orchestrator
+from ods_publish import uid_cache
+
+# The fake_ods fixture replaces it, the 404 test sends its requests through it
+common_publish_ods_dataset = common.publish_ods_dataset
+
+
+class FakeODS:
+    """Datasets are 'queued' for the first status polls after a publish request, then 'idle' and published."""
+
+    def __init__(self, polls_until_done):
+        self.polls_until_done = polls_until_done
+        self.lock = threading.Lock()
+        self.catalogue = {'100097': 'da_100097', '100200': 'da_100200', '100358': 'da_100358'}
+        self.catalogue_requests = 0
+        self.uid_requests = []
+        self.publish_requests = []
+        self.polls = {}
+        self.status = {}
+
+    def get_ods_catalogue_uids(self, creds):
+        self.catalogue_requests += 1
+        return dict(self.catalogue)
+
+    def get_ods_uids_by_ids(self, ods_ids, creds):
+        self.uid_requests.append(list(ods_ids))
+        return {ods_id: self.catalogue[ods_id] for ods_id in ods_ids if ods_id in self.catalogue}
+
+    def publish_ods_dataset(self, dataset_uid, creds):
+        with self.lock:
+            if self.status.get(dataset_uid) == 'queued':
+                raise RuntimeError(f'Dataset {dataset_uid} is still queued')
+            self.publish_requests.append(dataset_uid)
+            self.status[dataset_uid] = 'queued'
+            self.polls[dataset_uid] = 0
+
+    def get_dataset_status(self, dataset_uid, creds):
+        with self.lock:
+            self.polls[dataset_uid] += 1
+            if self.polls[dataset_uid] >= self.polls_until_done.get(dataset_uid, 1):
+                self.status[dataset_uid] = 'idle'
+            return True, self.status[dataset_uid], datetime.now(timezone.utc).isoformat()
+
+
+@pytest.fixture
+def fake_ods(monkeypatch):
+    ods = FakeODS({'da_100097': 1, 'da_100200': 3, 'da_100358': 2})
+    for name in ['get_ods_catalogue_uids', 'get_ods_uids_by_ids', 'publish_ods_dataset', 'get_dataset_status']:
+        monkeypatch.setattr(common, name, getattr(ods, name))
+    return ods
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return uid_cache.UidCache(creds=None, cache_file=str(tmp_path / 'ods_uids.json'))
+
+
+def test_publish_resolves_ids_once_and_waits_for_all(fake_ods, cache):
+    o = orchestrator.PublishOrchestrator(creds=None, poll_delay=0.01, cache=cache)
+    reports = o.publish(['100097', '100200', '100358', '100097'], wait=True)
+    assert fake_ods.catalogue_requests == 1
+    assert sorted(fake_ods.publish_requests) == ['da_100097', 'da_100200', 'da_100358']
+    assert [r['dataset_id'] for r in reports] == ['100097', '100200', '100358']
+    assert all(r['status'] == 'published' for r in reports)
+    assert reports[0]['seconds'] < reports[1]['seconds']
+    assert o.in_flight == {}
+    o.publish(['100200'])
+    assert fake_ods.catalogue_requests == 1
+    assert fake_ods.uid_requests == []
+
+
+def test_dataset_in_flight_is_published_again_after_it_is_done(fake_ods, cache):
+    o = orchestrator.PublishOrchestrator(creds=None, poll_delay=0.01, cache=cache)
+    o.publish(['100200'])
+    assert 'da_100200' in o.in_flight
+    o.publish(['100200'])
+    assert fake_ods.publish_requests == ['da_100200', 'da_100200']
+
+
+def test_unknown_dataset_id_raises(fake_ods, cache):
+    o = orchestrator.PublishOrchestrator(creds=None, poll_delay=0.01, cache=cache)
+    with pytest.raises(ValueError):
+        o.publish(['100097', 'unknown'])
+    assert fake_ods.uid_requests == [['unknown']]
+
+
+class FakeSession:
+    """Answers publish requests like the ODS automation API, with 404 for uids ODS does not know."""
+
+    def __init__(self, known_uids):
+        self.known_uids = known_uids
+        self.posts = []
+
+    def post(self, url, **kwargs):
+        self.posts.append(url)
+        response = requests.Response()
+        response.url = url
+        response.status_code = 200 if url.split('/')[-2] in self.known_uids else 404
+        return response
+
+
+def test_outdated_uid_is_resolved_again_on_first_404(fake_ods, cache, monkeypatch):
+    cache.get_uids(['100097'])
+    fake_ods.catalogue['100097'] = 'da_new'
+    session = FakeSession(known_uids={'da_new'})
+    monkeypatch.setattr(common.http_session, 'get_session', lambda: session)
+    monkeypatch.setattr(common, 'publish_ods_dataset', common_publish_ods_dataset)
+
+    def no_sleep(seconds):
+        raise AssertionError('A 404 must not be retried')
+
+    monkeypatch.setattr(time, 'sleep', no_sleep)
+    o = orchestrator.PublishOrchestrator(creds=SimpleNamespace(api_key='key'), poll_delay=0.01, cache=cache)
+    reports = o.publish(['100097'])
+    assert reports[0]['dataset_uid'] == 'da_new'
+    # One request with the outdated uid, then the uid is resolved again and one request with the current uid
+    assert session.posts == ['https://data.bs.ch/api/automation/v1.0/datasets/da_100097/publish',
+                             'https://data.bs.ch/api/automation/v1.0/datasets/da_new/publish']
+    assert fake_ods.uid_requests == [['100097']]
+    assert cache.get_uids(['100097']) == {'100097': 'da_new'}
@@ -0,0 +1,61 @@
+import pytest
+import common
+from ods_publish import uid_cache
+
+
+@pytest.fixture
+def catalogue(monkeypatch):
+    calls = {'catalogue': 0, 'ids': []}
+    uids = {'100097': 'da_a', '100200': 'da_b'}
+
+    def get_ods_catalogue_uids(creds):
+        calls['catalogue'] += 1
+        return dict(uids)
+
+    def get_ods_uids_by_ids(ods_ids, creds):
+        calls['ids'].append(list(ods_ids))
+        return {ods_id: uids[ods_id] for ods_id in ods_ids if ods_id in uids}
+
+    monkeypatch.setattr(common, 'get_ods_catalogue_uids', get_ods_catalogue_uids)
+    monkeypatch.setattr(common, 'get_ods_uids_by_ids', get_ods_uids_by_ids)
+    calls['uids'] = uids
+    return calls
+
+
+def test_cache_is_persisted(catalogue, tmp_path):
+    cache_file = str(tmp_path / 'ods_uids.json')
+    assert uid_cache.UidCache(creds=None, cache_file=cache_file).get_uids(['100097']) == {'100097': 'da_a'}
+    assert uid_cache.UidCache(creds=None, cache_file=cache_file).get_uids(['100200', '100097']) == {
+        '100200': 'da_b', '100097': 'da_a'}
+    assert catalogue['catalogue'] == 1
+    assert catalogue['ids'] == []
+
+
+def test_new_dataset_is_requested_by_id(catalogue, tmp_path):
+    cache = uid_cache.UidCache(creds=None, cache_file=str(tmp_path / 'ods_uids.json'))
+    cache.prefill()
+    catalogue['uids']['100300'] = 'da_c'
+    assert cache.get_uids(['100097', '100300']) == {'100097': 'da_a', '100300': 'da_c'}
+    assert catalogue['catalogue'] == 1
+    assert catalogue['ids'] == [['100300']]
+
+
+def test_expired_entries_are_refreshed(catalogue, tmp_path):
+    cache = uid_cache.UidCache(creds=None, cache_file=str(tmp_path / 'ods_uids.json'), ttl=3600)
+    cache.get_uids(['100097'])
+    cache.get_uids(['100097'])
+    assert catalogue['catalogue'] == 1
+    cache.listed_at -= 7200
+    cache.entries['100097']['fetched_at'] -= 7200
+    cache.get_uids(['100097'])
+    assert catalogue['catalogue'] == 2
+
+
+def test_invalidate(catalogue, tmp_path):
+    cache_file = str(tmp_path / 'ods_uids.json')
+    cache = uid_cache.UidCache(creds=None, cache_file=cache_file)
+    cache.get_uids(['100097'])
+    catalogue['uids']['100097'] = 'da_new'
+    cache.invalidate('100097')
+    assert uid_cache.UidCache(creds=None, cache_file=cache_file).get_uids(['100097']) == {'100097': 'da_new'}
+    assert catalogue['ids'] == [['100097']]
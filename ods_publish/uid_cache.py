@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import common
+from ods_publish import credentials
+
+# The uid of a dataset practically never changes, entries are refreshed after a week or if ODS answers with 404
+TTL_SECONDS = 7 * 24 * 60 * 60
+
+_uid_cache = None
+_uid_cache_lock = threading.Lock()
+
+
+def get_cache_file() -> str:
+    curr_dir = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(curr_dir, 'data', 'ods_uids.json')
+
+
+class UidCache:
+    """
+    On-disk cache of the mapping from ODS dataset id to the uid used by the automation API.
+
+    If requested ids are missing or expired and the catalogue was last listed more than ttl seconds ago,
+    the uids of all datasets are retrieved with one paginated listing of the catalogue. Otherwise only
+    the missing ids are requested. Entries that ODS does not know anymore are removed with invalidate().
+    """
+
+    def __init__(self, creds=credentials, cache_file='', ttl=TTL_SECONDS):
+        self.creds = creds
+        self.cache_file = cache_file or get_cache_file()
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.listed_at = 0
+        # dataset id -> {'uid': uid, 'fetched_at': unix timestamp}
+        self.entries = {}
+        if os.path.exists(self.cache_file):
+            with open(self.cache_file, 'r') as f:
+                cache = json.load(f)
+            self.listed_at = cache['listed_at']
+            self.entries = cache['entries']
+
+    def get_uids(self, dataset_ids) -> dict:
+        """Returns a dict {dataset id: uid}, raises a ValueError if ODS has no dataset with one of the ids."""
+        dataset_ids = list(dict.fromkeys(dataset_ids))
+        with self._lock:
+            missing = self._missing(dataset_ids)
+            if missing and time.time() - self.listed_at > self.ttl:
+                self._prefill()
+                missing = self._missing(dataset_ids)
+            if missing:
+                self._store(common.get_ods_uids_by_ids(missing, self.creds))
+            not_found = self._missing(dataset_ids)
+            if not_found:
+                raise ValueError(f'No ODS datasets found with ids {not_found}')
+            return {dataset_id: self.entries[dataset_id]['uid'] for dataset_id in dataset_ids}
+
+    def prefill(self):
+        """Retrieves and caches the uids of all datasets in the catalogue."""
+        with self._lock:
+            self._prefill()
+
+    def invalidate(self, dataset_id):
+        """Removes the uid of dataset_id, so that it is requested from ODS again the next time it is needed."""
+        with self._lock:
+            if self.entries.pop(dataset_id, None) is not None:
+                logging.info(f'Removed uid of dataset {dataset_id} from cache {self.cache_file}...')
+                self._save()
+
+    def _missing(self, dataset_ids) -> list:
+        now = time.time()
+        return [dataset_id for dataset_id in dataset_ids
+                if dataset_id not in self.entries or now - self.entries[dataset_id]['fetched_at'] > self.ttl]
+
+    def _prefill(self):
+        uids = common.get_ods_catalogue_uids(self.creds)
+        self.listed_at = time.time()
+        # Datasets that are not in the catalogue anymore are dropped as well
+        self.entries = {}
+        self._store(uids)
+
+    def _store(self, uids):
+        now = time.time()
+        self.entries.update({dataset_id: {'uid': uid, 'fetched_at': now} for dataset_id, uid in uids.items()})
+        self._save()
+
+    def _save(self):
+        common.write_json_atomic(self.cache_file, {'listed_at': self.listed_at, 'entries': self.entries})
+
+
+def get_uid_cache() -> UidCache:
+    """Returns the UidCache shared by all ods_publish functions of this process."""
+    global _uid_cache
+    with _uid_cache_lock:
+        if _uid_cache is None:
+            _uid_cache = UidCache()
+        return _uid_cache
@@ -0,0 +1,66 @@
+import os
+from io import StringIO
+import pandas as pd
+import pytest
+from rapidfuzz import process, fuzz
+from parlamentsdienst_gr_abstimmungen import utilities
+
+MEMBERS_CSV = ('name;vorname;name_vorname;url;uni_nr\n'
+               'Messerli;Beatrice;Messerli, Beatrice;https://grosserrat.bs.ch/?mnr=1;1\n'
+               'Baumgartner;Claudia;Baumgartner, Claudia;https://grosserrat.bs.ch/?mnr=2;2\n'
+               'Baumgartner;Thomas;Baumgartner, Thomas;https://grosserrat.bs.ch/?mnr=3;3\n'
+               'von Falkenstein;Patricia;von Falkenstein, Patricia;https://grosserrat.bs.ch/?mnr=4;4\n'
+               'Müller-Meier;Anna Lena;Müller-Meier, Anna Lena;https://grosserrat.bs.ch/?mnr=5;5\n'
+               'Vakanz;Vakanz;Vakanz;;0\n')
+
+
+@pytest.fixture
+def downloads(tmp_path, monkeypatch):
+    calls = []
+
+    def get_dataset(*args, **kwargs):
+        calls.append(args)
+        return pd.read_csv(StringIO(MEMBERS_CSV), sep=';')
+
+    monkeypatch.setattr(utilities.credentials, 'data_path', str(tmp_path), raising=False)
+    monkeypatch.setattr(utilities.reference_data, 'get_dataset', get_dataset)
+    return calls
+
+
+def poll_df():
+    return pd.DataFrame({'Mitglied_Name': ['Beatrice Messerli', 'Claudia Baumgartner', 'Thomas Baumgarter',
+                                           'Patricia von Falkenstein', 'Anna Müller', 'Beatrice Messerli', 'Vakanz']})
+
+
+def test_matches_extract_one(downloads, tmp_path):
+    resolver = utilities.NameResolver(path_lookup_table=os.path.join(tmp_path, 'lookup.csv'))
+    df = resolver.fill(poll_df())
+    name_index = resolver.get_name_index()
+    choices = name_index['comb_name_vorname'].tolist()
+    for name, name_vorname in zip(poll_df()['Mitglied_Name'], df['Mitglied_Name']):
+        _, _, i = process.extractOne(name, choices, scorer=fuzz.WRatio)
+        assert name_vorname == name_index.loc[i, 'name_vorname']
+    assert df['GR_url_ods'].tolist()[:2] == ['https://data.bs.ch/explore/dataset/100307/?refine.uni_nr=1',
+                                             'https://data.bs.ch/explore/dataset/100307/?refine.uni_nr=2']
+    assert df['GR_url_ods'].iloc[-1] == ''
+    assert len(downloads) == 1
+
+
+def test_lookup_table_is_reused(downloads, tmp_path):
+    path_lookup_table = os.path.join(tmp_path, 'lookup.csv')
+    df_first = utilities.NameResolver(path_lookup_table=path_lookup_table).fill(poll_df())
+    lookup_table = pd.read_csv(path_lookup_table)
+    assert lookup_table['fuzzy_name'].tolist() == ['Vakanz', 'Anna Müller', 'Patricia von Falkenstein',
+                                                   'Thomas Baumgarter', 'Claudia Baumgartner', 'Beatrice Messerli']
+    df_second = utilities.NameResolver(path_lookup_table=path_lookup_table).fill(poll_df())
+    # All names are known, so neither the members are downloaded nor the name combinations built again
+    assert len(downloads) == 1
+    assert df_second.astype(str).equals(df_first.astype(str))
+
+
+def test_name_index_is_cached_per_version(downloads, tmp_path):
+    utilities.NameResolver(path_lookup_table=os.path.join(tmp_path, 'lookup.csv')).get_name_index(surname_first=True)
+    index_files = [f for f in os.listdir(tmp_path) if f.startswith('name_index_surname_first_')]
+    assert len(index_files) == 1
+    name_index = utilities.NameResolver(path_lookup_table=os.path.join(tmp_path, 'lookup.csv')).get_name_index(True)
+    assert 'Müller Meier Anna Lena' in name_index['comb_name_vorname'].tolist()
@@ -9,8 +9,11 @@ from zoneinfo import ZoneInfo
 from rapidfuzz import process, fuzz
 from itertools import combinations
 import pathlib
+import numpy as np
+from hashlib import blake2b
 
 import common
+from common import reference_data
 from parlamentsdienst_gr_abstimmungen import credentials
 
 
@@ -180,67 +183,111 @@ def create_name_combinations(row, surname_first=False):
         for comb in name_combinations]
 
 
-def fill_values_from_dataframe(df: pd.DataFrame, df_lookup: pd.DataFrame, index, index_lookup):
-    df.loc[index, 'Mitglied_Nachname'] = df_lookup.loc[index_lookup, 'name']
-    df.loc[index, 'Mitglied_Vorname'] = df_lookup.loc[index_lookup, 'vorname']
-    df.loc[index, 'Mitglied_Name'] = df_lookup.loc[index_lookup, 'name_vorname']
-    df.loc[index, 'GR_uni_nr'] = df_lookup.loc[index_lookup, 'uni_nr']
-    df.loc[index, 'GR_url'] = df_lookup.loc[index_lookup, 'url']
-    df.loc[index, 'GR_url_ods'] = '' if df_lookup.loc[index_lookup, 'name'] == 'Vakanz' else \
-        'https://data.bs.ch/explore/dataset/100307/?refine.uni_nr=' + df_lookup.loc[index_lookup, 'uni_nr'].astype(
-            int).astype(str)
-    return df
+LOOKUP_COLUMNS = ['fuzzy_name', 'closest_combination', 'fuzz_score', 'name', 'vorname', 'name_vorname', 'uni_nr', 'url']
 
+_name_resolver = None
 
-def get_closest_name_from_member_dataset(df: pd.DataFrame, surname_first=False):
-    # Create new columns
-    df['Mitglied_Vorname'] = ''
-    df['Mitglied_Nachname'] = ''
-    df['GR_uni_nr'] = ''
-    df['GR_url'] = ''
-    df['GR_url_ods'] = ''
-    # Download members of Grosser Rat from ods
-    raw_data_file = os.path.join(credentials.data_path, 'members_gr.csv')
-    logging.info(f'Downloading Members of Grosser Rat from ods to file {raw_data_file}...')
-    r = common.requests_get(f'https://data.bs.ch/api/records/1.0/download?dataset=100307')
-    with open(raw_data_file, 'wb') as f:
-        f.write(r.content)
-    df_gr_mitglieder = pd.read_csv(raw_data_file, sep=';')
-    df_names = df_gr_mitglieder[['name', 'vorname', 'name_vorname', 'url', 'uni_nr']]
-    # Create all combinations of names
-    expanded_rows = [create_name_combinations(row, surname_first=surname_first) for index, row in df_names.iterrows()]
-    expanded_df = pd.DataFrame([item for sublist in expanded_rows for item in sublist])
-    name_list = expanded_df['comb_name_vorname'].tolist()
-    path_lookup_table = os.path.join(pathlib.Path(__file__).parents[0], 'data', 'lookup_grossrat.csv')
-    if os.path.exists(path_lookup_table):
-        logging.info(f'Loading lookup table from {path_lookup_table}...')
-        lookup_table = pd.read_csv(path_lookup_table)
-    else:
-        logging.info(f'Creating lookup table and saving to {path_lookup_table}...')
-        lookup_table = pd.DataFrame(
-            columns=['fuzzy_name', 'closest_combination', 'fuzz_score',
-                     'name', 'vorname', 'name_vorname', 'uni_nr', 'url'])
-    for index, row in df.iterrows():
-        if row['Mitglied_Name'] in lookup_table['fuzzy_name'].tolist():
-            index_lookup = lookup_table.loc[lookup_table['fuzzy_name'] == row['Mitglied_Name']].index[0]
+
+class NameResolver:
+    """
+    Maps the member names found in the poll files to the members of Grosser Rat in dataset 100307.
+
+    The combinations of first and last names of all members are built once and cached to disk for each
+    version of 100307. Names seen before are taken from the persistent lookup table, all other names
+    are matched in a single batch using rapidfuzz.
+    """
+
+    def __init__(self, path_lookup_table=''):
+        self.path_lookup_table = path_lookup_table or os.path.join(pathlib.Path(__file__).parents[0], 'data',
+                                                                   'lookup_grossrat.csv')
+        self.members = None
+        self.members_hash = None
+        self.name_indexes = {}
+        self.lookup = {}
+        self.new_names = []
+        if os.path.exists(self.path_lookup_table):
+            logging.info(f'Loading lookup table from {self.path_lookup_table}...')
+            for entry in pd.read_csv(self.path_lookup_table).to_dict('records'):
+                self.lookup.setdefault(entry['fuzzy_name'], entry)
+
+    def get_name_index(self, surname_first=False) -> pd.DataFrame:
+        """Returns all combinations of first and last names of the members, built once per version of 100307."""
+        if surname_first in self.name_indexes:
+            return self.name_indexes[surname_first]
+        if self.members is None:
+            logging.info(f'Getting Members of Grosser Rat from the local snapshot of ods dataset 100307...')
+            self.members = reference_data.get_dataset('100307')
+            self.members_hash = blake2b(pd.util.hash_pandas_object(self.members, index=False).to_numpy().tobytes(),
+                                        digest_size=16).hexdigest()
+        order = 'surname_first' if surname_first else 'first_name_first'
+        index_file = os.path.join(credentials.data_path, f'name_index_{order}_{self.members_hash}.pkl')
+        if os.path.exists(index_file):
+            logging.info(f'Loading name combinations from {index_file}...')
+            name_index = pd.read_pickle(index_file)
         else:
-            logging.info(f'Looking for closest name for {row["Mitglied_Name"]}...')
-            closest_name, score, index_gr_mitglieder = process.extractOne(row['Mitglied_Name'], name_list,
-                                                                          scorer=fuzz.WRatio)
-            logging.info(f'Closest name for {row["Mitglied_Name"]} is {closest_name} with score {score}...')
-            lookup_table.loc[-1] = [row['Mitglied_Name'], closest_name, score,
-                                    expanded_df.loc[index_gr_mitglieder, 'name'],
-                                    expanded_df.loc[index_gr_mitglieder, 'vorname'],
-                                    expanded_df.loc[index_gr_mitglieder, 'name_vorname'],
-                                    expanded_df.loc[index_gr_mitglieder, 'uni_nr'],
-                                    expanded_df.loc[index_gr_mitglieder, 'url']]
-            lookup_table.index = lookup_table.index + 1
-            lookup_table.sort_index(inplace=True)
-            index_lookup = lookup_table.index[0]
-        df = fill_values_from_dataframe(df, lookup_table, index, index_lookup)
-    # Save lookup table
-    lookup_table.to_csv(path_lookup_table, index=False)
-    return df
+            df_names = self.members[['name', 'vorname', 'name_vorname', 'url', 'uni_nr']]
+            # Create all combinations of names
+            name_index = pd.DataFrame([comb for row in df_names.to_dict('records')
+                                       for comb in create_name_combinations(row, surname_first=surname_first)])
+            # Name combinations of earlier versions of 100307 are not needed anymore
+            for old_index_file in pathlib.Path(credentials.data_path).glob(f'name_index_{order}_*.pkl'):
+                old_index_file.unlink()
+            logging.info(f'Saving name combinations to {index_file}...')
+            name_index.to_pickle(index_file)
+        self.name_indexes[surname_first] = name_index
+        return name_index
+
+    def resolve(self, names, surname_first=False) -> pd.DataFrame:
+        """Returns the lookup table entries for names, indexed by name. Unknown names are matched in one batch."""
+        unique_names = pd.unique(pd.Series(names).dropna())
+        missing = [name for name in unique_names if name not in self.lookup]
+        if missing:
+            name_index = self.get_name_index(surname_first)
+            choices = name_index['comb_name_vorname'].tolist()
+            logging.info(f'Looking for closest names for {len(missing)} names...')
+            scores = process.cdist(missing, choices, scorer=fuzz.WRatio, dtype=np.float64, workers=-1)
+            # argmax returns the first of equally good matches, as process.extractOne does
+            best = scores.argmax(axis=1)
+            for name, i, score in zip(missing, best, scores[np.arange(len(missing)), best]):
+                logging.info(f'Closest name for {name} is {choices[i]} with score {score}...')
+                self.lookup[name] = {'fuzzy_name': name, 'closest_combination': choices[i], 'fuzz_score': float(score),
+                                     **name_index.loc[i, ['name', 'vorname', 'name_vorname', 'uni_nr', 'url']]}
+                self.new_names.append(name)
+            self.save_lookup_table()
+        return pd.DataFrame([self.lookup[name] for name in unique_names], columns=LOOKUP_COLUMNS, index=unique_names)
+
+    def fill(self, df: pd.DataFrame, surname_first=False) -> pd.DataFrame:
+        """Replaces Mitglied_Name by the name of the closest member and adds the columns of that member."""
+        resolved = self.resolve(df['Mitglied_Name'], surname_first=surname_first)
+        resolved['url_ods'] = ['' if name == 'Vakanz' else
+                               'https://data.bs.ch/explore/dataset/100307/?refine.uni_nr=' + str(int(uni_nr))
+                               for name, uni_nr in zip(resolved['name'], resolved['uni_nr'])]
+        names = df['Mitglied_Name']
+        for col, lookup_col in [('Mitglied_Vorname', 'vorname'), ('Mitglied_Nachname', 'name'),
+                                ('GR_uni_nr', 'uni_nr'), ('GR_url', 'url'), ('GR_url_ods', 'url_ods'),
+                                ('Mitglied_Name', 'name_vorname')]:
+            df[col] = names.map(resolved[lookup_col])
+        return df
+
+    def save_lookup_table(self):
+        # Names found most recently are at the top of the lookup table
+        entries = list(self.lookup.values())
+        n_loaded = len(entries) - len(self.new_names)
+        lookup_table = pd.DataFrame(entries[n_loaded:][::-1] + entries[:n_loaded], columns=LOOKUP_COLUMNS)
+        logging.info(f'Saving lookup table to {self.path_lookup_table}...')
+        lookup_table.to_csv(self.path_lookup_table, index=False)
+
+
+def get_name_resolver() -> NameResolver:
+    """Returns the NameResolver of this run, so that the members are only downloaded and indexed once."""
+    global _name_resolver
+    if _name_resolver is None:
+        _name_resolver = NameResolver()
+    return _name_resolver
+
+
+def get_closest_name_from_member_dataset(df: pd.DataFrame, surname_first=False):
+    return get_name_resolver().fill(df, surname_first=surname_first)
 
 
 def add_seat_99(df):
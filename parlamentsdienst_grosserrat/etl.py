@@ -3,28 +3,22 @@ import pandas as pd
 import numpy as np
 import logging
 import ast
-from datetime import datetime
-from io import StringIO
+from datetime import datetime, timedelta
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from parlamentsdienst_grosserrat import credentials
 import common
 
 # All paths
 PATH_GR = 'https://grosserrat.bs.ch/index.php?option=com_gribs&view=exporter&format=csv&chosentable='
-PATH_ADR = StringIO(common.requests_get(f'{PATH_GR}adr').text)
-PATH_MIT = StringIO(common.requests_get(f'{PATH_GR}mit').text)
-PATH_GRE = StringIO(common.requests_get(f'{PATH_GR}gre').text)
-PATH_INTR = StringIO(common.requests_get(f'{PATH_GR}intr').text)
-PATH_GES = StringIO(common.requests_get(f'{PATH_GR}ges').text)
-PATH_KON = StringIO(common.requests_get(f'{PATH_GR}kon').text)
-PATH_ZUW = StringIO(common.requests_get(f'{PATH_GR}zuw').text)
-PATH_DOK = StringIO(common.requests_get(f'{PATH_GR}dok').text)
-PATH_VOR = StringIO(common.requests_get(f'{PATH_GR}vor').text)
-PATH_SIZ = StringIO(common.requests_get(f'{PATH_GR}siz').text)
-PATH_GR_SITZUNG = StringIO(common.requests_get(f'{PATH_GR}gr_sitzung').text)
-PATH_GR_TAGESORDNUNG = StringIO(common.requests_get(f'{PATH_GR}gr_tagesordnung').text)
-PATH_GR_TRAKTANDEN = StringIO(common.requests_get(f'{PATH_GR}gr_tagesordnung_pos').text)
+# GRIBS exporter tables, they are only downloaded when running main()
+GRIBS_TABLES = {'adr': 'Personen', 'mit': 'Mitgliedschaften', 'gre': 'Gremien', 'intr': 'Interessensbindungen',
+                'ges': 'Geschäfte', 'kon': 'Konsorten', 'zuw': 'Zuweisungen', 'dok': 'Dokumente', 'vor': 'Vorgänge',
+                'siz': 'Sitzungen', 'gr_sitzung': 'Sitzungsdaten', 'gr_tagesordnung': 'Tagesordnung',
+                'gr_tagesordnung_pos': 'Traktanden'}
+# Downloaded tables younger than this are read from disk instead of being downloaded again (e.g. when re-running the job)
+GRIBS_CACHE_MAX_AGE = timedelta(hours=1)
 PATH_PERSONEN = 'https://grosserrat.bs.ch/?mnr='
 PATH_GESCHAEFT = 'https://grosserrat.bs.ch/?gnr='
 PATH_DOKUMENT = 'https://grosserrat.bs.ch/?dnr='
@@ -124,42 +118,30 @@ def main():
     2. Process and modify the data
     3. Create CSV files for data.bs.ch
     """
-    logging.info(f'Reading Personen.csv...')
-    df_adr = common.pandas_read_csv(PATH_ADR, encoding='utf-8', dtype=str)
-    logging.info(f'Reading Mitgliedschaften.csv...')
-    df_mit = common.pandas_read_csv(PATH_MIT, encoding='utf-8', dtype=str)
-    logging.info(f'Reading Gremien.csv...')
-    df_gre = common.pandas_read_csv(PATH_GRE, encoding='utf-8', dtype=str)
-    logging.info(f'Reading Interessensbindungen.csv...')
-    df_intr = common.pandas_read_csv(PATH_INTR, encoding='utf-8', dtype=str)
-
-    logging.info(f'Reading Geschäfte.csv...')
-    df_ges = common.pandas_read_csv(PATH_GES, encoding='utf-8', dtype=str)
+    tables = load_gribs_tables(list(GRIBS_TABLES))
+    df_adr = tables['adr']
+    df_mit = tables['mit']
+    df_gre = tables['gre']
+    df_intr = tables['intr']
+
+    df_ges = tables['ges']
     # Replace identifiers to match with values in the committee list (gremium.csv)
     df_ges['gr_urheber'] = df_ges['gr_urheber'].replace(REPLACE_UNI_NR_GRE_DICT)
 
-    logging.info(f'Reading Konsorten.csv...')
-    df_kon = common.pandas_read_csv(PATH_KON, encoding='utf-8', dtype=str)
+    df_kon = tables['kon']
     df_kon['uni_nr_adr'] = df_kon['uni_nr_adr'].replace(REPLACE_UNI_NR_GRE_DICT)
 
-    logging.info(f'Reading Zuweisungen.csv...')
-    df_zuw = common.pandas_read_csv(PATH_ZUW, encoding='utf-8', dtype=str)
+    df_zuw = tables['zuw']
     # Replace identifiers to match with values in the committee list (gremium.csv)
     df_zuw['uni_nr_an'] = df_zuw['uni_nr_an'].replace(REPLACE_UNI_NR_GRE_DICT)
     df_zuw['uni_nr_von'] = df_zuw['uni_nr_von'].replace(REPLACE_UNI_NR_GRE_DICT)
 
-    logging.info(f'Reading Dokumente.csv...')
-    df_dok = common.pandas_read_csv(PATH_DOK, encoding='utf-8', dtype=str)
-    logging.info(f'Reading Vorgänge.csv...')
-    df_vor = common.pandas_read_csv(PATH_VOR, encoding='utf-8', dtype=str)
-    logging.info(f'Reading Sitzungen.csv...')
-    df_siz = common.pandas_read_csv(PATH_SIZ, encoding='utf-8', dtype=str)
-    logging.info(f'Reading Sitzungsdaten.csv...')
-    df_gr_sitzung = common.pandas_read_csv(PATH_GR_SITZUNG, encoding='utf-8', dtype=str)
-    logging.info(f'Reading Tagesordnung.csv...')
-    df_gr_tagesordnung = common.pandas_read_csv(PATH_GR_TAGESORDNUNG, encoding='utf-8', dtype=str)
-    logging.info(f'Reading Traktanden.csv...')
-    df_gr_traktanden = common.pandas_read_csv(PATH_GR_TRAKTANDEN, encoding='utf-8', dtype=str)
+    df_dok = tables['dok']
+    df_vor = tables['vor']
+    df_siz = tables['siz']
+    df_gr_sitzung = tables['gr_sitzung']
+    df_gr_tagesordnung = tables['gr_tagesordnung']
+    df_gr_traktanden = tables['gr_tagesordnung_pos']
 
     # Perform data processing and CSV file creation functions
     args_for_uploads = [create_mitglieder_csv(df_adr, df_mit),
@@ -177,6 +159,42 @@ def main():
         common.update_ftp_and_odsp(*args_for_upload)
 
 
+def load_gribs_tables(tables: list, max_workers=8) -> dict:
+    """
+    Downloads the given GRIBS exporter tables in parallel and reads them into DataFrames.
+
+    Args:
+        tables (list): Names of the tables as used in the exporter url, see GRIBS_TABLES.
+        max_workers (int): Maximum number of parallel downloads.
+
+    Returns:
+        dict: DataFrames (all columns as str) by table name.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        dfs = dict(zip(tables, executor.map(load_gribs_table, tables)))
+    logging.info(f'Loaded {len(tables)} GRIBS tables in {time.perf_counter() - start:.1f} seconds')
+    return dfs
+
+
+def load_gribs_table(table: str) -> pd.DataFrame:
+    """
+    Downloads a GRIBS exporter table to the data folder and reads it into a DataFrame.
+
+    If the file in the data folder is younger than GRIBS_CACHE_MAX_AGE, it is read without downloading it again.
+    """
+    path_raw = os.path.join(credentials.data_path, 'gribs', f'{table}.csv')
+    if os.path.exists(path_raw) and datetime.now() - datetime.fromtimestamp(os.path.getmtime(path_raw)) < GRIBS_CACHE_MAX_AGE:
+        logging.info(f'Reading {GRIBS_TABLES[table]}.csv from recently downloaded file {path_raw}...')
+    else:
+        logging.info(f'Downloading {GRIBS_TABLES[table]}.csv...')
+        r = common.requests_get(f'{PATH_GR}{table}', cache=True)
+        os.makedirs(os.path.dirname(path_raw), exist_ok=True)
+        with open(path_raw, 'wb') as f:
+            f.write(r.content)
+    return common.pandas_read_csv(path_raw, encoding='utf-8', dtype=str)
+
+
 def create_mitglieder_csv(df_adr: pd.DataFrame, df_mit: pd.DataFrame) -> tuple:
     # Select members of Grosser Rat without specific functions
     # since functions are always recorded as part of an entire membership
@@ -560,33 +578,19 @@ def create_vorgaenge_csv(df_ges: pd.DataFrame, df_vor: pd.DataFrame, df_siz: pd.
 
 def create_traktanden_csv(df_gr_tagesordnung: pd.DataFrame, df_gr_traktanden: pd.DataFrame,
                           df_gr_sitzung: pd.DataFrame) -> tuple:
-    transformed_columns = ['idnr', 'gr_sitzung_idnr', 'einleitungstext', 'zwischentext',
-                           'gruppennummer', 'gruppentitel', 'gruppentitel_pos', 'gruppentitel_next_pos']
-    transformed_df = pd.DataFrame(columns=transformed_columns)
+    df = transform_traktanden(df_gr_tagesordnung, df_gr_traktanden, df_gr_sitzung)
+
+    logging.info(f'Creating dataset "Grosser Rat: Traktanden"...')
+    path_export = os.path.join(credentials.data_path, 'export', '100348_gr_traktanden.csv')
+    df.to_csv(path_export, index=False)
+    # Returning the path where the created CSV-file is stored
+    # and two string identifiers which are needed to update the file in the FTP server and in ODSP
+    return path_export, 'parlamentsdienst/grosser_rat', '100348'
 
-    # Finding out how many gruppentitel there are
-    max_gruppentitel = max(int(col.split('_')[1]) for col in df_gr_tagesordnung.columns if 'gruppentitel_' in col)
 
-    # Transforming the dataframe to have one row per gruppentitel
-    for index, row in df_gr_tagesordnung.iterrows():
-        for i in range(1, max_gruppentitel + 1):
-            gruppentitel = row[f'gruppentitel_{i}']
-            gruppentitel_pos = row[f'gruppentitel_{i}_pos']
-            gruppentitel_next_pos = row[f'gruppentitel_{i + 1}_pos'] if i < max_gruppentitel else '0'
-
-            # Skip rows where gruppentitel is empty
-            if pd.notna(gruppentitel) and gruppentitel != "":
-                new_row = {
-                    'idnr': row['idnr'],
-                    'gr_sitzung_idnr': row['gr_sitzung_idnr'],
-                    'einleitungstext': row['einleitungstext'],
-                    'zwischentext': row['zwischentext'],
-                    'gruppennummer': i,
-                    'gruppentitel': gruppentitel,
-                    'gruppentitel_pos': gruppentitel_pos,
-                    'gruppentitel_next_pos': gruppentitel_next_pos
-                }
-                transformed_df = pd.concat([transformed_df, pd.DataFrame([new_row])], ignore_index=True)
+def transform_traktanden(df_gr_tagesordnung: pd.DataFrame, df_gr_traktanden: pd.DataFrame,
+                         df_gr_sitzung: pd.DataFrame) -> pd.DataFrame:
+    transformed_df = explode_gruppentitel(df_gr_tagesordnung)
     # Replace 0 in gruppentitel_next_pos with a big number
     transformed_df['gruppentitel_next_pos'] = transformed_df['gruppentitel_next_pos'].replace('0', '999999').fillna(
         '999999')
@@ -627,8 +631,7 @@ def create_traktanden_csv(df_gr_tagesordnung: pd.DataFrame, df_gr_traktanden: pd
             return np.nan
 
     df['anr'] = df['Abstimmung'].str.replace('.pdf', '').apply(safe_literal_eval)
-    df['anr'] = pd.json_normalize(df['anr']).map(transform_value).apply(lambda x: ','.join(x.dropna().astype(str)),
-                                                                        axis=1)
+    df['anr'] = join_non_null(pd.json_normalize(df['anr']).map(transform_value), ',')
 
     # Create url's
     df['url_tagesordnung_dok'] = PATH_MEDIA_TAGESORDNUNG + 'tagesordnung_' + df['tag1'] + '.pdf'
@@ -649,31 +652,23 @@ def create_traktanden_csv(df_gr_tagesordnung: pd.DataFrame, df_gr_traktanden: pd
     df['url_dok'] = ''
     df['url_dokument_ods'] = ''
     df['url_abstimmungen'] = ''
-    for index, row in df.iterrows():
-        if isinstance(row['signatur'], str) and '.' in row['signatur']:
-            df.at[index, 'url_ges'] = ''
-            df.at[index, 'url_geschaeft_ods'] = f'{PATH_DATASET}100311/?'
-            df.at[index, 'url_dok'] = ''
-            df.at[index, 'url_dokument_ods'] = f'{PATH_DATASET}100313/?'
-            signaturen = row['signatur'].split(',')
-            for signatur in signaturen:
-                signatur_parts = signatur.split('.')
-                df.at[index, 'url_ges'] += f"{PATH_GESCHAEFT}{'.'.join(signatur_parts[:2])} ,"
-                df.at[index, 'url_geschaeft_ods'] += f"refine.signatur_ges={'.'.join(signatur_parts[:2])}&"
-                df.at[index, 'url_dok'] += f"{PATH_DOKUMENT}{signatur} ,"
-                df.at[index, 'url_dokument_ods'] += f"refine.signatur_dok={signatur}&"
-            # remove last char of every url
-            df.at[index, 'url_ges'] = df.at[index, 'url_ges'][:-1]
-            df.at[index, 'url_geschaeft_ods'] = df.at[index, 'url_geschaeft_ods'][:-1]
-            df.at[index, 'url_dok'] = df.at[index, 'url_dok'][:-1]
-            df.at[index, 'url_dokument_ods'] = df.at[index, 'url_dokument_ods'][:-1]
-        if isinstance(row['anr'], str) and '-' in row['anr']:
-            df.at[index, 'url_abstimmungen'] = f'{PATH_DATASET}100186/?'
-            anrs = row['anr'].split(',')
-            for anr in anrs:
-                df.at[index, 'url_abstimmungen'] += f"refine.anr={anr}&"
-            # remove last char of url
-            df.at[index, 'url_abstimmungen'] = df.at[index, 'url_abstimmungen'][:-1]
+    # Signaturen and Abstimmungs-IDs are comma separated lists, their urls are built by replacing the commas
+    has_signatur = df['signatur'].map(lambda x: isinstance(x, str) and '.' in x)
+    signaturen = df.loc[has_signatur, 'signatur']
+    # The Geschäft is identified by the first two parts of the signatur, e.g. 23.5012 for the Dokument 23.5012.01
+    signaturen_ges = signaturen.str.replace(r'([^,.]*(?:\.[^,.]*)?)[^,]*', r'\1', regex=True)
+    df.loc[has_signatur, 'url_ges'] = (PATH_GESCHAEFT +
+                                       signaturen_ges.str.replace(',', f' ,{PATH_GESCHAEFT}', regex=False) + ' ')
+    df.loc[has_signatur, 'url_geschaeft_ods'] = (f'{PATH_DATASET}100311/?refine.signatur_ges=' +
+                                                 signaturen_ges.str.replace(',', '&refine.signatur_ges=',
+                                                                            regex=False))
+    df.loc[has_signatur, 'url_dok'] = (PATH_DOKUMENT +
+                                       signaturen.str.replace(',', f' ,{PATH_DOKUMENT}', regex=False) + ' ')
+    df.loc[has_signatur, 'url_dokument_ods'] = (f'{PATH_DATASET}100313/?refine.signatur_dok=' +
+                                                signaturen.str.replace(',', '&refine.signatur_dok=', regex=False))
+    has_anr = df['anr'].map(lambda x: isinstance(x, str) and '-' in x)
+    df.loc[has_anr, 'url_abstimmungen'] = (f'{PATH_DATASET}100186/?refine.anr=' +
+                                           df.loc[has_anr, 'anr'].str.replace(',', '&refine.anr=', regex=False))
 
     # Select relevant columns for publication
     cols_of_interest = ['tagesordnung_idnr', 'versand', 'tag1', 'text1', 'tag2', 'text2', 'tag3', 'text3', 'bemerkung',
@@ -685,14 +680,52 @@ def create_traktanden_csv(df_gr_tagesordnung: pd.DataFrame, df_gr_traktanden: pd
                         'departement', 'signatur', 'url_ges', 'url_geschaeft_ods', 'url_dok', 'url_dokument_ods',
                         'Abstimmung', 'anr', 'url_abstimmungen']
 
-    df = df[cols_of_interest]
+    return df[cols_of_interest]
 
-    logging.info(f'Creating dataset "Grosser Rat: Traktanden"...')
-    path_export = os.path.join(credentials.data_path, 'export', '100348_gr_traktanden.csv')
-    df.to_csv(path_export, index=False)
-    # Returning the path where the created CSV-file is stored
-    # and two string identifiers which are needed to update the file in the FTP server and in ODSP
-    return path_export, 'parlamentsdienst/grosser_rat', '100348'
+
+def explode_gruppentitel(df_gr_tagesordnung: pd.DataFrame) -> pd.DataFrame:
+    """
+    Transforms the Tagesordnungen from one column pair (gruppentitel_i, gruppentitel_i_pos) per Gruppentitel
+    to one row per Gruppentitel. Rows are ordered by Tagesordnung first and by gruppennummer second,
+    Gruppentitel that are empty are left out.
+
+    Args:
+        df_gr_tagesordnung (pd.DataFrame): Tagesordnungen as exported by GRIBS.
+
+    Returns:
+        pd.DataFrame: DataFrame with one row per Gruppentitel, the position of the next Gruppentitel
+        of the same Tagesordnung is stored in gruppentitel_next_pos ('0' for the last one).
+    """
+    # Finding out how many gruppentitel there are
+    max_gruppentitel = max(int(col.split('_')[1]) for col in df_gr_tagesordnung.columns if 'gruppentitel_' in col)
+    gruppennummern = range(1, max_gruppentitel + 1)
+
+    # 2-dimensional arrays with one row per Tagesordnung and one column per Gruppentitel,
+    # flattening them in row-major order results in the order described above
+    titel = df_gr_tagesordnung[[f'gruppentitel_{i}' for i in gruppennummern]].to_numpy(dtype=object)
+    pos = df_gr_tagesordnung[[f'gruppentitel_{i}_pos' for i in gruppennummern]].to_numpy(dtype=object)
+    next_pos = np.concatenate([pos[:, 1:], np.full((len(pos), 1), '0', dtype=object)], axis=1)
+
+    # Columns of the Tagesordnung are repeated for each of its Gruppentitel
+    transformed_df = pd.DataFrame({col: np.repeat(df_gr_tagesordnung[col].to_numpy(dtype=object), max_gruppentitel)
+                                   for col in ['idnr', 'gr_sitzung_idnr', 'einleitungstext', 'zwischentext']})
+    transformed_df['gruppennummer'] = np.tile(np.array(gruppennummern, dtype=object), len(df_gr_tagesordnung))
+    transformed_df['gruppentitel'] = titel.ravel()
+    transformed_df['gruppentitel_pos'] = pos.ravel()
+    transformed_df['gruppentitel_next_pos'] = next_pos.ravel()
+    # Skip rows where gruppentitel is empty
+    is_empty = transformed_df['gruppentitel'].isna() | (transformed_df['gruppentitel'] == '')
+    return transformed_df[~is_empty].reset_index(drop=True)
+
+
+def join_non_null(df: pd.DataFrame, sep: str) -> pd.Series:
+    """Joins the non-null values of each row of df into one string, column by column instead of row by row."""
+    joined = pd.Series('', index=df.index, dtype=object)
+    for column in df.columns:
+        values = df[column]
+        needs_sep = values.notna() & (joined != '')
+        joined = joined + np.where(needs_sep, sep, '') + values.fillna('').astype(str)
+    return joined
 
 
 # Transform Abstimmungs-IDS from GRBS-Abst-YYYYMMDD-HHMMSS-TXXX-YY-ZZZZZZZ to ZZZZZZZ-YYYYMMDD-HHMMSS
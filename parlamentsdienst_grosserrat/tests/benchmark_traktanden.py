@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import pandas as pd
+from parlamentsdienst_grosserrat import etl
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+FIXTURES_DIR = os.path.join(CURR_DIR, 'fixtures')
+
+
+def read_fixture(file_name) -> pd.DataFrame:
+    return pd.read_csv(os.path.join(FIXTURES_DIR, file_name), encoding='utf-8', dtype=str)
+
+
+def scale_fixtures(factor: int) -> tuple:
+    """Repeats the fixtures factor times, with shifted identifiers so that every copy is a separate Sitzung."""
+    df_gr_tagesordnung = read_fixture('gr_tagesordnung.csv')
+    df_gr_traktanden = read_fixture('gr_tagesordnung_pos.csv')
+    df_gr_sitzung = read_fixture('gr_sitzung.csv')
+    tagesordnungen, traktanden, sitzungen = [], [], []
+    for i in range(factor):
+        offset = i * 100000
+        df = df_gr_tagesordnung.copy()
+        df['idnr'] = (df['idnr'].astype(int) + offset).astype(str)
+        df['gr_sitzung_idnr'] = (df['gr_sitzung_idnr'].astype(int) + offset).astype(str)
+        tagesordnungen.append(df)
+        df = df_gr_traktanden.copy()
+        df['idnr'] = (df['idnr'].astype(int) + offset).astype(str)
+        df['tagesordnung_idnr'] = (df['tagesordnung_idnr'].astype(int) + offset).astype(str)
+        traktanden.append(df)
+        df = df_gr_sitzung.copy()
+        df['idnr'] = (df['idnr'].astype(int) + offset).astype(str)
+        sitzungen.append(df)
+    return (pd.concat(tagesordnungen, ignore_index=True), pd.concat(traktanden, ignore_index=True),
+            pd.concat(sitzungen, ignore_index=True))
+
+
+def main(factor=1000, repeat=3):
+    df_gr_tagesordnung, df_gr_traktanden, df_gr_sitzung = scale_fixtures(factor)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = etl.transform_traktanden(df_gr_tagesordnung, df_gr_traktanden, df_gr_sitzung)
+        timings.append(time.perf_counter() - start)
+    print(f'transform_traktanden: {len(df_gr_tagesordnung)} Tagesordnungen, {len(df_gr_traktanden)} Traktanden, '
+          f'{len(df)} rows created, best of {repeat}: {min(timings):.3f}s')
+
+
+if __name__ == "__main__":
+    print(f'Executing {__file__}...')
+    main(*[int(arg) for arg in sys.argv[1:]])
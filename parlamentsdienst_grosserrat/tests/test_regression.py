@@ -0,0 +1,28 @@
+import os
+import filecmp
+import pandas as pd
+from parlamentsdienst_grosserrat import etl
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+FIXTURES_DIR = os.path.join(CURR_DIR, 'fixtures')
+
+
+def read_fixture(file_name) -> pd.DataFrame:
+    return pd.read_csv(os.path.join(FIXTURES_DIR, file_name), encoding='utf-8', dtype=str)
+
+
+def test_regression_traktanden(tmp_path):
+    # Reference file created by the row-by-row implementation of create_traktanden_csv
+    ref_file = os.path.join(FIXTURES_DIR, '100348_gr_traktanden.csv')
+    df = etl.transform_traktanden(read_fixture('gr_tagesordnung.csv'), read_fixture('gr_tagesordnung_pos.csv'),
+                                  read_fixture('gr_sitzung.csv'))
+    file_to_test = os.path.join(tmp_path, '100348_gr_traktanden.csv')
+    df.to_csv(file_to_test, index=False)
+    assert filecmp.cmp(ref_file, file_to_test, shallow=False)
+
+
+def test_explode_gruppentitel():
+    df = etl.explode_gruppentitel(read_fixture('gr_tagesordnung.csv'))
+    assert df[['idnr', 'gruppennummer']].values.tolist() == [['101', 1], ['101', 2], ['102', 1], ['102', 3],
+                                                              ['103', 2], ['103', 3]]
+    assert df['gruppentitel_next_pos'].tolist() == ['3', '0', '0', '0', '4', '0']
@@ -1,14 +1,20 @@
 import logging
+import os
 from datetime import datetime, timedelta
 import pandas as pd
 import common
+from common import paginated_api
 from smarte_strasse_ladestation import credentials
 
 
 def main():
-    latest_ods_start_time = get_latest_ods_start_time()
-    from_filter = datetime.fromisoformat(latest_ods_start_time) - timedelta(days=7)
-    logging.info(f'Latest starttime in ods: {latest_ods_start_time}, retrieving charges from {from_filter}...')
+    curr_dir = os.path.dirname(os.path.realpath(__file__))
+    high_water_mark = paginated_api.HighWaterMark(os.path.join(curr_dir, 'data', 'high_water_marks.json'))
+    # ODS is only asked for its latest entry if there is no high-water mark yet
+    latest_start_time = high_water_mark.get('charges') or get_latest_ods_start_time()
+    # Charges of the last week are retrieved again, since charges that were running might have changed
+    from_filter = datetime.fromisoformat(latest_start_time) - timedelta(days=7)
+    logging.info(f'Latest starttime pushed: {latest_start_time}, retrieving charges from {from_filter}...')
 
     token = authenticate()
     df = extract_data(token=token, from_filter=from_filter)
@@ -17,6 +23,7 @@ def main():
     if size > 0:
         df_export = transform_data(df)
         load_data(df_export)
+        high_water_mark.set('charges', pd.to_datetime(df_export.startTime, utc=True).max().isoformat())
     logging.info(f'Job successful!')
 
 
@@ -71,12 +78,13 @@ def get_latest_ods_start_time():
     return latest_ods_start_time
 
 
-def extract_data(token, from_filter):
+def extract_data(token, from_filter, max_workers=1):
     logging.info(f'Retrieving data...')
     headers = {'authorization': f'Bearer {token}', 'x-api-key': credentials.api_key}
-    r = common.requests_get(url=f'{credentials.charges_url}', params={'perPage': 1000, 'from': from_filter}, headers=headers)
-    r.raise_for_status()
-    df = pd.json_normalize(r.json())
+    client = paginated_api.PaginatedClient(credentials.charges_url, headers=headers, page_size=1000, size_param='perPage',
+                                           max_workers=max_workers)
+    pages = list(client.iter_by_page({'from': from_filter}, page_param='page', first_page=1))
+    df = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame()
     return df
 
 
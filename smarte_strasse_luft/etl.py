@@ -3,6 +3,7 @@ import logging
 import os
 from datetime import date
 from common import change_tracking as ct
+from common import paginated_api
 import pandas as pd
 import common
 import numpy as np
@@ -10,6 +11,8 @@ from smarte_strasse_luft import credentials
 
 
 def main():
+    curr_dir = os.path.dirname(os.path.realpath(__file__))
+    high_water_mark = paginated_api.HighWaterMark(os.path.join(curr_dir, 'data', 'high_water_marks.json'))
     logging.info(f'Handling live data...')
     live_column_name_replacements = {
         'Anfangszeit_Unnamed: 0_level_1_Unnamed: 0_level_2_Unnamed: 0_level_3_Unnamed: 0_level_4': 'Anfangszeit',
@@ -23,7 +26,7 @@ def main():
         'bl_Gundeldingerstrasse131_O3_O3_Sensirion_min30_µg/m3': 'G131_O3',
         'bl_Gundeldingerstrasse131_PM2.5_PM25_Sensirion_min30_ug/m3': 'G131_PM25'
     }
-    etl(credentials.data_url_live, live_column_name_replacements, export_file=os.path.join(credentials.data_path, f'luft_{date.today()}.csv'), push_url=credentials.ods_live_realtime_push_url, push_key=credentials.ods_live_realtime_push_key)
+    etl(credentials.data_url_live, live_column_name_replacements, export_file=os.path.join(credentials.data_path, f'luft_{date.today()}.csv'), push_url=credentials.ods_live_realtime_push_url, push_key=credentials.ods_live_realtime_push_key, high_water_mark=high_water_mark, name='live')
 
     logging.info(f"Handling yesterday's data...")
     yest_column_name_replacements = {
@@ -38,7 +41,7 @@ def main():
         'bl_Gundeldingerstrasse131_PM2.5_PM25_Sensirion_d1_ug/m3': 'G131_PM25',
         'bl_Gundeldingerstrasse131_O3_O3_Sensirion_max_h1_d1_µg/m3': 'G131_O3'
     }
-    etl(credentials.data_url_yest, yest_column_name_replacements, export_file=os.path.join(credentials.data_path, f'luft_yesterday_{date.today()}.csv'), push_url=credentials.ods_yest_realtime_push_url, push_key=credentials.ods_yest_realtime_push_key)
+    etl(credentials.data_url_yest, yest_column_name_replacements, export_file=os.path.join(credentials.data_path, f'luft_yesterday_{date.today()}.csv'), push_url=credentials.ods_yest_realtime_push_url, push_key=credentials.ods_yest_realtime_push_key, high_water_mark=high_water_mark, name='yesterday')
 
     logging.info(f"Handling comparative data...")
     comp_column_name_replacements = {
@@ -53,10 +56,10 @@ def main():
        'bl_StJohann2_O3_O3_Sensirion2_min30_µg/m3': 'stjohann2_o3',
        'bl_StJohann2__nd_PM25_Sensirion2_min30_ug/m3': 'stjohann2_pm25'
     }
-    etl(credentials.data_url_comp, comp_column_name_replacements, export_file=os.path.join(credentials.data_path, f'luft_comp_{date.today()}.csv'), push_url=credentials.ods_comp_realtime_push_url, push_key=credentials.ods_comp_realtime_push_key)
+    etl(credentials.data_url_comp, comp_column_name_replacements, export_file=os.path.join(credentials.data_path, f'luft_comp_{date.today()}.csv'), push_url=credentials.ods_comp_realtime_push_url, push_key=credentials.ods_comp_realtime_push_key, high_water_mark=high_water_mark, name='comp')
 
 
-def etl(download_url, column_name_replacements, export_file, push_url, push_key):
+def etl(download_url, column_name_replacements, export_file, push_url, push_key, high_water_mark, name):
     logging.info(f'Downloading data from {download_url}...')
     df = common.pandas_read_csv(io.StringIO(common.requests_get(download_url).text), sep=';', encoding='cp1252', header=[0, 1, 2, 3, 4])
     # Replace the 2-level multi-index column names with a string that concatenates both strings
@@ -76,13 +79,24 @@ def etl(download_url, column_name_replacements, export_file, push_url, push_key)
             common.upload_ftp(export_file, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass, 'smarte_strasse/luft')
             ct.update_hash_file(export_file)
 
-        print(f'Pushing {row_count} rows to ODS realtime API...')
+        # The export file always contains the whole time window, only rows from the high-water mark on are pushed.
+        # The row at the high-water mark is pushed again, since its values might have been incomplete.
+        latest_pushed = high_water_mark.get(name)
+        if latest_pushed:
+            df = df[df.timestamp >= pd.Timestamp(latest_pushed)].copy()
+        if len(df) == 0:
+            print(f'No rows since {latest_pushed} to push to ODS... ')
+            return
+        latest = df.timestamp.max().isoformat()
+        print(f'Pushing {len(df)} rows to ODS realtime API...')
         df.timestamp = df.timestamp.dt.strftime('%Y-%m-%dT%H:%M:%S%z')
         df['timestamp_text'] = df.timestamp
         payload = df.to_json(orient="records")
         # print(f'Pushing the following data to ODS: {json.dumps(json.loads(payload), indent=4)}')
         # use data=payload here because payload is a string. If it was an object, we'd have to use json=payload.
         r = common.requests_post(url=push_url, data=payload, params={'pushkey': push_key, 'apikey': credentials.ods_api_key})
+        r.raise_for_status()
+        high_water_mark.set(name, latest)
 
 
 if __name__ == "__main__":
@@ -5,24 +5,34 @@ from datetime import datetime
 import pandas as pd
 from requests.auth import HTTPBasicAuth
 import common
+from common import paginated_api
 from smarte_strasse_parking import credentials
 
 
 def main():
     curr_dir = os.path.dirname(os.path.realpath(__file__))
     timestamp = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
+    high_water_mark = paginated_api.HighWaterMark(os.path.join(curr_dir, 'data', 'high_water_marks.json'))
 
     df_stat = get_statistics()
     # {"from":"2022-04-19T10:00:00","to":"2022-04-19T11:00:00","type":"Blue","sum_inflow":1.0,"sum_outflow":1.0,"avg_occupancy_abs":1.0}
     stat_export_file = os.path.join(curr_dir, 'data', f'statistics_ {timestamp}.csv')
     df_stat.to_csv(stat_export_file, index=False)
-    common.ods_realtime_push_df(df_stat, url=credentials.ods_push_url_stat)
+    # The hour pushed last might have been incomplete, so it is pushed again
+    df_stat_new = df_stat[df_stat['from'] >= high_water_mark.get('statistics', '')]
+    common.ods_realtime_push_df(df_stat_new, url=credentials.ods_push_url_stat)
+    if len(df_stat_new) > 0:
+        high_water_mark.set('statistics', df_stat_new['from'].max())
 
     df_curr = get_current_state_data()
     # {"timestamp":"2022-02-03T16:43:09+00:00","Blue_occupied":4,"Yellow_occupied":2,"Blue_available":0,"Yellow_available":0,"Blue_total":4,"Yellow_total":2,"timestamp_text":"2022-02-03T16:43:09+00:00"}
     curr_export_file = os.path.join(curr_dir, 'data', f'current_{timestamp}.csv')
     df_curr.to_csv(curr_export_file, index=False)
-    common.ods_realtime_push_df(df_curr, url=credentials.ods_push_url_curr)
+    # The current state is only pushed if the API has a newer one than the state pushed last
+    df_curr_new = df_curr[df_curr.timestamp > high_water_mark.get('current', '')]
+    common.ods_realtime_push_df(df_curr_new, url=credentials.ods_push_url_curr)
+    if len(df_curr_new) > 0:
+        high_water_mark.set('current', df_curr_new.timestamp.max())
 
     # common.ods_realtime_push_df(df1, url=credentials.ods_realtime_push_url_curr, push_key=credentials.ods_realtime_push_key_curr)
     # common.ods_realtime_push_df(df=df1, url=credentials.ods_realtime_push_url_curr, push_key=credentials.ods_realtime_push_key_curr)
@@ -1,38 +1,47 @@
 import logging
 import datetime
+import os
 from datetime import timezone
 from zoneinfo import ZoneInfo
-import numpy
 import numpy as np
 import pandas as pd
 import common
+from common import paginated_api
 from smarte_strasse_schall import credentials
 from requests.auth import HTTPBasicAuth
 
 
 def main():
     auth = HTTPBasicAuth(credentials.username, credentials.password)
-    df_vehicles = push_vehicles(auth)
-    df_sound_levels = push_noise_levels(auth)
-    df_vehicles_speed = push_vehicle_speed_level(auth)
+    curr_dir = os.path.dirname(os.path.realpath(__file__))
+    high_water_mark = paginated_api.HighWaterMark(os.path.join(curr_dir, 'data', 'high_water_marks.json'))
+    df_vehicles = push_vehicles(auth, high_water_mark)
+    df_sound_levels = push_noise_levels(auth, high_water_mark)
+    df_vehicles_speed = push_vehicle_speed_level(auth, high_water_mark)
     logging.info(f'Job succcessful!')
     pass
 
 
-def push_vehicles(auth):
+def push_vehicles(auth, high_water_mark):
     logging.info(f'Starting process to update vehicles dataset...')
     now = datetime.datetime.now(timezone.utc).astimezone(ZoneInfo('Europe/Zurich'))
-    # end = now.isoformat()
-    start = (now - datetime.timedelta(hours=3)).isoformat()
-    url = credentials.url + 'api/detections2'
-    params = {'start_time': start, 'sort': 'timestamp', 'order': 'desc',  'size': '10000', 'filter': f'deviceId:{credentials.device_id}'}
-    df_class = query_sensor_api(auth, params, url)
+    # Without a high-water mark, start 3 hours ago
+    start = high_water_mark.get('vehicles', (now - datetime.timedelta(hours=3)).isoformat())
+    params = {'filter': f'deviceId:{credentials.device_id}'}
+    df_class = query_sensor_api(auth, params, start)
+    if len(df_class) > 0:
+        # The detection at the high-water mark itself was pushed in the last run
+        df_class = df_class[df_class.localDateTime != start]
+    if len(df_class) == 0:
+        logging.info(f'No new vehicles since {start}...')
+        return df_class
     df_vehicles = df_class[['localDateTime', 'classificationIndex', 'classification']].copy(deep=True)
     # todo: Retrieve real values for speed and sound level as soon as API provides them
-    df_vehicles['speed'] = numpy.NAN
-    df_vehicles['level'] = numpy.NAN
+    df_vehicles['speed'] = np.nan
+    df_vehicles['level'] = np.nan
     df_vehicles['timestamp_text'] = df_vehicles.localDateTime
     common.ods_realtime_push_df(df_vehicles, credentials.ods_dataset_url_veh, credentials.ods_push_key_veh)
+    high_water_mark.set('vehicles', df_vehicles.localDateTime.iloc[-1])
     # {
     #     "localDateTime": "2022-01-19T08:17:13.896+01:00",
     #     "classificationIndex": -1,
@@ -45,13 +54,10 @@ def push_vehicles(auth):
     return df_vehicles
 
 
-def push_vehicle_speed_level(auth):
-    logging.info(f'Starting process to update vehicles with speed and noise level dataset...')
-    now = datetime.datetime.now(timezone.utc).astimezone(ZoneInfo('Europe/Zurich'))
+def get_latest_ods_interval_end():
     # If the dataset is empty, set a default start timestampt for the api call
     # start = (now - datetime.timedelta(hours=37)).isoformat()
     start = '2022-02-01T00:00:00.000000+01:00'
-    end = now.isoformat()
     logging.info(f'Checking timestamp of latest entry ods...')
     latest_data_url = f'https://data.bs.ch/api/records/1.0/search/?dataset=100175&q=&rows=1&sort=localdatetime_interval_end&apikey={credentials.ods_api_key}'
     r = common.requests_get(url=latest_data_url)
@@ -60,19 +66,30 @@ def push_vehicle_speed_level(auth):
     if results > 0:
         # start = (datetime.datetime.fromisoformat(json['records'][0]['fields']['localdatetime_interval_end_text']) - datetime.timedelta(milliseconds=1)).isoformat()
         start = datetime.datetime.fromisoformat(json['records'][0]['fields']['localdatetime_interval_end_text']).isoformat()
+    return start
+
 
-    url = credentials.url + 'api/detections2'
-    params = {'start_time': start, 'end_time': end, 'sort': 'timestamp', 'order': 'desc',  'size': '10000', 'filter': f'deviceId:{credentials.device_id}'}
-    df_class = query_sensor_api(auth, params, url)
-    df_reorder = df_class.sort_values(by='localDateTime').reset_index(drop=True)
+def push_vehicle_speed_level(auth, high_water_mark):
+    logging.info(f'Starting process to update vehicles with speed and noise level dataset...')
+    now = datetime.datetime.now(timezone.utc).astimezone(ZoneInfo('Europe/Zurich'))
+    # ODS is only asked for its latest entry if there is no high-water mark yet.
+    # The detection at the end of the last interval starts the next interval, so it is retrieved again.
+    start = high_water_mark.get('vehicle_speed_level') or get_latest_ods_interval_end()
+    end = now.isoformat()
+    params = {'end_time': end, 'filter': f'deviceId:{credentials.device_id}'}
+    df_class = query_sensor_api(auth, params, start)
+    if len(df_class) == 0:
+        logging.info(f'No new vehicles since {start}...')
+        return df_class
+    df_reorder = df_class.sort_values(by='localDateTime', kind='stable').reset_index(drop=True)
     # select every nth row,starting once from 0 and once from 1. See also https://stackoverflow.com/a/25057724
     n = 20
     dfn = df_reorder.iloc[::n, :]
     df_merged = df_reorder.merge(right=dfn, how='left', left_index=True, right_index=True, suffixes=(None, '_start'))
     logging.info(f'Calculating start and end timestamp of each interval of {n} vehicles...')
     df_merged['localDateTime_interval_end'] = df_merged.localDateTime_start.shift(-1)
-    df_merged['localDateTime_interval_start'] = df_merged.localDateTime_start.fillna(method='ffill')
-    df_merged['localDateTime_interval_end'] = df_merged.localDateTime_interval_end.fillna(method='bfill')
+    df_merged['localDateTime_interval_start'] = df_merged.localDateTime_start.ffill()
+    df_merged['localDateTime_interval_end'] = df_merged.localDateTime_interval_end.bfill()
     logging.info(f"Removing last interval in which we don't have {n} vehicles yet..")
     df_merged = df_merged.dropna(subset=['localDateTime_interval_end'])
     logging.info(f'Calculating interval length...')
@@ -92,6 +109,8 @@ def push_vehicle_speed_level(auth):
                    )
     df_vehicles['vehicle_rand_number'] = df_vehicles.index % n
     common.ods_realtime_push_df(df_vehicles, credentials.ods_dataset_url_veh_speed, credentials.ods_push_key_veh_speed)
+    if len(df_merged) > 0:
+        high_water_mark.set('vehicle_speed_level', df_merged.localDateTime_interval_end.iloc[-1])
     logging.info(f'That worked out successfully!')
     return df_vehicles
 
@@ -108,12 +127,14 @@ def push_vehicle_speed_level(auth):
     # }
 
 
-def query_sensor_api(auth, params, url):
-    logging.info(f'Querying API using url {url} with parameters {params}...')
-    r = common.requests_get(url=url, params=params, auth=auth)
-    r.raise_for_status()
-    json = r.json()
-    df = pd.json_normalize(json, record_path='results')
+def query_sensor_api(auth, params, start, page_size=10000):
+    """Returns all detections since start (inclusive), retrieved page by page in ascending order."""
+    client = paginated_api.PaginatedClient(credentials.url + 'api/detections2', auth=auth, page_size=page_size,
+                                           record_path='results')
+    df = client.fetch_by_timestamp({**params, 'sort': 'timestamp', 'order': 'asc'}, start_param='start_time',
+                                   timestamp_field='localDateTime', start=start)
+    if len(df) == 0:
+        return df
     df_classifications = pd.DataFrame.from_dict({
         'classificationIndex': [-1, 0, 1, 2, 3],
         'classification': ['Unknown', 'Car', 'Bicycle / Motorbike', 'Truck / Bus', 'Van / Suv']
@@ -123,12 +144,13 @@ def query_sensor_api(auth, params, url):
     return df_class
 
 
-def push_noise_levels(auth):
+def push_noise_levels(auth, high_water_mark):
     logging.info(f'Starting process to update noise level dataset...')
     now = datetime.datetime.now(timezone.utc).astimezone(ZoneInfo('Europe/Zurich'))
     # end = now.isoformat()
-    # datetime needed in military "Zulu" notation using %Z
-    start = (now - datetime.timedelta(hours=3)).astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    # datetime needed in military "Zulu" notation using %Z. The latest 5 minute mean pushed might have been
+    # incomplete, so it is retrieved again.
+    start = high_water_mark.get('noise_levels', (now - datetime.timedelta(hours=3)).astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'))
     r = common.requests_get(url=credentials.url + f'api/sound-levels/aggs/mean', params={'timespan': '5m', 'filter': f'deviceId:{credentials.device_id}', 'start_time': start}, auth=auth)
     r.raise_for_status()
     json = r.json()
@@ -140,6 +162,8 @@ def push_noise_levels(auth):
     df_pivot = df_pivot.rename(columns={'timestamp_': 'timestamp', 'general_level_': 'general_level'})
     df_pivot['timestamp_text'] = df_pivot.timestamp
     common.ods_realtime_push_df(df_pivot, credentials.ods_dataset_url_noise, credentials.ods_push_key_noise)
+    if len(df_pivot) > 0:
+        high_water_mark.set('noise_levels', df_pivot.timestamp.max())
     logging.info(f'That worked out successfully!')
     return df_pivot
 
@@ -0,0 +1,2 @@
+cd /code/data-processing || exit
+python3 -m staka_abstimmungen.src.watch
@@ -20,10 +20,7 @@ def main():
     if push_past_abstimmungen:
         push_past_abstimmungen_to_ods()
         return
-    logging.info(f'Reading control.csv...')
-    df = pd.read_csv(os.path.join(credentials.path, 'control.csv'), sep=';',
-                     parse_dates=['Ignore_changes_before', 'Embargo', 'Ignore_changes_after'])
-    active_abst = df.query('Active == True').copy(deep=True)
+    active_abst = read_active_abstimmungen()
     active_active_size = active_abst.Active.size
     what_changed = {'updated_ods_datasets': [], 'send_update_email': False}
     if active_active_size == 1:
@@ -58,6 +55,13 @@ def main():
     logging.info(f'Job Successful!')
 
 
+def read_active_abstimmungen():
+    logging.info(f'Reading control.csv...')
+    df = pd.read_csv(os.path.join(credentials.path, 'control.csv'), sep=';',
+                     parse_dates=['Ignore_changes_before', 'Embargo', 'Ignore_changes_after'])
+    return df.query('Active == True').copy(deep=True)
+
+
 def push_past_abstimmungen_to_ods():
     path_data_processing_output = os.path.join(credentials.path, 'data-processing-output')
     files_details = glob.glob(os.path.join(path_data_processing_output, 'Abstimmungen_Details_??????????.csv'))
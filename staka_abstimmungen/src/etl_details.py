@@ -1,4 +1,5 @@
 from staka_abstimmungen import credentials
+from staka_abstimmungen.src.workbook import load_workbook
 import pandas as pd
 import os
 import dateparser
@@ -30,11 +31,11 @@ def calculate_details(data_file_names):
                        'abst_typ']
     for data_file_name in data_file_names:
         import_file_name = os.path.join(credentials.path, data_file_name)
-        print(f'Reading dataset from {import_file_name} to retrieve sheet names...')
-        sheets = pd.read_excel(import_file_name, sheet_name=None, skiprows=4, index_col=None)
+        # The workbook is parsed once, all sheets are then read from memory
+        workbook = load_workbook(import_file_name)
         dat_sheet_names = []
         print(f'Determining "DAT n" sheets...')
-        for key in sheets:
+        for key in workbook.sheet_names:
             if key.startswith('DAT '):
                 dat_sheet_names.append(key)
 
@@ -55,7 +56,7 @@ def calculate_details(data_file_names):
         for sheet_name in dat_sheet_names:
             is_gegenvorschlag = False  # Is this a sheet that contains a Gegenvorschlag?
             print(f'Reading Abstimmungstitel from {sheet_name}...')
-            df_title = pd.read_excel(import_file_name, sheet_name=sheet_name, skiprows=4, index_col=None)
+            df_title = workbook.read_sheet(sheet_name, skiprows=4)
             abst_title_raw = df_title.columns[1]
             # Get String that starts form ')' plus space + 1 characters to the right
             abst_title = abst_title_raw[abst_title_raw.find(')') + 2:]
@@ -63,15 +64,14 @@ def calculate_details(data_file_names):
                 is_gegenvorschlag = True
 
             print(f'Reading Abstimmungsart and Date from {sheet_name}...')
-            df_meta = pd.read_excel(import_file_name, sheet_name=sheet_name, skiprows=2, index_col=None)
+            df_meta = workbook.read_sheet(sheet_name, skiprows=2)
             title_string = df_meta.columns[1]
             abst_type = 'kantonal' if title_string.startswith('Kantonal') else 'national'
             abst_date_raw = title_string[title_string.find('vom ') + 4:]
             abst_date = dateparser.parse(abst_date_raw).strftime('%Y-%m-%d')
 
             print(f'Reading data from {sheet_name}...')
-            df = pd.read_excel(import_file_name, sheet_name=sheet_name, skiprows=6,
-                               index_col=None)  # , header=[0, 1, 2])
+            df = workbook.read_sheet(sheet_name, skiprows=6)
             df.reset_index(inplace=True)
 
             print('Filtering out Wahllokale...')
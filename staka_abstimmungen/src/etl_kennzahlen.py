@@ -1,4 +1,5 @@
 from staka_abstimmungen import credentials
+from staka_abstimmungen.src.workbook import load_workbook
 import pandas as pd
 import os
 import dateparser
@@ -31,11 +32,11 @@ def calculate_kennzahlen(data_file_names):
                        'Stimmber_Anz_M', 'Stimmber_Anz_F', 'abst_typ']
     for data_file_name in data_file_names:
         import_file_name = os.path.join(credentials.path, data_file_name)
-        print(f'Reading dataset from {import_file_name} to retrieve sheet names...')
-        sheets = pd.read_excel(import_file_name, sheet_name=None, skiprows=4, index_col=None)
+        # The workbook is parsed once, all sheets are then read from memory
+        workbook = load_workbook(import_file_name)
         dat_sheet_names = []
         print(f'Determining "DAT n" sheets...')
-        for key in sheets:
+        for key in workbook.sheet_names:
             if key.startswith('DAT '):
                 dat_sheet_names.append(key)
 
@@ -47,7 +48,7 @@ def calculate_kennzahlen(data_file_names):
         for sheet_name in dat_sheet_names:
             is_gegenvorschlag = False  # Is this a sheet that contains a Gegenvorschlag?
             print(f'Reading Abstimmungstitel from {sheet_name}...')
-            df_title = pd.read_excel(import_file_name, sheet_name=sheet_name, skiprows=4, index_col=None)
+            df_title = workbook.read_sheet(sheet_name, skiprows=4)
             abst_title_raw = df_title.columns[1]
             # Get String that starts form ')' plus space + 1 characters to the right
             abst_title = abst_title_raw[abst_title_raw.find(')') + 2:]
@@ -55,15 +56,14 @@ def calculate_kennzahlen(data_file_names):
                 is_gegenvorschlag = True
 
             print(f'Reading Abstimmungsart and Date from {sheet_name}...')
-            df_meta = pd.read_excel(import_file_name, sheet_name=sheet_name, skiprows=2, index_col=None)
+            df_meta = workbook.read_sheet(sheet_name, skiprows=2)
             title_string = df_meta.columns[1]
             abst_type = 'kantonal' if title_string.startswith('Kantonal') else 'national'
             abst_date_raw = title_string[title_string.find('vom ') + 4:]
             abst_date = dateparser.parse(abst_date_raw).strftime('%Y-%m-%d')
 
             print(f'Reading data from {sheet_name}...')
-            df = pd.read_excel(import_file_name, sheet_name=sheet_name, skiprows=6,
-                               index_col=None)  # , header=[0, 1, 2])
+            df = workbook.read_sheet(sheet_name, skiprows=6)
             df.reset_index(inplace=True)
 
             print('Filtering out Wahllokale...')
@@ -146,7 +146,7 @@ def calculate_kennzahlen(data_file_names):
 
         stimmber_sheet_name = 'Stimmberechtigte (Details)'
         print(f'Reading data from {stimmber_sheet_name}...')
-        df_stimmber = pd.read_excel(import_file_name, sheet_name=stimmber_sheet_name, skiprows=4, index_col=None)
+        df_stimmber = workbook.read_sheet(stimmber_sheet_name, skiprows=4)
         print(f'Renaming columns in sheet {stimmber_sheet_name}...')
         df_stimmber.rename(columns={'Unnamed: 0': 'empty',
                                     'Unnamed: 1': 'Gemein_Name',
@@ -164,14 +164,14 @@ def calculate_kennzahlen(data_file_names):
         kennz_sheet_name = 'Abstimmungs-Kennzahlen'
         # number of empty rows may be different for KAN and EID files
         # skip_rows = 4 if '_KAN' in import_file_name else 7
-        df_kennz_sheet = pd.read_excel(import_file_name, sheet_name=kennz_sheet_name, index_col=None)
+        df_kennz_sheet = workbook.read_sheet(kennz_sheet_name)
         skip_rows = None
         for index, row in df_kennz_sheet.iterrows():
             # Check if the row contains table headers
             if 'Stimmberechtigte' in row.values or '\nStimmberechtigte' in row.values:
                 skip_rows = index + 1  # Set the table start index
         print(f'Reading data from {kennz_sheet_name}, skipping first {skip_rows} rows...')
-        df_kennz = pd.read_excel(import_file_name, sheet_name=kennz_sheet_name, skiprows=skip_rows, index_col=None)
+        df_kennz = workbook.read_sheet(kennz_sheet_name, skiprows=skip_rows)
         df_kennz.rename(columns={'Unnamed: 0': 'empty',
                                  'Unnamed: 1': 'Gemein_Name',
                                  'Durchschnittliche\nStimmbeteiligung': 'Durchschn_Stimmbet_pro_Abst_Art',
@@ -0,0 +1,229 @@
+import fnmatch
+import json
+import logging
+import os
+import pathlib
+import time
+from datetime import datetime, timezone
+import common
+import common.change_tracking as ct
+from staka_abstimmungen import credentials
+from staka_abstimmungen.src import etl
+
+DATA_FILE_PATTERNS = ['*_EID_????????*.xlsx', '*_KAN_????????*.xlsx']
+CONTROL_FILE = 'control.csv'
+# Seconds between two scans of the share, also the longest time waited for an inotify event
+POLL_INTERVAL = 2.0
+# A changed file is only read once its mtime and size did not change for this many seconds, so it is completely written
+SETTLE_SECONDS = 1.0
+
+
+def get_state_path() -> str:
+    return os.path.join(pathlib.Path(__file__).parents[1], 'data', 'watch')
+
+
+def get_endpoints() -> dict:
+    return {'details_test': credentials.push_url_details_test, 'kennz_test': credentials.push_url_kennz_test,
+            'details_public': credentials.push_url_details_public, 'kennz_public': credentials.push_url_kennz_public}
+
+
+class FileWatcher:
+    """
+    Reports the files of a directory whose mtime or size changed, using inotify where it is available.
+
+    inotify does not see changes made by other hosts on a mounted share, so the directory is scanned every
+    poll_interval seconds in any case. inotify only wakes the watcher earlier for changes it does see.
+    """
+
+    def __init__(self, path, patterns, poll_interval=POLL_INTERVAL, settle_seconds=SETTLE_SECONDS, use_inotify=True):
+        self.path = path
+        self.patterns = patterns
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.inotify = self.open_inotify() if use_inotify else None
+        self.stats = self.scan()
+
+    def open_inotify(self):
+        try:
+            from inotify_simple import INotify, flags
+            inotify = INotify()
+            inotify.add_watch(self.path, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+        except (ImportError, OSError) as e:
+            logging.info(f'inotify not available ({e}), scanning {self.path} every {self.poll_interval}s...')
+            return None
+        logging.info(f'Watching {self.path} using inotify, scanning it every {self.poll_interval}s as well...')
+        return inotify
+
+    def scan(self) -> dict:
+        """Returns (mtime, size) of all files matching the patterns."""
+        stats = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.is_file() and any(fnmatch.fnmatch(entry.name, pattern) for pattern in self.patterns):
+                    stat = entry.stat()
+                    stats[entry.name] = (stat.st_mtime, stat.st_size)
+        return stats
+
+    def wait(self) -> dict:
+        """Waits at most poll_interval seconds for changes, returns the changed files with their (mtime, size)."""
+        if self.inotify is not None:
+            self.inotify.read(timeout=int(self.poll_interval * 1000))
+        else:
+            time.sleep(self.poll_interval)
+        stats = self.scan()
+        if stats == self.stats:
+            return {}
+        while True:
+            time.sleep(self.settle_seconds)
+            settled = self.scan()
+            if settled == stats:
+                break
+            stats = settled
+        changed = {name: stat for name, stat in stats.items() if self.stats.get(name) != stat}
+        self.stats = stats
+        logging.info(f'Files changed: {list(changed)}')
+        return changed
+
+
+class PushState:
+    """
+    The JSON of each row pushed to an ODS realtime endpoint, by id, so that only rows whose JSON differs from
+    the one pushed last are pushed again. Saved after each acknowledged push.
+    """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.rows = {}
+        if os.path.exists(state_file):
+            with open(state_file, 'r') as f:
+                self.rows = json.load(f)
+
+    def update(self, rows):
+        self.rows.update(rows)
+        common.write_json_atomic(self.state_file, self.rows)
+
+
+def push_changed_rows(df, url, push_state) -> int:
+    """Pushes the rows of df that are new or differ from the ones pushed last, returns the number of rows pushed."""
+    ids = df['id'].astype(str).tolist()
+    # Rows are compared as they are serialised for the push
+    rows = df.to_json(orient='records', lines=True).splitlines() if len(df) > 0 else []
+    changed = [i for i, (row_id, row) in enumerate(zip(ids, rows)) if push_state.rows.get(row_id) != row]
+    logging.info(f'{len(changed)} of {len(df)} rows changed since the last push to {url.partition("?")[0]}...')
+    if changed:
+        common.ods_realtime_push_df(df.iloc[changed], url)
+        push_state.update({ids[i]: rows[i] for i in changed})
+    return len(changed)
+
+
+def record_latency(metrics_file, endpoint, rows, changed_files, detected_at, pushed_at):
+    """Appends the time from the newest change of the data files to the push acknowledged by ODS to metrics_file."""
+    file_mtime = max(mtime for mtime, _ in changed_files.values())
+    entry = {'endpoint': endpoint, 'rows': rows, 'files': sorted(changed_files),
+             'file_mtime': datetime.fromtimestamp(file_mtime, timezone.utc).isoformat(),
+             'pushed_at': datetime.fromtimestamp(pushed_at, timezone.utc).isoformat(),
+             'detection_seconds': round(detected_at - file_mtime, 3),
+             'processing_seconds': round(pushed_at - detected_at, 3),
+             'latency_seconds': round(pushed_at - file_mtime, 3)}
+    logging.info(f'Latency from file change to push to {endpoint}: {entry["latency_seconds"]}s '
+                 f'(detection {entry["detection_seconds"]}s, processing {entry["processing_seconds"]}s)')
+    pathlib.Path(os.path.dirname(metrics_file)).mkdir(parents=True, exist_ok=True)
+    with open(metrics_file, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+
+def process_changes(active_files, make_live_public, push_states, changed_files, detected_at):
+    """
+    Does what etl.main does when the data files changed, but pushes only the rows that differ from the ones pushed
+    last to each endpoint. Workbooks that did not change are not parsed again, see src/workbook.py.
+    """
+    data_files_changed = etl.have_data_files_changed(active_files)
+    if not (data_files_changed or make_live_public):
+        return
+    what_changed = {'updated_ods_datasets': [], 'send_update_email': False}
+    df_details, details_changed, df_kennz, kennz_changed = etl.calculate_and_upload(active_files)
+    frames = {'details': df_details, 'kennz': df_kennz}
+    targets = ['test', 'public'] if make_live_public else ['test']
+    endpoints = get_endpoints()
+    changed_data_files = {name: stat for name, stat in changed_files.items() if name in active_files}
+    for target in targets:
+        if target == 'public':
+            what_changed = etl.make_datasets_public(active_files, what_changed)
+        for dataset, df in frames.items():
+            endpoint = f'{dataset}_{target}'
+            rows = push_changed_rows(df, endpoints[endpoint], push_states[endpoint])
+            if rows and changed_data_files:
+                record_latency(os.path.join(get_state_path(), 'latency.jsonl'), endpoint, rows, changed_data_files,
+                               detected_at, time.time())
+        if target == 'test':
+            what_changed = etl.publish_datasets(details_changed, kennz_changed, what_changed=what_changed)
+            for file in active_files:
+                ct.update_hash_file(os.path.join(credentials.path, file))
+    if data_files_changed:
+        etl.send_update_email(what_changed)
+
+
+def watch(poll_interval=POLL_INTERVAL, settle_seconds=SETTLE_SECONDS):
+    """
+    Processes the active Abstimmung whenever its data files or control.csv change, until Ignore_changes_after.
+    Replaces running etl.main periodically on the Abstimmungs-Sonntag.
+    """
+    watcher = FileWatcher(credentials.path, DATA_FILE_PATTERNS + [CONTROL_FILE], poll_interval, settle_seconds)
+    push_states = {endpoint: PushState(os.path.join(get_state_path(), f'pushed_{endpoint}.json'))
+                   for endpoint in get_endpoints()}
+    # The files are processed once at the start, as by a run of etl.main, latencies are only known for later changes
+    changed_files = {}
+    detected_at = time.time()
+    pending = True
+    was_public = None
+    control = None
+    while True:
+        if control is None:
+            try:
+                control = etl.read_active_abstimmungen()
+            except Exception:
+                logging.exception(f'Could not read {CONTROL_FILE}, reading it again in the next round...')
+        if control is not None:
+            # check_embargos localizes the timestamps in place
+            active_abst = control.copy(deep=True)
+            if active_abst.Active.size > 1:
+                raise NotImplementedError('Only one Abstimmung must be active at any time!')
+            if active_abst.Active.size == 0:
+                logging.info(f'No active Abstimmung, stopping to watch...')
+                return
+            do_process, make_live_public = etl.check_embargos(active_abst, active_abst.Active.size)
+            if datetime.now(timezone.utc) >= active_abst.Ignore_changes_after.iloc[0]:
+                logging.info(f'Changes after {active_abst.Ignore_changes_after.iloc[0]} are ignored, stopping to watch...')
+                return
+            if do_process and (pending or make_live_public != was_public):
+                try:
+                    active_files = etl.find_data_files_for_active_abst(active_abst)
+                    process_changes(active_files, make_live_public, push_states, changed_files, detected_at)
+                    pending = False
+                    changed_files = {}
+                    was_public = make_live_public
+                except Exception:
+                    # E.g. a data file that is written again while it is read, or a push that failed after all retries.
+                    # Unlike a run of etl.main, the watch keeps running, everything is processed again in the next round
+                    logging.exception(f'Could not process the changes, trying again in the next round...')
+        try:
+            changed = watcher.wait()
+        except OSError:
+            logging.exception(f'Could not scan {credentials.path}, scanning it again in the next round...')
+            time.sleep(poll_interval)
+            continue
+        if CONTROL_FILE in changed:
+            # Read again in the next round, the active Abstimmung or its data files may have changed
+            control = None
+            pending = True
+            changed.pop(CONTROL_FILE)
+        if changed:
+            pending = True
+            changed_files.update(changed)
+            detected_at = time.time()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logging.info(f'Executing {__file__}...')
+    watch()
+    logging.info(f'Job successful!')
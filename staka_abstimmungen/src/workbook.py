@@ -0,0 +1,56 @@
+import os
+import pandas as pd
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+
+
+class Workbook:
+    """
+    Cell values of all sheets of an Excel file, parsed once (openpyxl in read-only mode).
+
+    read_sheet() returns what pd.read_excel(file, sheet_name, skiprows=skiprows) returns, but slices the
+    rows from the grid in memory instead of parsing the file again for each sheet and each skiprows.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        print(f'Parsing all sheets of {file_name}...')
+        # Without header, type conversion and NA detection, the frames hold the raw grids of the sheets
+        frames = pd.read_excel(file_name, sheet_name=None, header=None, dtype=object, na_filter=False,
+                               engine='openpyxl')
+        self.grids = {sheet_name: df.values.tolist() for sheet_name, df in frames.items()}
+
+    @property
+    def sheet_names(self) -> list:
+        return list(self.grids)
+
+    def read_sheet(self, sheet_name, skiprows=None) -> pd.DataFrame:
+        grid = self.grids[sheet_name]
+        if not grid:
+            return pd.DataFrame()
+        try:
+            # The same parser and options as pd.read_excel, see pandas.io.excel._base.BaseExcelReader
+            parser = TextParser([list(row) for row in grid], header=0, index_col=None, skiprows=skiprows,
+                                skip_blank_lines=False)
+            return parser.read()
+        except EmptyDataError:
+            return pd.DataFrame()
+
+
+# etl.py reads the same files for the details and the Kennzahlen, process_old_files.py reads many files one by one
+MAX_CACHED_WORKBOOKS = 4
+_workbooks = {}
+
+
+def load_workbook(file_name) -> Workbook:
+    """Returns the parsed workbook, parsing it again only if the file changed since it was parsed last."""
+    stat = os.stat(file_name)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _workbooks.get(file_name)
+    if cached is None or cached[0] != version:
+        _workbooks.pop(file_name, None)
+        while len(_workbooks) >= MAX_CACHED_WORKBOOKS:
+            # Dicts keep the insertion order, the first entry is the oldest one
+            del _workbooks[next(iter(_workbooks))]
+        _workbooks[file_name] = (version, Workbook(file_name))
+    return _workbooks[file_name][1]
@@ -0,0 +1,98 @@
+import datetime
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import openpyxl
+import pandas as pd
+from staka_abstimmungen.src import workbook
+
+WAHLLOKALE = ['Bahnhof SBB', 'Rathaus', 'Polizeiwache Clara', 'Basel briefl. & elektr. Stimmende (Total)', 'Total Basel',
+              'Riehen Gemeindehaus', 'Riehen briefl. & elektr. Stimmende (Total)', 'Total Riehen',
+              'Bettingen Gemeindehaus', 'Bettingen briefl. & elektr. Stimmende (Total)', 'Total Bettingen',
+              'Persönlich an der Urne Stimmende AS', 'Brieflich Stimmende AS', 'Elektronisch Stimmende AS',
+              'Total Auslandschweizer (AS)', 'Total Kanton']
+GEMEINDEN = ['Basel', 'Riehen', 'Bettingen', 'Auslandschweizer/-innen', 'Total Kanton']
+
+
+def write_workbook(path, vorlagen):
+    """Writes a workbook laid out like the result files of the Staatskanzlei, with one "DAT n" sheet per Vorlage."""
+    rng = np.random.default_rng(0)
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    header = [None, 'Wahllokale', None, 'eingelegte', 'leere', 'ungültige', 'Total gültige', 'Ja', 'Nein']
+    for n in range(1, vorlagen + 1):
+        ws = wb.create_sheet(f'DAT {n}')
+        ws.append(['Staatskanzlei Basel-Stadt'])
+        ws.append([])
+        ws.append([None, 'Eidgenössische Volksabstimmung vom 18. Juni 2023'] + [None] * 6 + ['Schlussresultate'])
+        ws.append([])
+        ws.append([None, f'{n}) Vorlage Nummer {n}'])
+        ws.append([None, None, 'Stimm-', 'Stimmzettel'])
+        ws.append(header)
+        for wahllokal in WAHLLOKALE:
+            ws.append([None, wahllokal] + [int(v) for v in rng.integers(0, 20000, len(header) - 2)])
+        ws.append([])
+        ws.append([None, 'Stand: ', datetime.datetime(2023, 6, 18, 14, 5)])
+    ws = wb.create_sheet('Stimmberechtigte (Details)')
+    for _ in range(4):
+        ws.append([])
+    ws.append([None, None, 'Stimmberechtigte', 'davon Männer', 'davon Frauen'])
+    for gemeinde in GEMEINDEN:
+        ws.append([None, gemeinde] + [int(v) for v in rng.integers(0, 100000, 3)])
+    ws = wb.create_sheet('Abstimmungs-Kennzahlen')
+    ws.append([None, None, 'Stimmberechtigte', 'Stimmbeteiligung', 'Anteil der brieflich Stimmenden'])
+    for gemeinde in GEMEINDEN:
+        ws.append([None, gemeinde, int(rng.integers(0, 100000)), float(rng.random()), float(rng.random())])
+    wb.save(path)
+
+
+def read_legacy(file_name):
+    """The reads of calculate_details and calculate_kennzahlen before, each one parses the whole file again."""
+    frames = []
+    for job in ['details', 'kennzahlen']:
+        sheets = pd.read_excel(file_name, sheet_name=None, skiprows=4, index_col=None)
+        for sheet_name in [s for s in sheets if s.startswith('DAT ')]:
+            for skiprows in [4, 2, 6]:
+                frames.append(pd.read_excel(file_name, sheet_name=sheet_name, skiprows=skiprows, index_col=None))
+        if job == 'kennzahlen':
+            frames.append(pd.read_excel(file_name, sheet_name='Stimmberechtigte (Details)', skiprows=4, index_col=None))
+            frames.append(pd.read_excel(file_name, sheet_name='Abstimmungs-Kennzahlen', index_col=None))
+            frames.append(pd.read_excel(file_name, sheet_name='Abstimmungs-Kennzahlen', skiprows=2, index_col=None))
+    return frames
+
+
+def read_workbook(file_name):
+    """The same reads using the workbook loader, the file is parsed once for both jobs."""
+    frames = []
+    for job in ['details', 'kennzahlen']:
+        wb = workbook.load_workbook(file_name)
+        for sheet_name in [s for s in wb.sheet_names if s.startswith('DAT ')]:
+            for skiprows in [4, 2, 6]:
+                frames.append(wb.read_sheet(sheet_name, skiprows=skiprows))
+        if job == 'kennzahlen':
+            frames.append(wb.read_sheet('Stimmberechtigte (Details)', skiprows=4))
+            frames.append(wb.read_sheet('Abstimmungs-Kennzahlen'))
+            frames.append(wb.read_sheet('Abstimmungs-Kennzahlen', skiprows=2))
+    return frames
+
+
+def main(vorlagen=6, files=2):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_names = [os.path.join(tmp_dir, f'Resultate_{i}.xlsx') for i in range(files)]
+        for file_name in file_names:
+            write_workbook(file_name, vorlagen)
+        results = {}
+        for mode, read in [('legacy', read_legacy), ('workbook', read_workbook)]:
+            start = time.perf_counter()
+            results[mode] = [frame for file_name in file_names for frame in read(file_name)]
+            seconds = (time.perf_counter() - start) / files
+            print(f'{mode}: {seconds:.3f}s per file with {vorlagen} Vorlagen')
+        identical = all(a.equals(b) for a, b in zip(results['legacy'], results['workbook']))
+        print(f'Frames identical: {identical}')
+
+
+if __name__ == "__main__":
+    print(f'Executing {__file__}...')
+    main(*[int(arg) for arg in sys.argv[1:]])
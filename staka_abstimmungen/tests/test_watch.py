@@ -0,0 +1,110 @@
+import json
+import os
+import pandas as pd
+import pytest
+from staka_abstimmungen.src import watch
+
+
+@pytest.fixture
+def pushes(monkeypatch):
+    pushed = []
+    monkeypatch.setattr(watch.common, 'ods_realtime_push_df', lambda df, url: pushed.append(df.copy()))
+    return pushed
+
+
+def details(ja_rathaus=700):
+    return pd.DataFrame({'id': ['2023-06-18_01_1', '2023-06-18_01_2', '2023-06-18_02_1'],
+                         'Wahllok_name': ['Bahnhof SBB', 'Rathaus', 'Bahnhof SBB'],
+                         'Ja_Anz': [1200, ja_rathaus, 400],
+                         'anteil_ja_stimmen': [0.6, ja_rathaus / 1500, None]})
+
+
+def test_only_changed_rows_are_pushed(pushes, tmp_path):
+    state_file = os.path.join(tmp_path, 'pushed_details_test.json')
+    assert watch.push_changed_rows(details(), 'https://ods/push/?pushkey=a', watch.PushState(state_file)) == 3
+    # The state is kept on disk, another process pushes only what changed since
+    assert watch.push_changed_rows(details(), 'https://ods/push/?pushkey=a', watch.PushState(state_file)) == 0
+    assert watch.push_changed_rows(details(ja_rathaus=750), 'https://ods/push/?pushkey=a',
+                                   watch.PushState(state_file)) == 1
+    assert [len(df) for df in pushes] == [3, 1]
+    assert pushes[1]['id'].tolist() == ['2023-06-18_01_2']
+    assert pushes[1]['Ja_Anz'].tolist() == [750]
+
+
+def test_rows_are_not_marked_pushed_if_push_fails(monkeypatch, tmp_path):
+    def fail(df, url):
+        raise ConnectionError()
+
+    monkeypatch.setattr(watch.common, 'ods_realtime_push_df', fail)
+    push_state = watch.PushState(os.path.join(tmp_path, 'pushed_details_test.json'))
+    with pytest.raises(ConnectionError):
+        watch.push_changed_rows(details(), 'https://ods/push/?pushkey=a', push_state)
+    assert push_state.rows == {}
+
+
+@pytest.mark.parametrize('use_inotify', [False, True])
+def test_watcher_reports_changed_files(tmp_path, use_inotify):
+    data_file = os.path.join(tmp_path, 'Resultate_EID_20230618.xlsx')
+    with open(data_file, 'wb') as f:
+        f.write(b'first')
+    with open(os.path.join(tmp_path, 'notes.txt'), 'w') as f:
+        f.write('not watched')
+    watcher = watch.FileWatcher(str(tmp_path), watch.DATA_FILE_PATTERNS, poll_interval=0.05, settle_seconds=0.05,
+                                use_inotify=use_inotify)
+    assert list(watcher.stats) == ['Resultate_EID_20230618.xlsx']
+    assert watcher.wait() == {}
+    with open(data_file, 'wb') as f:
+        f.write(b'second version')
+    with open(os.path.join(tmp_path, 'notes.txt'), 'w') as f:
+        f.write('changed, but not watched')
+    changed = watcher.wait()
+    assert list(changed) == ['Resultate_EID_20230618.xlsx']
+    assert changed['Resultate_EID_20230618.xlsx'][1] == len(b'second version')
+    assert watcher.wait() == {}
+
+
+def test_latency_is_recorded(tmp_path):
+    metrics_file = os.path.join(tmp_path, 'latency.jsonl')
+    changed_files = {'Resultate_EID_20230618.xlsx': (1000.0, 10), 'Resultate_KAN_20230618.xlsx': (1002.0, 10)}
+    watch.record_latency(metrics_file, 'details_test', 3, changed_files, detected_at=1003.5, pushed_at=1004.25)
+    with open(metrics_file) as f:
+        entry = json.loads(f.readline())
+    assert entry['latency_seconds'] == 2.25
+    assert entry['detection_seconds'] == 1.5
+    assert entry['processing_seconds'] == 0.75
+    assert entry['files'] == sorted(changed_files)
+
+
+class FakeWatcher:
+    """Reports a change of control.csv in the third round, nothing in all others."""
+
+    def __init__(self, *args, **kwargs):
+        self.rounds = 0
+
+    def wait(self):
+        self.rounds += 1
+        return {watch.CONTROL_FILE: (1000.0, 10)} if self.rounds == 3 else {}
+
+
+def test_watch_keeps_running_after_errors(monkeypatch, tmp_path):
+    now = pd.Timestamp.now(tz='UTC')
+    controls = [now + pd.Timedelta(hours=1), now - pd.Timedelta(hours=1)]
+    processed = []
+
+    def read_active_abstimmungen():
+        return pd.DataFrame({'Active': [True], 'Ignore_changes_after': [controls.pop(0)]})
+
+    def process_changes(*args):
+        processed.append(args)
+        if len(processed) == 1:
+            raise RuntimeError('Push failed after all retries')
+
+    monkeypatch.setattr(watch, 'FileWatcher', FakeWatcher)
+    monkeypatch.setattr(watch, 'get_state_path', lambda: str(tmp_path))
+    monkeypatch.setattr(watch.etl, 'read_active_abstimmungen', read_active_abstimmungen)
+    monkeypatch.setattr(watch.etl, 'check_embargos', lambda active_abst, size: (True, False))
+    monkeypatch.setattr(watch.etl, 'find_data_files_for_active_abst', lambda active_abst: [])
+    monkeypatch.setattr(watch, 'process_changes', process_changes)
+    # Ends once the control file read again in the third round has Ignore_changes_after in the past
+    watch.watch()
+    assert len(processed) == 2
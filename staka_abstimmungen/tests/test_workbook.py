@@ -0,0 +1,49 @@
+import datetime
+import os
+import openpyxl
+import pandas as pd
+from staka_abstimmungen.src import workbook
+
+
+def write_result_file(path, ja=1200):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'DAT 1'
+    ws.append(['Staatskanzlei Basel-Stadt'])
+    ws.append([])
+    ws.append([None, 'Eidgenössische Volksabstimmung vom 18. Juni 2023'] + [None] * 6 + ['Schlussresultate'])
+    ws.append([])
+    ws.append([None, '1) Vorlage «Titel»'])
+    ws.append([None, None, 'Stimm-', 'Stimmzettel'])
+    ws.append([None, 'Wahllokale', None, 'eingelegte', 'leere', 'ungültige', 'Total gültige', 'Ja', 'Nein'])
+    ws.append([None, 'Bahnhof SBB', 4000, 2100, 10, 5, 2085, ja, 885])
+    ws.append([None, 'Rathaus', 3000, 1500, None, 2, 1498, 700.5, 798])
+    ws.append([])
+    ws.append([None, 'Stand: ', datetime.datetime(2023, 6, 18, 14, 5)])
+    ws = wb.create_sheet('Abstimmungs-Kennzahlen')
+    ws.append([None, None, 'Stimmberechtigte', 'Stimmbeteiligung'])
+    ws.append([None, 'Basel', 100000, 0.45])
+    wb.save(path)
+
+
+def test_read_sheet_as_read_excel(tmp_path):
+    file_name = os.path.join(tmp_path, 'Resultate_EID_20230618.xlsx')
+    write_result_file(file_name)
+    wb = workbook.Workbook(file_name)
+    assert wb.sheet_names == ['DAT 1', 'Abstimmungs-Kennzahlen']
+    for sheet_name in wb.sheet_names:
+        for skiprows in [None, 2, 4, 6]:
+            expected = pd.read_excel(file_name, sheet_name=sheet_name, skiprows=skiprows, index_col=None)
+            pd.testing.assert_frame_equal(wb.read_sheet(sheet_name, skiprows=skiprows), expected)
+
+
+def test_workbook_is_parsed_again_if_changed(tmp_path):
+    file_name = os.path.join(tmp_path, 'Resultate_EID_20230618.xlsx')
+    write_result_file(file_name)
+    wb = workbook.load_workbook(file_name)
+    assert workbook.load_workbook(file_name) is wb
+    write_result_file(file_name, ja=1300)
+    os.utime(file_name, ns=(0, os.stat(file_name).st_mtime_ns + 1))
+    wb_changed = workbook.load_workbook(file_name)
+    assert wb_changed is not wb
+    assert wb_changed.read_sheet('DAT 1', skiprows=6)['Ja'].iloc[0] == 1300
@@ -71,7 +71,7 @@ def get_content_from_xml(url):
         root = ET.fromstring(xml_content)
         content = root.find('content')
         attachments = root.find('attachments')
-    except requests.exceptions.HTTPError as err:
+    except (requests.exceptions.HTTPError, common.HttpNotFoundError) as err:
         logging.error(f"HTTP error occurred: {err}")
         return None, None
     return content, attachments
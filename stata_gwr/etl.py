@@ -1,60 +1,171 @@
+import json
 import logging
 import os
 import zipfile
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import common
-import common.change_tracking as ct
 import ods_publish.etl_id as odsp
 from stata_gwr import credentials
 
+ZIP_URL = 'https://public.madd.bfs.admin.ch/bs.zip'
+CODES_FILE = 'kodes_codes_codici.csv'
+GEB = {'filename': 'gebaeude_batiment_edificio{}.csv',
+       'to_decode': ['GKSCE', 'GSTAT', 'GKAT', 'GKLAS', 'GBAUP', 'GVOLNORM', 'GVOLSCE', 'GSCHUTZR', 'GWAERZH1', 'GENH1',
+                     'GWAERSCEH1', 'GWAERZH2', 'GENH2', 'GWAERSCEH2', 'GWAERZW1', 'GENW1', 'GWAERSCEW1', 'GWAERZW2',
+                     'GENW2', 'GWAERSCEW2'],
+       'ods_id': '100230'}
+DOM = {'filename': 'eingang_entree_entrata{}.csv',
+       'to_decode': ['STRSP', 'STROFFIZIEL', 'DOFFADR'],
+       'ods_id': '100231'}
+WHG = {'filename': 'wohnung_logement_abitazione{}.csv',
+       'to_decode': ['WSTWK', 'WMEHRG', 'WSTAT', 'WKCHE'],
+       'ods_id': '100232'}
+ALL_ENTITIES = [GEB, DOM, WHG]
+
+DECODED_COL_APPENDIX = '_DECODED'
+DECODED_FILE_APPENDIX = '_bs'  # with empty string, this overwrites original files. Use 'decoded' or similar to create new files
+# The default na_values of pandas.read_csv, so that the files are read as with pd.read_table(dtype=str)
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
+             'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+# Bytes of the entity files parsed at once, the decoded files are written one such block after the other
+READ_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+class CodeDecoder:
+    """
+    Decodes GWR code columns to their German text using the BFS code list (kodes_codes_codici.csv).
+
+    Coded columns are categoricals, only their categories are looked up and the codes of the rows are remapped
+    with one numpy take, so the work on strings depends on the number of distinct codes, not on the number of rows.
+    """
+
+    def __init__(self, codes: pd.DataFrame):
+        # Like a dict built from the code list, the last text of a code wins
+        codes = codes.drop_duplicates(subset='CECODID', keep='last')
+        self.code_map = pd.Series(codes.CODTXTLD.values, index=codes.CECODID.values)
+
+    @classmethod
+    def from_file(cls, f) -> 'CodeDecoder':
+        return cls(pd.read_table(f, dtype=str, usecols=['CECODID', 'CODTXTLD']))
+
+    def decode(self, values: pd.Series) -> pd.Series:
+        """Returns the texts of the codes in values as categorical, missing for unknown or empty codes."""
+        values = values.astype('category')
+        texts = values.cat.categories.map(self.code_map)
+        decoded_categories = pd.Index(texts.dropna().unique())
+        new_codes = np.append(decoded_categories.get_indexer(texts), -1)
+        # Missing values have the code -1, which takes the -1 appended to new_codes
+        codes = new_codes[values.cat.codes.to_numpy()]
+        return pd.Series(pd.Categorical.from_codes(codes, categories=decoded_categories), index=values.index,
+                         name=values.name)
+
+
+def get_data_orig_path() -> str:
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data_orig')
+
+
+def get_data_path() -> str:
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
+
+
+def get_member_crcs(zip_file_path) -> dict:
+    """Returns the CRC-32 and size of each member, as stored in the central directory of the zip file."""
+    with zipfile.ZipFile(zip_file_path) as z:
+        return {info.filename: [info.CRC, info.file_size] for info in z.infolist()}
+
+
+def load_processed_crcs(state_file) -> dict:
+    """Returns the member CRCs of the entities processed successfully, keyed by the member of the entity."""
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r') as f:
+        return json.load(f)
+
+
+def save_processed_crcs(state_file, crcs):
+    common.write_json_atomic(state_file, crcs)
+
+
+def get_entity_crcs(entity, member_crcs) -> list:
+    # The decoded files depend on the codes as well
+    return [member_crcs.get(entity['filename'].format('')), member_crcs.get(CODES_FILE)]
+
+
+def get_changed_entities(member_crcs, processed_crcs) -> list:
+    return [entity for entity in ALL_ENTITIES
+            if processed_crcs.get(entity['filename'].format('')) != get_entity_crcs(entity, member_crcs)]
+
+
+def open_entity_reader(f, entity) -> pa_csv.CSVStreamingReader:
+    """Opens a streaming reader of the entity file f, the coded columns are read as dictionaries."""
+    columns = f.readline().decode('utf-8-sig').rstrip('\r\n').split('\t')
+    f.seek(0)
+    column_types = {column: pa.string() for column in columns}
+    column_types.update({column: pa.dictionary(pa.int32(), pa.string()) for column in entity['to_decode']})
+    return pa_csv.open_csv(f,
+                           read_options=pa_csv.ReadOptions(block_size=READ_BLOCK_SIZE),
+                           parse_options=pa_csv.ParseOptions(delimiter='\t'),
+                           convert_options=pa_csv.ConvertOptions(column_types=column_types, null_values=NA_VALUES,
+                                                                 strings_can_be_null=True))
+
+
+def decode_entity(z, entity, decoder) -> str:
+    """
+    Reads the entity from the zip file block by block, adds the decoded columns after the coded ones and appends
+    each block to the exported file, so only one block is held in memory. Returns the path of the exported file.
+    """
+    export_file_path = os.path.join(get_data_path(), entity['filename'].format(DECODED_FILE_APPENDIX))
+    rows = 0
+    entity_file = entity['filename'].format('')
+    with z.open(entity_file) as f_entity, open(export_file_path, 'w', encoding='utf-8', newline='') as f:
+        reader = open_entity_reader(f_entity, entity)
+        header = True
+        for batch in reader:
+            ent = batch.to_pandas()
+            for var in entity['to_decode']:
+                ent.insert(ent.columns.get_loc(var) + 1, var + DECODED_COL_APPENDIX, decoder.decode(ent[var]))
+            ent.to_csv(f, index=False, sep='\t', header=header)
+            header = False
+            rows += len(ent)
+        if header:
+            columns = []
+            for column in reader.schema.names:
+                columns += [column, column + DECODED_COL_APPENDIX] if column in entity['to_decode'] else [column]
+            pd.DataFrame(columns=columns).to_csv(f, index=False, sep='\t')
+    logging.info(f'Exported {rows} decoded rows to {export_file_path}...')
+    return export_file_path
+
 
 def main():
-    GEB = {'filename': 'gebaeude_batiment_edificio{}.csv',
-           'to_decode': ['GKSCE', 'GSTAT', 'GKAT', 'GKLAS', 'GBAUP', 'GVOLNORM', 'GVOLSCE', 'GSCHUTZR', 'GWAERZH1', 'GENH1',
-                         'GWAERSCEH1', 'GWAERZH2', 'GENH2', 'GWAERSCEH2', 'GWAERZW1', 'GENW1', 'GWAERSCEW1', 'GWAERZW2',
-                         'GENW2', 'GWAERSCEW2']}
-    DOM = {'filename': 'eingang_entree_entrata{}.csv',
-           'to_decode': ['STRSP', 'STROFFIZIEL', 'DOFFADR']}
-    WHG = {'filename': 'wohnung_logement_abitazione{}.csv',
-           'to_decode': ['WSTWK', 'WMEHRG', 'WSTAT', 'WKCHE']}
-
-    all_entities = [GEB, DOM, WHG]
-
-    DECODED_COL_APPENDIX = '_DECODED'
-    DECODED_FILE_APPENDIX = '_bs'  # with empty string, this overwrites original files. Use 'decoded' or similar to create new files
-
-    r = common.requests_get('https://public.madd.bfs.admin.ch/bs.zip')
-    r.raise_for_status()
-    data_orig_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data_orig')
-    zip_folder = 'bs'
-    zip_file_path = os.path.join(data_orig_path, f'{zip_folder}.zip')
-    with open(zip_file_path, "wb") as f:
-        f.write(r.content)
-    if ct.has_changed(zip_file_path):
-        with zipfile.ZipFile(zip_file_path) as z:
-            z.extractall(os.path.join(data_orig_path, zip_folder))
-        codes = pd.read_table(os.path.join(data_orig_path, zip_folder, 'kodes_codes_codici.csv'), dtype=str)
-        code_map = pd.Series(codes.CODTXTLD.values, index=codes.CECODID).to_dict()
+    zip_file_path = os.path.join(get_data_orig_path(), 'bs.zip')
+    state_file = os.path.join(get_data_orig_path(), 'bs_processed_crcs.json')
+    # The archive is streamed to disk, and not transferred at all if the server reports that it did not change
+    if not common.requests_download(ZIP_URL, zip_file_path):
+        logging.info(f'{ZIP_URL} did not change since the last download...')
+
+    # Entities are compared using the CRCs of the central directory, so only the CSV files that changed are decoded
+    member_crcs = get_member_crcs(zip_file_path)
+    processed_crcs = load_processed_crcs(state_file)
+    changed_entities = get_changed_entities(member_crcs, processed_crcs)
+    logging.info(f'{len(changed_entities)} of {len(ALL_ENTITIES)} entities changed: '
+                 f'{[entity["filename"].format("") for entity in changed_entities]}')
+    if not changed_entities:
+        return
+
+    with zipfile.ZipFile(zip_file_path) as z:
+        with z.open(CODES_FILE) as f:
+            decoder = CodeDecoder.from_file(f)
         logging.info(f'Adding decoded columns to datasets...')
-        data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
-        exported_files = []
-        for entity in all_entities:
-            ent = pd.read_table(os.path.join(data_orig_path, zip_folder, entity['filename'].format('')), dtype=str)
-            for var in entity['to_decode']:
-                ent.insert(ent.columns.get_loc(var) + 1, var + DECODED_COL_APPENDIX, '')
-                ent[var + DECODED_COL_APPENDIX] = ent[var].map(code_map)
-            export_file_path = os.path.join(data_path, entity['filename'].format(DECODED_FILE_APPENDIX))
-            ent.to_csv(export_file_path, index=False, sep='\t')
-            exported_files.append(export_file_path)
-        for filename in os.listdir(data_path):
-            file_path = os.path.join(data_path, filename)
-            if os.path.isfile(file_path) and '.csv' in file_path and ct.has_changed(file_path):
-                common.upload_ftp(file_path, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass, f'gwr/opendata_export')
-        ods_ids = ['100230', '100231', '100232']
-        for ods_id in ods_ids:
-            odsp.publish_ods_dataset_by_id(ods_id)
-        ct.update_hash_file(zip_file_path)
-    pass
+        for entity in changed_entities:
+            export_file_path = decode_entity(z, entity, decoder)
+            common.upload_ftp(export_file_path, credentials.ftp_server, credentials.ftp_user, credentials.ftp_pass,
+                              f'gwr/opendata_export')
+            odsp.publish_ods_dataset_by_id(entity['ods_id'])
+            processed_crcs[entity['filename'].format('')] = get_entity_crcs(entity, member_crcs)
+            save_processed_crcs(state_file, processed_crcs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+import os
+import resource
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+import numpy as np
+import pandas as pd
+from stata_gwr import etl
+
+ENTITY = etl.GEB
+# Uncoded columns added to the buildings, the national file has about as many
+OTHER_COLUMNS = [f'COL{i}' for i in range(20)]
+
+
+def write_archive(path, rows):
+    """Writes a zip like bs.zip with a code list and a synthetic buildings file of the given number of rows."""
+    rng = np.random.default_rng(0)
+    code_ids = np.arange(1000, 9000)
+    codes = pd.DataFrame({'CECODID': code_ids.astype(str), 'CODTXTLD': [f'Text des Codes {c}' for c in code_ids]})
+    df = pd.DataFrame({'EGID': np.arange(rows).astype(str)})
+    for i, column in enumerate(ENTITY['to_decode']):
+        # Few distinct codes per column, some of them empty, as in the real files
+        values = rng.choice(code_ids[i * 20:i * 20 + 20], rows).astype(str)
+        df[column] = np.where(rng.random(rows) < 0.2, '', values)
+    for column in OTHER_COLUMNS:
+        df[column] = rng.integers(0, 10 ** 6, rows).astype(str)
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr(etl.CODES_FILE, codes.to_csv(index=False, sep='\t'))
+        z.writestr(ENTITY['filename'].format(''), df.to_csv(index=False, sep='\t'))
+
+
+def decode_legacy(z, data_path):
+    """The previous implementation: the whole file as strings, every coded column mapped with a dict."""
+    codes = pd.read_table(z.open(etl.CODES_FILE), dtype=str)
+    code_map = pd.Series(codes.CODTXTLD.values, index=codes.CECODID).to_dict()
+    ent = pd.read_table(z.open(ENTITY['filename'].format('')), dtype=str)
+    for var in ENTITY['to_decode']:
+        ent.insert(ent.columns.get_loc(var) + 1, var + etl.DECODED_COL_APPENDIX, '')
+        ent[var + etl.DECODED_COL_APPENDIX] = ent[var].map(code_map)
+    ent.to_csv(os.path.join(data_path, 'legacy.csv'), index=False, sep='\t')
+
+
+def decode_streaming(z, data_path):
+    with mock.patch.object(etl, 'get_data_path', lambda: data_path):
+        etl.decode_entity(z, ENTITY, etl.CodeDecoder.from_file(z.open(etl.CODES_FILE)))
+
+
+def run(mode, zip_path, data_path) -> tuple:
+    """Runs in a fresh process, so that the peak memory only includes this mode."""
+    start = time.perf_counter()
+    with zipfile.ZipFile(zip_path) as z:
+        {'legacy': decode_legacy, 'streaming': decode_streaming}[mode](z, data_path)
+    return time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(rows=2500000):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        zip_path = os.path.join(tmp_dir, 'bs.zip')
+        write_archive(zip_path, rows)
+        for mode in ['legacy', 'streaming']:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                seconds, peak_mb = executor.submit(run, mode, zip_path, tmp_dir).result()
+            print(f'{mode}: {rows} buildings decoded in {seconds:.2f}s, peak memory {peak_mb:.0f} MB')
+        with open(os.path.join(tmp_dir, 'legacy.csv'), 'rb') as f1, \
+                open(os.path.join(tmp_dir, ENTITY['filename'].format(etl.DECODED_FILE_APPENDIX)), 'rb') as f2:
+            print(f'Outputs identical: {f1.read() == f2.read()}')
+
+
+if __name__ == "__main__":
+    print(f'Executing {__file__}...')
+    main(*[int(arg) for arg in sys.argv[1:]])
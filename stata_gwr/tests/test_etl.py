@@ -0,0 +1,85 @@
+import os
+import shutil
+import zipfile
+import pandas as pd
+import pytest
+from stata_gwr import etl
+
+CODES = 'CECODID\tCODTXTLD\n1001\tcode 1001\n1002\tcode 1002\n'
+
+
+def entity_csv(entity, value):
+    columns = ['EGID'] + entity['to_decode']
+    return '\t'.join(columns) + '\n' + '\t'.join(['1'] + [value] * len(entity['to_decode'])) + '\n'
+
+
+def write_zip(path, values):
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr(etl.CODES_FILE, CODES)
+        for entity, value in zip(etl.ALL_ENTITIES, values):
+            z.writestr(entity['filename'].format(''), entity_csv(entity, value))
+
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    remote_zip = os.path.join(tmp_path, 'remote.zip')
+    calls = {'uploaded': [], 'published': []}
+
+    def download(url, file_name, **kwargs):
+        shutil.copy(remote_zip, file_name)
+        return True
+
+    monkeypatch.setattr(etl, 'get_data_orig_path', lambda: str(tmp_path))
+    monkeypatch.setattr(etl, 'get_data_path', lambda: str(tmp_path))
+    monkeypatch.setattr(etl.common, 'requests_download', download)
+    monkeypatch.setattr(etl.common, 'upload_ftp', lambda file, *args: calls['uploaded'].append(os.path.basename(file)))
+    monkeypatch.setattr(etl.odsp, 'publish_ods_dataset_by_id', lambda ods_id: calls['published'].append(ods_id))
+    return remote_zip, calls
+
+
+def test_only_changed_entities_are_processed(job, tmp_path):
+    remote_zip, calls = job
+    write_zip(remote_zip, ['1001', '1001', '1001'])
+    etl.main()
+    assert calls['published'] == ['100230', '100231', '100232']
+    with open(os.path.join(tmp_path, 'eingang_entree_entrata_bs.csv')) as f:
+        assert f.read().splitlines()[1] == '1\t1001\tcode 1001\t1001\tcode 1001\t1001\tcode 1001'
+
+    calls['published'].clear()
+    etl.main()
+    assert calls['published'] == []
+
+    write_zip(remote_zip, ['1001', '1002', '1001'])
+    etl.main()
+    assert calls['published'] == ['100231']
+    assert calls['uploaded'][-1] == 'eingang_entree_entrata_bs.csv'
+
+
+def test_decode_entity_matches_mapping_of_strings(tmp_path, monkeypatch):
+    monkeypatch.setattr(etl, 'get_data_path', lambda: str(tmp_path))
+    # Small blocks, so that the file is read and written in several parts
+    monkeypatch.setattr(etl, 'READ_BLOCK_SIZE', 64)
+    entity = etl.DOM
+    rows = ['EGID\tSTRSP\tSTRNAME\tSTROFFIZIEL\tDOFFADR']
+    for i in range(50):
+        rows.append(f'{i}\t{1001 + i % 3}\tStrasse "{i}"\t{["", "NA", "1002"][i % 3]}\t{["9999", "1001", "None"][i % 3]}')
+    path = os.path.join(tmp_path, 'bs.zip')
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr(etl.CODES_FILE, CODES + '1002\tduplicate code 1002\n')
+        z.writestr(entity['filename'].format(''), '\n'.join(rows) + '\n')
+
+    with zipfile.ZipFile(path) as z:
+        with z.open(etl.CODES_FILE) as f:
+            decoder = etl.CodeDecoder.from_file(f)
+        with open(etl.decode_entity(z, entity, decoder)) as f:
+            decoded = f.read()
+        # The previous implementation: all columns as strings, decoded with a dict
+        with z.open(etl.CODES_FILE) as f:
+            codes = pd.read_table(f, dtype=str)
+        code_map = pd.Series(codes.CODTXTLD.values, index=codes.CECODID).to_dict()
+        with z.open(entity['filename'].format('')) as f:
+            ent = pd.read_table(f, dtype=str)
+    for var in entity['to_decode']:
+        ent.insert(ent.columns.get_loc(var) + 1, var + etl.DECODED_COL_APPENDIX, ent[var].map(code_map))
+    assert decoded == ent.to_csv(index=False, sep='\t')
+    assert 'duplicate code 1002' in decoded
@@ -8,10 +8,21 @@ sorts these columns by granularity and only considers those with the highest gra
 - If no 'month' fields are present, fields with 'year' granularity are used.
 
 If none of these granularities are present, the process skips the dataset and moves to the next.
+
+The whole catalogue is scanned concurrently, with a limit on the number of requests per second. The oldest and newest
+date of a dataset are retrieved with one aggregate query over all considered columns. Datasets whose 'data_processed'
+timestamp has not changed since the last scan are skipped, the timestamps are kept in data/scan_state.json.
 """
 
+import json
 import logging
-from typing import Optional, Dict, Any
+import os
+import pathlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
+from urllib.parse import urlencode
 from dateutil.relativedelta import relativedelta
 import pandas as pd
 
@@ -20,6 +31,27 @@ from ods_utils_py import _requests_utils
 
 from datetime import datetime
 
+EXPLORE_API_URL = "https://data.bs.ch/api/explore/v2.1"
+AUTOMATION_API_URL = "https://data.bs.ch/api/automation/v1.0"
+
+# (template, field) of the metadata fields set by this job
+TEMPORAL_METADATA_FIELDS = {
+    'temporal_period': ('default', 'temporal_period'),
+    'temporal_coverage_start_date': ('dcat', 'temporal_coverage_start_date'),
+    'temporal_coverage_end_date': ('dcat', 'temporal_coverage_end_date'),
+}
+
+REPORT_COLUMNS = [
+    'dataset_id',
+    'dataset_title',
+    'date_fields_found',
+    'date_fields_considered',
+    'granularity_used',
+    'min_date',
+    'max_date',
+    'status'
+]
+
 
 def _parse_date(date: str, is_min_date: bool) -> Optional[datetime]:
     """
@@ -59,13 +91,38 @@ def _parse_date(date: str, is_min_date: bool) -> Optional[datetime]:
             raise ValueError(f"Date format for '{date}' not recognized")
 
 
-def get_dataset_date_range(dataset_id: str) -> (str, str, Dict[str, Any]):
+def get_relevant_date_columns(data_fields: List[Dict[str, Any]], additional_information: Dict[str, Any]) -> List[str]:
+    """
+    Returns the names of the date or datetime columns with the highest granularity available, and records the fields
+    found and the granularity used in additional_information. Returns an empty list if there are no suitable columns.
+    """
+    datetime_columns = [col for col in data_fields if col.get('type') == 'datetime']
+    date_columns = [col for col in data_fields if col.get('type') == 'date']
+    additional_information["date_fields_found"] = [col['name'] for col in datetime_columns + date_columns]
+
+    if datetime_columns:
+        additional_information["granularity_used"] = "datetime"
+        return [col['name'] for col in datetime_columns]
+
+    for granularity in ['day', 'month', 'year']:
+        relevant_column_names = [col['name'] for col in date_columns
+                                 if col.get('annotations', {}).get('timeserie_precision', '') == granularity]
+        if relevant_column_names:
+            additional_information["granularity_used"] = granularity
+            return relevant_column_names
+    return []
+
+
+def get_dataset_date_range(dataset_id: str, data_fields: Optional[List[Dict[str, Any]]] = None,
+                           rate_limiter: Optional['RateLimiter'] = None) -> (str, str, Dict[str, Any]):
     """
     Find the oldest and newest date in the dataset. This will only consider columns that are of the format datetime or
-    date.
+    date. The minimum and maximum of all considered columns are retrieved with a single aggregate query.
 
     Args:
         dataset_id: The id of the dataset that can be seen in the url of the dataset
+        data_fields: The fields of the dataset as returned by the catalog endpoint, retrieved if not given
+        rate_limiter: If given, each request waits until the rate limiter allows it
 
     Returns:
         A tuple containing:
@@ -77,66 +134,46 @@ def get_dataset_date_range(dataset_id: str) -> (str, str, Dict[str, Any]):
                 - "granularity_used" (str): The granularity level used ("datetime", "day", "month", "year", or "").
                 - "status" (str): Indicates if the process was successful or if there were any issues.
     """
+    rate_limiter = rate_limiter or RateLimiter(requests_per_second=0)
 
-    base_url = "https://data.bs.ch/api/explore/v2.1"
-
-    r = _requests_utils.requests_get(url=f"{base_url}/catalog/datasets/{dataset_id}")
-    r.raise_for_status()
-
-    data_fields = r.json().get("fields")
-
-    datetime_columns = [col for col in data_fields if col.get('type') == 'datetime']
-    date_columns = [col for col in data_fields if col.get('type') == 'date']
+    if data_fields is None:
+        rate_limiter.wait()
+        r = _requests_utils.requests_get(url=f"{EXPLORE_API_URL}/catalog/datasets/{dataset_id}")
+        r.raise_for_status()
+        data_fields = r.json().get("fields")
 
     additional_information: Dict[str, Any] = {
-        "date_fields_found": [col['name'] for col in datetime_columns + date_columns],
+        "date_fields_found": [],
         "date_fields_considered": [],
         "granularity_used": "",
         "status": "No suitable fields found"
     }
 
-    if datetime_columns:
-        relevant_column_names = [col['name'] for col in datetime_columns]
-        additional_information["granularity_used"] = "datetime"
-    elif date_columns:
-        relevant_column_names = [col['name'] for col in date_columns if col.get('annotations', {}).get('timeserie_precision', '') == 'day']
-        additional_information["granularity_used"] = "day"
-
-        if not relevant_column_names:
-            relevant_column_names = [col['name'] for col in date_columns if col.get('annotations', {}).get('timeserie_precision', '') == 'month']
-            additional_information["granularity_used"] = "month"
-
-        if not relevant_column_names:
-            relevant_column_names = [col['name'] for col in date_columns if col.get('annotations', {}).get('timeserie_precision', '') == 'year']
-            additional_information["granularity_used"] = "year"
-
-        if not relevant_column_names:
-            logging.warning(f"No suitable date fields found for dataset {dataset_id}")
-            return None, None, additional_information
-
-    else:
+    relevant_column_names = get_relevant_date_columns(data_fields, additional_information)
+    if not relevant_column_names:
+        logging.warning(f"No suitable date fields found for dataset {dataset_id}")
         return None, None, additional_information
 
     additional_information["date_fields_considered"] = relevant_column_names
 
+    # Aliases instead of the column names, since these might contain characters that are not allowed in an alias
+    select = ','.join(f"min(`{column_name}`) as min_{i},max(`{column_name}`) as max_{i}"
+                      for i, column_name in enumerate(relevant_column_names))
+    rate_limiter.wait()
+    r = _requests_utils.requests_get(
+        url=f"{EXPLORE_API_URL}/catalog/datasets/{dataset_id}/records?{urlencode({'select': select, 'limit': 1})}")
+    r.raise_for_status()
+    results = r.json().get('results', [])
+    aggregates = results[0] if results else {}
+
     min_return_value = None
     max_return_value = None
-    for column_name in relevant_column_names:
-        link_for_min = f"{base_url}/catalog/datasets/{dataset_id}/records?select={column_name}&order_by={column_name}%20ASC&limit=1"
-        link_for_max = f"{base_url}/catalog/datasets/{dataset_id}/records?select={column_name}&order_by={column_name}%20DESC&limit=1"
-        r_min = _requests_utils.requests_get(url=link_for_min)
-        r_min.raise_for_status()
-
-        r_max = _requests_utils.requests_get(url=link_for_max)
-        r_max.raise_for_status()
-
-        try:
-            min_date = r_min.json().get('results', {})[0][column_name]
-            max_date = r_max.json().get('results', {})[0][column_name]
-        except IndexError:
-            return None, None
-
-
+    for i, column_name in enumerate(relevant_column_names):
+        min_date = aggregates.get(f'min_{i}')
+        max_date = aggregates.get(f'max_{i}')
+        if min_date is None or max_date is None:
+            logging.debug(f"Column {column_name} of dataset {dataset_id} contains no dates")
+            continue
 
         min_date_candidate = _parse_date(min_date, is_min_date=True)
         max_date_candidate = _parse_date(max_date, is_min_date=False)
@@ -161,64 +198,154 @@ def get_dataset_date_range(dataset_id: str) -> (str, str, Dict[str, Any]):
     return min_date_str, max_date_str, additional_information
 
 
-def main():
-    # Create an empty DataFrame to store the data for the CSV
-    df = pd.DataFrame(columns=[
-        'dataset_id',
-        'dataset_title',
-        'date_fields_found',
-        'date_fields_considered',
-        'granularity_used',
-        'min_date',
-        'max_date',
-        'status'
-    ])
-
-    #all_dataset_ids: [int] = ods_utils.get_all_dataset_ids()
-
-    for dataset_id in ['100397', '100396', '100014']:#all_dataset_ids:
+class RateLimiter:
+    """Spaces calls of wait() from all threads by at least 1 / requests_per_second seconds, 0 means no limit."""
+
+    def __init__(self, requests_per_second: float):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_until = max(self._next_time, now)
+            self._next_time = wait_until + self.interval
+        time.sleep(wait_until - now)
+
+
+def get_state_file() -> str:
+    curr_dir = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(curr_dir, 'data', 'scan_state.json')
+
+
+class TemporalCoverageScanner:
+    """
+    Scans datasets concurrently and sets their temporal coverage metadata.
+
+    For each dataset the catalog entry is retrieved once, it contains the fields, the title and the 'data_processed'
+    timestamp. If the timestamp is the same as in the last successful scan, the dataset is skipped and the row of the
+    last scan is reported. Otherwise the date range is determined with one aggregate query, and the three temporal
+    coverage fields are written with one metadata update, followed by a publish, only if one of them changed.
+    """
+
+    def __init__(self, state_file='', max_workers=8, requests_per_second=5):
+        self.state_file = state_file or get_state_file()
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self._lock = threading.Lock()
+        # dataset id -> {'data_processed': timestamp, 'row': report row of the last scan}
+        self.state = {}
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r') as f:
+                self.state = json.load(f)
+
+    def scan(self, dataset_ids) -> pd.DataFrame:
+        """Scans all datasets and returns the report with one row per dataset."""
+        dataset_ids = list(dict.fromkeys(str(dataset_id) for dataset_id in dataset_ids))
+        logging.info(f"Scanning {len(dataset_ids)} datasets with {self.max_workers} workers...")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            rows = list(executor.map(self.scan_dataset, dataset_ids))
+        return pd.DataFrame(rows, columns=REPORT_COLUMNS)
+
+    def scan_dataset(self, dataset_id: str) -> Dict[str, Any]:
         logging.info(f"Processing dataset {dataset_id}")
-        dataset_title = ods_utils.get_dataset_title(dataset_id=dataset_id)
-
-        logging.info(f"Trying to retrieve oldest and newest date in the dataset {dataset_id}")
-        min_date, max_date, additional_info = get_dataset_date_range(dataset_id=dataset_id)
-        logging.info(f"Found dates in dataset {dataset_id} from {min_date} to {max_date}")
-
-        new_row = pd.DataFrame({
-            'dataset_id': [dataset_id],
-            'dataset_title': [dataset_title],
-            'date_fields_found': [', '.join(additional_info["date_fields_found"])],
-            'date_fields_considered': [', '.join(additional_info["date_fields_considered"])],
-            'granularity_used': [additional_info["granularity_used"]],
-            'min_date': [min_date],
-            'max_date': [max_date],
-            'status': [additional_info["status"]]
-        })
-
-        df = pd.concat([df, new_row], ignore_index=True)
-
-        if min_date and max_date:
+        try:
+            self.rate_limiter.wait()
+            r = _requests_utils.requests_get(url=f"{EXPLORE_API_URL}/catalog/datasets/{dataset_id}")
+            r.raise_for_status()
+            dataset = r.json()
+            default_metas = dataset.get('metas', {}).get('default', {})
+            data_processed = default_metas.get('data_processed')
+
+            previous = self.state.get(dataset_id)
+            if data_processed and previous and previous['data_processed'] == data_processed:
+                logging.info(f"Dataset {dataset_id} has not been processed since the last scan, skipping it")
+                return previous['row']
+
+            logging.info(f"Trying to retrieve oldest and newest date in the dataset {dataset_id}")
+            min_date, max_date, additional_info = get_dataset_date_range(
+                dataset_id=dataset_id, data_fields=dataset.get('fields', []), rate_limiter=self.rate_limiter)
+            logging.info(f"Found dates in dataset {dataset_id} from {min_date} to {max_date}")
+
+            if min_date and max_date:
+                self.set_temporal_coverage(dataset['dataset_uid'], min_date, max_date)
+            else:
+                logging.warning(f"Skipping metadata update for dataset {dataset_id} due to missing date range.")
+
+            row = {
+                'dataset_id': dataset_id,
+                'dataset_title': default_metas.get('title'),
+                'date_fields_found': ', '.join(additional_info["date_fields_found"]),
+                'date_fields_considered': ', '.join(additional_info["date_fields_considered"]),
+                'granularity_used': additional_info["granularity_used"],
+                'min_date': min_date,
+                'max_date': max_date,
+                'status': additional_info["status"]
+            }
+        except Exception as e:
+            # The dataset is not recorded in the state, so that it is scanned again next time
+            logging.exception(f"Dataset {dataset_id} could not be processed")
+            return {'dataset_id': dataset_id, 'status': f"Error: {e}"}
+
+        if data_processed:
+            self.save_state(dataset_id, data_processed, row)
+        logging.info(f"Dataset {dataset_id} process finished")
+        return row
+
+    def set_temporal_coverage(self, dataset_uid: str, min_date: str, max_date: str) -> bool:
+        """
+        Sets the temporal coverage fields with one update of the dataset metadata and publishes the dataset.
+        Does nothing if all fields already have the given values. Returns whether the metadata was updated.
+        """
+        values = {
             # ISO 8601 standard for date ranges is "YYYY-MM-DD/YYYY-MM-DD"; we implement this here
-            ods_utils.set_dataset_metadata_temporal_period(
-                temporal_period=f"{min_date}/{max_date}",
-                dataset_id=dataset_id,
-                publish=False
-            )
-
-            ods_utils.set_dataset_metadata_temporal_coverage_start_date(
-                temporal_coverage_start_date=min_date,
-                dataset_id=dataset_id,
-                publish=False
-            )
-            ods_utils.set_dataset_metadata_temporal_coverage_end_date(
-                temporal_coverage_end_date=max_date,
-                dataset_id=dataset_id,
-                publish=True
-            )
-        else:
-            logging.warning(f"Skipping metadata update for dataset {dataset_id} due to missing date range.")
+            'temporal_period': f"{min_date}/{max_date}",
+            'temporal_coverage_start_date': min_date,
+            'temporal_coverage_end_date': max_date,
+        }
+        metadata_url = f"{AUTOMATION_API_URL}/datasets/{dataset_uid}/metadata/"
+        self.rate_limiter.wait()
+        r = _requests_utils.requests_get(url=metadata_url)
+        r.raise_for_status()
+        metadata = r.json()
+
+        changed = False
+        for name, value in values.items():
+            template_name, field_name = TEMPORAL_METADATA_FIELDS[name]
+            field = metadata.setdefault(template_name, {}).setdefault(field_name, {})
+            if field.get('value') != value:
+                field['value'] = value
+                field['override_remote_value'] = True
+                changed = True
+        if not changed:
+            logging.info(f"Temporal coverage of dataset {dataset_uid} is already up to date")
+            return False
+
+        self.rate_limiter.wait()
+        r = _requests_utils.requests_put(url=metadata_url, json=metadata)
+        r.raise_for_status()
+        self.rate_limiter.wait()
+        r = _requests_utils.requests_post(url=f"{AUTOMATION_API_URL}/datasets/{dataset_uid}/publish/")
+        r.raise_for_status()
+        return True
+
+    def save_state(self, dataset_id: str, data_processed: str, row: Dict[str, Any]):
+        with self._lock:
+            self.state[dataset_id] = {'data_processed': data_processed, 'row': row}
+            # Not common.write_json_atomic, the image of this job only installs ods_utils_py, not the dependencies of common
+            pathlib.Path(os.path.dirname(self.state_file)).mkdir(parents=True, exist_ok=True)
+            tmp_file = f'{self.state_file}.{os.getpid()}.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(self.state, f, indent=1)
+            os.replace(tmp_file, self.state_file)
 
-        logging.info(f"Dataset {dataset_id} process finished")
+
+def main():
+    all_dataset_ids = ods_utils.get_all_dataset_ids()
+    df = TemporalCoverageScanner().scan(all_dataset_ids)
 
     # Save the DataFrame to a CSV file
     csv_filename = 'update_temporal_coverage_report.csv'
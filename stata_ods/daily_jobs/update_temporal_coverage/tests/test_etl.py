@@ -0,0 +1,81 @@
+from urllib.parse import urlparse, parse_qs
+import pytest
+from stata_ods.daily_jobs.update_temporal_coverage import etl
+
+
+class Response:
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeODS:
+    """Explore and automation API of a catalogue with one daily and one monthly dataset."""
+
+    def __init__(self):
+        self.datasets = {
+            '100001': {'dataset_uid': 'da_1', 'metas': {'default': {'title': 'Daily', 'data_processed': 't1'}},
+                       'fields': [{'name': 'datum', 'type': 'date', 'annotations': {'timeserie_precision': 'day'}},
+                                  {'name': 'monat', 'type': 'date', 'annotations': {'timeserie_precision': 'month'}},
+                                  {'name': 'wert', 'type': 'double'}]},
+            '100002': {'dataset_uid': 'da_2', 'metas': {'default': {'title': 'Monthly', 'data_processed': 't1'}},
+                       'fields': [{'name': 'von', 'type': 'date', 'annotations': {'timeserie_precision': 'month'}},
+                                  {'name': 'bis', 'type': 'date', 'annotations': {'timeserie_precision': 'month'}}]},
+        }
+        self.aggregates = {
+            '100001': {'min_0': '2020-01-05', 'max_0': '2024-03-31'},
+            '100002': {'min_0': '2016-05', 'max_0': '2018-01', 'min_1': '2016-06', 'max_1': '2018-02'},
+        }
+        self.metadata = {'da_1': {}, 'da_2': {}}
+        self.requests = []
+
+    def requests_get(self, url):
+        self.requests.append(('get', url))
+        parsed = urlparse(url)
+        parts = parsed.path.strip('/').split('/')
+        if parts[-1] == 'records':
+            assert parse_qs(parsed.query)['limit'] == ['1']
+            return Response({'results': [self.aggregates[parts[-2]]]})
+        if parts[-1] == 'metadata':
+            return Response(self.metadata[parts[-2]])
+        return Response(self.datasets[parts[-1]])
+
+    def requests_put(self, url, json):
+        self.requests.append(('put', url))
+        self.metadata[url.strip('/').split('/')[-2]] = json
+        return Response({})
+
+    def requests_post(self, url):
+        self.requests.append(('post', url))
+        return Response({})
+
+
+@pytest.fixture
+def fake_ods(monkeypatch):
+    ods = FakeODS()
+    for name in ['requests_get', 'requests_put', 'requests_post']:
+        monkeypatch.setattr(etl._requests_utils, name, getattr(ods, name))
+    return ods
+
+
+def test_scan_sets_metadata_once_and_skips_unchanged_datasets(fake_ods, tmp_path):
+    state_file = str(tmp_path / 'scan_state.json')
+    df = etl.TemporalCoverageScanner(state_file=state_file, requests_per_second=0).scan(['100001', '100002'])
+    assert df[['min_date', 'max_date']].values.tolist() == [['2020-01-05', '2024-03-31'], ['2016-05-01', '2018-02-28']]
+    assert df['date_fields_considered'].tolist() == ['datum', 'von, bis']
+    assert fake_ods.metadata['da_2']['dcat']['temporal_coverage_end_date']['value'] == '2018-02-28'
+    assert fake_ods.metadata['da_2']['default']['temporal_period']['value'] == '2016-05-01/2018-02-28'
+    assert [method for method, url in fake_ods.requests if 'da_1' in url] == ['get', 'put', 'post']
+    assert len([url for method, url in fake_ods.requests if '/records?' in url]) == 2
+
+    # Only the dataset that was processed again is scanned, its date range did not change
+    fake_ods.requests = []
+    fake_ods.datasets['100002']['metas']['default']['data_processed'] = 't2'
+    df_again = etl.TemporalCoverageScanner(state_file=state_file, requests_per_second=0).scan(['100001', '100002'])
+    assert df_again.equals(df)
+    assert [method for method, url in fake_ods.requests] == ['get', 'get', 'get', 'get']
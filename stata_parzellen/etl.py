@@ -1,10 +1,10 @@
 import os
-from io import StringIO
 import pandas as pd
 import logging
 import common.change_tracking as ct
 import ods_publish.etl_id as odsp
 import common
+from common import reference_data
 from stata_parzellen import credentials
 
 
@@ -14,15 +14,11 @@ def main():
     if ct.has_changed(parzellen_data_file):
         logging.info(f'Reading data from 4 datasets...')
         df = pd.read_csv(parzellen_data_file, dtype={'WOV_ID': 'str', 'BEZ_ID': 'str', 'BLO_ID': 'str'})
-        df_wohnviertel = common.pandas_read_csv(
-            StringIO(common.requests_get('https://data.bs.ch/explore/dataset/100042/download/?format=csv').text),
-            sep=';', dtype={'wov_id': 'str'})[['wov_id', 'wov_label', 'wov_name', 'gemeinde_name']]
-        df_bezirk = common.pandas_read_csv(
-            StringIO(common.requests_get('https://data.bs.ch/explore/dataset/100039/download/?format=csv').text),
-            sep=';', dtype={'bez_id': 'str'})[['bez_id', 'bez_label', 'bez_name']]
-        df_block = common.pandas_read_csv(
-            StringIO(common.requests_get('https://data.bs.ch/explore/dataset/100040/download/?format=csv').text),
-            sep=';', dtype={'blo_id': 'str'})[['blo_id', 'blo_label']]
+        # Reference datasets are shared local snapshots, downloaded again only if they changed, see common.reference_data
+        df_wohnviertel = reference_data.get_dataset('100042', dtype={'wov_id': 'str'},
+                                                    columns=['wov_id', 'wov_label', 'wov_name', 'gemeinde_name'])
+        df_bezirk = reference_data.get_dataset('100039', dtype={'bez_id': 'str'}, columns=['bez_id', 'bez_label', 'bez_name'])
+        df_block = reference_data.get_dataset('100040', dtype={'blo_id': 'str'}, columns=['blo_id', 'blo_label'])
         logging.info(f'Merging datasets...')
         df_export = (df.merge(df_wohnviertel, left_on='WOV_ID', right_on='wov_id', how='left')
                      .merge(df_bezirk, left_on='BEZ_ID', right_on='bez_id', how='left')
@@ -14,6 +14,7 @@ import geopandas as gpd
 from shapely.geometry import Point
 
 import common
+from common import reference_data
 import common.change_tracking as ct
 import ods_publish.etl_id as odsp
 from zefix_handelsregister import credentials
@@ -50,24 +51,20 @@ def create_diff_files(path_to_new):
     path_to_last = os.path.join(pathlib.Path(__file__).parents[0], 'data', 'handelsregister_last_version.csv')
     if os.path.exists(path_to_last):
         df_last = pd.read_csv(path_to_last)
-        # Find new rows if any
-        new_rows = ct.find_new_rows(df_last, df_new, 'company_uid')
+        # Find new, modified and deleted rows in one pass
+        diff = ct.diff_frames(df_last, df_new, 'company_uid')
         path_export = os.path.join(pathlib.Path(__file__).parents[0], 'data', 'diff_files',
                                    f'handelsregister_new_{datetime.date.today()}.csv')
-        upload_rows_to_ftp(new_rows, path_export)
-        # Find modified rows if any
-        deprecated_rows, updated_rows = ct.find_modified_rows(df_last, df_new, 'company_uid')
+        upload_rows_to_ftp(diff.new_rows, path_export)
         path_export = os.path.join(pathlib.Path(__file__).parents[0], 'data', 'diff_files',
                                    f'handelsregister_deprecated_{datetime.date.today()}.csv')
-        upload_rows_to_ftp(deprecated_rows, path_export)
+        upload_rows_to_ftp(diff.deprecated_rows, path_export)
         path_export = os.path.join(pathlib.Path(__file__).parents[0], 'data', 'diff_files',
                                    f'handelsregister_updated_{datetime.date.today()}.csv')
-        upload_rows_to_ftp(updated_rows, path_export)
-        # Find deleted rows if any
-        deleted_rows = ct.find_deleted_rows(df_last, df_new, 'company_uid')
+        upload_rows_to_ftp(diff.updated_rows, path_export)
         path_export = os.path.join(pathlib.Path(__file__).parents[0], 'data', 'diff_files',
                                    f'handelsregister_deleted_{datetime.date.today()}.csv')
-        upload_rows_to_ftp(deleted_rows, path_export)
+        upload_rows_to_ftp(diff.deleted_rows, path_export)
     # Save new version of the file as the last version
     df_new.to_csv(path_to_last, index=False)
 
@@ -186,12 +183,8 @@ def get_data_of_all_cantons():
 
 
 def get_gebaeudeeingaenge():
-    raw_data_file = os.path.join(pathlib.Path(__file__).parent, 'data', 'gebaeudeeingaenge.csv')
-    logging.info(f'Downloading Gebäudeeingänge from ods to file {raw_data_file}...')
-    r = common.requests_get(f'https://data.bs.ch/api/records/1.0/download?dataset=100231')
-    with open(raw_data_file, 'wb') as f:
-        f.write(r.content)
-    return pd.read_csv(raw_data_file, sep=';')
+    logging.info(f'Getting Gebäudeeingänge from the local snapshot of ods dataset 100231...')
+    return reference_data.get_dataset('100231')
 
 
 def get_coordinates_from_gwr(df, df_geb_eing):